@@ -8,7 +8,7 @@ This is a central communication hub between Python codes and web UI
 
 import os, sys, uuid, json
 import webbrowser, urlparse
-from time import sleep
+from time import sleep, time
 from multiprocessing import Queue, Manager, cpu_count
 
 from PySide.QtCore import QObject, Slot, Signal
@@ -16,16 +16,28 @@ from PySide.QtGui import QMessageBox, QInputDialog, QLineEdit
 
 from classes import Pools
 from ui import AddPoolDialog
-from miner.miner import MinerWork, MinerRPC
-from settings import APP_NAME, DATA_DIR
+from miner.miner import MinerRPC, POOLED_WORKER_ENGINES, RPC_ENGINES
+from miner.shared import JobSlot, HashCounters, ShareChannel
+from miner.topology import worker_cpu, SCRATCHPAD_SIZE, SCRATCHPAD_SIZE_LIGHT
+from miner.failover import FailoverGroup
+from miner.scheduler import CpuScheduler
+from miner.supervisor import WorkerSupervisor
+from miner.workerpool import WorkerPool
+from miner.tuner import profile_threads
+from settings import APP_NAME, DATA_DIR, HASHING_ALGO, OPT_CPU_PLACEMENT, OPT_RPC_ENGINE, \
+                        OPT_FAILOVER_DELAY, OPT_FAILBACK_DELAY, OPT_WORKER_HANG_TIMEOUT, \
+                        OPT_WORKER_RESTART_DELAY_MIN, OPT_WORKER_RESTART_DELAY_MAX, OPT_STOP_TIMEOUT, \
+                        WORKER_ENGINE_TYPES
 from ui import LogViewer
-from utils.logger import log, LEVEL_ERROR
+from utils.logger import log, LEVEL_ERROR, LEVEL_INFO
 from utils.common import smart_strip
 
 CPU_COUNT = cpu_count()
 
-def get_num_cpus():
-    return CPU_COUNT
+def get_cpu_budget(hardware_profile):
+    """ most workers mining at once over all pools: the tuned worker count 
+    (`miner_cli.py --tune`) of the heaviest tuned algo, else all CPUs """
+    return max(profile_threads(hardware_profile, algo, CPU_COUNT) for algo in HASHING_ALGO)
 
 import psutil
 if sys.platform == 'win32':
@@ -53,6 +65,13 @@ def get_cpu_priority_level(priority_level):
         cpu_priority_level = VERY_HIGH_CPU_PRIORITY_LEVEL
     return cpu_priority_level
 
+def get_worker_cpu(pool_info, thr_id):
+    """ logical CPU to pin a pool's worker to, None to let the OS decide """
+    if not OPT_CPU_PLACEMENT:
+        return None
+    is_cryptolite = pool_info['algo'] == "Cryptonight-Light"
+    return worker_cpu(thr_id, SCRATCHPAD_SIZE_LIGHT if is_cryptolite else SCRATCHPAD_SIZE)
+
 POOL_SIZE_LIMIT = 10 # number of pools can be added to avoid over screen
 manager = None
 
@@ -62,6 +81,20 @@ class Hub(QObject):
         self.app = app
         self.pools = Pools(self.app.property("AppPath"))
         self.pools.load_all()
+        budget = get_cpu_budget(self.pools.hardware_profile)
+        # workers started once, parked while not mining: starting and stopping 
+        # mining, or moving workers between pools, does not fork processes
+        self.worker_pool = WorkerPool(POOLED_WORKER_ENGINES, get_cpu_priority_level('normal'))
+        for pool_info in self.pools.all_pools:
+            self._pool_lane(pool_info)
+        for engine in set(self._worker_engine(pool_info) for pool_info in self.pools.all_pools):
+            self.worker_pool.prestart(engine, range(budget))
+        # one set of workers for all pools, sharing the CPUs between them
+        self.scheduler = CpuScheduler(budget, OPT_STOP_TIMEOUT, stop=self.worker_pool.park)
+        # restarts crashed or hung workers
+        self.supervisor = WorkerSupervisor(hang_timeout=OPT_WORKER_HANG_TIMEOUT, 
+                                           restart_delay=OPT_WORKER_RESTART_DELAY_MIN, 
+                                           restart_delay_max=OPT_WORKER_RESTART_DELAY_MAX).start()
         
         self.add_pool_dialog = AddPoolDialog(self.app, self, "addpool.html", False)
  
@@ -103,28 +136,15 @@ class Hub(QObject):
         
         """ Else start mining """
         if num_procs == 0:
-            num_procs = get_num_cpus()
+            num_procs = self.pools.default_num_cpus(pool_info['algo'])
         
         global manager
         if not manager: manager = Manager()
         
-        if not 'work_submit_queue' in pool_info:
-            work_submit_queue = Queue()
-            pool_info['work_submit_queue'] = work_submit_queue
-        else:
-            work_submit_queue = pool_info['work_submit_queue']
-        
-        if not 'g_work' in pool_info:
-            g_work = manager.dict()
-            pool_info['g_work'] = g_work
-        else:
-            g_work = pool_info['g_work']
-        
-        if not 'hash_report' in pool_info:
-            hash_report = manager.dict()
-            pool_info['hash_report'] = hash_report
-        else:
-            hash_report = pool_info['hash_report']
+        lane = self._pool_lane(pool_info)
+        work_submit_queue = pool_info['work_submit_queue']
+        g_work = pool_info['g_work']
+        hash_report = pool_info['hash_report']
         
         if not 'work_report' in pool_info:
             work_report = manager.dict()
@@ -132,14 +152,22 @@ class Hub(QObject):
         else:
             work_report = pool_info['work_report']
             
-        cpu_priority_level = get_cpu_priority_level(pool_info['priority_level'])
+        worker_engine = self._worker_engine(pool_info)
+        def spawn(thr_id, slot):
+            # a parked worker, pinned by the scheduler's slot, unique across pools
+            p = self.worker_pool.assign(worker_engine, slot, lane, thr_id, cpu=get_worker_cpu(pool_info, slot))
+            p.set_cpu_priority(get_cpu_priority_level(pool_info['priority_level']))
+            return p
         
         pool_info['thr_list'] = []
-        for thr_id in range(num_procs):
-            p = MinerWork(thr_id, work_submit_queue, g_work, hash_report, get_cpu_priority_level('normal'))
-            p.start()
-            p.set_cpu_priority(cpu_priority_level)
-            pool_info['thr_list'].append(p)
+        self.scheduler.add(pool_info['id'], num_procs, pool_info['thr_list'], spawn, g_work.set_num_thrs, 
+                           log=lambda msg: log(msg, LEVEL_INFO, pool_info['id']))
+        
+        def report_restarts(restarts):
+            work_report['worker_restarts'] = restarts
+        self.supervisor.watch(pool_info['id'], pool_info['thr_list'], hash_report, 
+                              lambda thr_id, old: self.scheduler.replace(pool_info['id'], thr_id, old), 
+                              log=lambda msg: log(msg, LEVEL_ERROR, pool_info['id']), report=report_restarts)
         
         # set main UI process priority to normal level to avoid UI frozen
         psutil.Process().nice(NORMAL_CPU_PRIORITY_LEVEL)
@@ -147,7 +175,19 @@ class Hub(QObject):
         pool_info['num_cpus'] = num_procs
         pool_info['is_mining'] = True
         
-        rpc = MinerRPC(pool_info, work_submit_queue, g_work, work_report)
+        rpc_engine = RPC_ENGINES.get(OPT_RPC_ENGINE, MinerRPC)
+        failover_pools = self._failover_pools(pool_info)
+        if failover_pools:
+            # one connection per pool of the group, each with a copy of its
+            # pool info pointing at its own URL and account
+            member_infos = [dict(pool_info, url=p['url'], username=p['username'] or pool_info['username'], 
+                                 password=p['password'], ssl_enabled=p['ssl_enabled'], error=None)
+                            for p in [pool_info] + failover_pools]
+            members = [rpc_engine(p, work_submit_queue, g_work, work_report) for p in member_infos]
+            rpc = FailoverGroup(members, pool_info, member_infos, OPT_FAILOVER_DELAY, OPT_FAILBACK_DELAY, 
+                                log=lambda msg: log(msg, LEVEL_INFO, pool_info['id']))
+        else:
+            rpc = rpc_engine(pool_info, work_submit_queue, g_work, work_report)
         rpc.set_thread_list(pool_info['thr_list'])
         rpc.daemon = True
         rpc.start()
@@ -156,18 +196,60 @@ class Hub(QObject):
         self.on_start_mining_event.emit(pool_info["id"])
         
     
+    def _pool_lane(self, pool_info):
+        """ the pool's shares queue, job slot and hash counters, as a lane of the worker pool """
+        if not 'work_submit_queue' in pool_info:
+            # the reactor client waits on the channel to send shares right away
+            pool_info['work_submit_queue'] = ShareChannel() if OPT_RPC_ENGINE == 'reactor' else Queue()
+        if not 'g_work' in pool_info:
+            pool_info['g_work'] = JobSlot()
+        if not 'hash_report' in pool_info:
+            pool_info['hash_report'] = HashCounters()
+        return self.worker_pool.add_lane(pool_info['work_submit_queue'], pool_info['g_work'], 
+                                         pool_info['hash_report'])
+    
+    def _worker_engine(self, pool_info):
+        engine = pool_info.get('worker_engine')
+        return engine if engine in POOLED_WORKER_ENGINES else 'process'
+    
+    def _failover_pools(self, pool_info):
+        """ pools to fail over to, in order: configured ones of the same algo """
+        pools = []
+        for pool_id in pool_info.get('failover_pool_ids', []):
+            p = self.pools.find_pool(pool_id)
+            if p is not None and p is not pool_info and p['algo'] == pool_info['algo'] and p['url']:
+                pools.append(p)
+        return pools
+    
     def _stop_mining(self, pool_info):
         if 'thr_list' in pool_info and pool_info['thr_list'] is not None:
-            # shut down threads
-            for thr in pool_info['thr_list']:
-                thr.shutdown()
-                thr.join()
-                self.app_process_events(0.1)
+            self.stop_pools([pool_info])
+            pool_info['is_mining'] = False
+            return True
+        return False
+    
+    def stop_pools(self, pool_infos, timeout=OPT_STOP_TIMEOUT):
+        """ stop mining the pools all at once, in about `timeout` seconds however many 
+            workers they have: the workers are parked right away, then the shares they 
+            found are sent while the time lasts """
+        deadline = time() + timeout
+        for pool_info in pool_infos:
+            self.supervisor.unwatch(pool_info['id'])
+        # park the workers, the other pools get the CPUs
+        self.scheduler.remove(*[pool_info['id'] for pool_info in pool_infos])
+        for pool_info in pool_infos:
             pool_info['thr_list'] = None
-            
-            # shut down RPC client
+            # drop the last job so a restart does not hash it with a stale login
+            pool_info['g_work'].invalidate()
+        
+        # the clients send the last shares in their own threads
+        for pool_info in pool_infos:
+            pool_info['rpc'].flush(max(0., deadline - time()))
+        # shut down RPC clients
+        for pool_info in pool_infos:
             pool_info['rpc'].shutdown()
-            pool_info['rpc'].join()
+        for pool_info in pool_infos:
+            pool_info['rpc'].join(max(.1, deadline - time()))
             work_submit_queue = pool_info['work_submit_queue']
             # clear the submit queue
             while not work_submit_queue.empty():
@@ -175,10 +257,6 @@ class Hub(QObject):
             
             if 'error' in pool_info: 
                 pool_info['error'] = None
-            
-            pool_info['is_mining'] = False
-            return True
-        return False
     
     def app_process_events(self, seconds=1):
         for _ in range(int(seconds*10)):
@@ -199,27 +277,8 @@ class Hub(QObject):
             # it means mining stopped or never started 
             return
         
-        thr_list = pool_info['thr_list']
-        if num_cpus >  len(thr_list):
-            # add more cores
-            cpus = num_cpus - len(thr_list)
-            work_submit_queue = pool_info['work_submit_queue']
-            g_work = pool_info['g_work']
-            hash_report = pool_info['hash_report']
-            for _ in range(cpus):
-                thr_id = len(thr_list)
-                p = MinerWork(thr_id, work_submit_queue, g_work, hash_report, 
-                              get_cpu_priority_level('normal'))
-                thr_list.append(p)
-                g_work['num_thrs'] = len(thr_list)
-                p.start()
-                p.set_cpu_priority(get_cpu_priority_level(pool_info['priority_level']))
-        elif num_cpus <  len(thr_list):
-            # remove cores
-            for _ in range(len(thr_list) - num_cpus):
-                thr = thr_list.pop(len(thr_list) - 1)
-                thr.shutdown()
-                thr.join()
+        # add or remove cores, within what the other pools leave
+        self.scheduler.set_weight(pool_id, num_cpus)
                 
     @Slot(str, str)
     def change_priority(self, pool_id, priority_level):
@@ -280,6 +339,9 @@ class Hub(QObject):
         if reply==QMessageBox.Yes:
             # stop mining
             self._stop_mining( pool_info )
+            # its lane of the worker pool goes with it
+            if 'g_work' in pool_info:
+                self.worker_pool.remove_lane(pool_info['g_work'])
             # remove pool from list
             self.pools.remove_pool(pool_id)
             # tell UI to remove the pool row
@@ -295,7 +357,7 @@ class Hub(QObject):
             QMessageBox.warning(self.ui, 'Add/Edit Pool Error', "<b>You have reached number of pools limit!\
             <br> Adding new pool is not allowed.</b><br><br><i>Hint: Remove unused pools to add new ones</i>")
             return
-        self.on_reset_addpool_form_event.emit()
+        self.on_reset_addpool_form_event.emit(self._failover_choices())
 #         self.add_pool_dialog.center()
         self.add_pool_dialog.exec_()
 #         self.add_pool_dialog.show()
@@ -304,8 +366,14 @@ class Hub(QObject):
     def close_addpool_dialog(self):
         self.add_pool_dialog.close()
     
-    @Slot(str, str, str, str, str, str, bool)
-    def add_edit_pool(self, pool_id, pool_display_name, pool_url, pool_username, pool_password, pool_algo, pool_ssl):
+    def _failover_choices(self):
+        """ the pools the add/edit pool form offers to fail over to """
+        return json.dumps([{'id': p['id'], 'name': smart_strip(p['name'], 30), 'algo': p['algo']} 
+                           for p in self.pools.all_pools])
+    
+    @Slot(str, str, str, str, str, str, bool, str, str)
+    def add_edit_pool(self, pool_id, pool_display_name, pool_url, pool_username, pool_password, pool_algo, pool_ssl, 
+                      pool_worker_engine, pool_failover_ids):
         
         if not pool_display_name.strip():
             QMessageBox.warning(self.add_pool_dialog,'Add/Edit Pool Error', "Pool Name is required.")
@@ -345,6 +413,11 @@ class Hub(QObject):
             QMessageBox.warning(self.add_pool_dialog, 'Add/Edit Pool Error', "Invalid pool URL!<br><br>Pool URL must be in form of <b>URL:Port</b><br> like <b>pool.sumokoin.com:3333</b>")
             return
         
+        worker_engine = pool_worker_engine if pool_worker_engine in WORKER_ENGINE_TYPES else 'process'
+        # known pools other than this one, in the order of the form
+        failover_pool_ids = [i for i in pool_failover_ids.split(',') 
+                             if i and i != pool_id and self.pools.find_pool(i) is not None]
+        
         if pool_id == "":
             pool_id = str(uuid.uuid4())
             pool_info = {
@@ -356,10 +429,12 @@ class Hub(QObject):
                 'algo': pool_algo,
                 'is_fixed': False,
                 'is_mining': False,
-                'num_cpus': get_num_cpus(),
+                'num_cpus': self.pools.default_num_cpus(pool_algo),
                 'priority_level': 'normal',
+                'worker_engine': worker_engine,
                 'is_hidden': False,
                 'ssl_enabled': pool_ssl,
+                'failover_pool_ids': failover_pool_ids,
             }
              
             self.pools.add_pool(pool_info)
@@ -372,7 +447,8 @@ class Hub(QObject):
                 'algo': pool_info['algo'],
                 'is_fixed': pool_info['is_fixed'],
                 'is_hidden': pool_info['is_hidden'],
-                'num_cpus': get_num_cpus() if pool_info['num_cpus'] == 0 else pool_info['num_cpus'],
+                'num_cpus': self.pools.default_num_cpus(pool_info['algo']) if pool_info['num_cpus'] == 0 \
+                            else pool_info['num_cpus'],
                 'priority_level': pool_info['priority_level'],
             }
             self.on_create_sumo_pool_list_event.emit(json.dumps([_pool_info]), CPU_COUNT, sys.platform == "win32")
@@ -407,6 +483,14 @@ class Hub(QObject):
                 if  'ssl_enabled' in pool_info and pool_info['ssl_enabled'] != pool_ssl:
                     need_restart_mining = True
                 pool_info['ssl_enabled'] = pool_ssl
+                
+                if pool_info['worker_engine'] != worker_engine:
+                    pool_info['worker_engine'] = worker_engine
+                    need_restart_mining = True
+                
+                if pool_info['failover_pool_ids'] != failover_pool_ids:
+                    pool_info['failover_pool_ids'] = failover_pool_ids
+                    need_restart_mining = True
 
 
                 pool_info['is_hidden'] = False
@@ -435,7 +519,7 @@ class Hub(QObject):
 #             if pool_info['is_mining'] and self._stop_mining(pool_info):
 #                 self.on_stop_mining_event.emit(pool_info["id"]) 
             
-            self.on_reset_addpool_form_event.emit()
+            self.on_reset_addpool_form_event.emit(self._failover_choices())
             url = pool_info['url']
             if url.find('://') >= 0:
                 url = url[url.find('://') + 3:]
@@ -447,6 +531,8 @@ class Hub(QObject):
                 'username': pool_info['username'],
                 'password': pool_info['password'],
                 'is_fixed': pool_info['is_fixed'],
+                'worker_engine': pool_info['worker_engine'],
+                'failover_pool_ids': pool_info['failover_pool_ids'],
             }
 
             if 'ssl_enabled' in pool_info:
@@ -490,7 +576,7 @@ class Hub(QObject):
                 'algo': p['algo'],
                 'is_fixed': p['is_fixed'],
                 'is_hidden': p['is_hidden'],
-                'num_cpus': get_num_cpus() if p['num_cpus'] == 0 else p['num_cpus'],
+                'num_cpus': self.pools.default_num_cpus(p['algo']) if p['num_cpus'] == 0 else p['num_cpus'],
                 'priority_level': p['priority_level'] if 'priority_level' in p else 0,
             }
             pool_list.append(pool_info)
@@ -521,5 +607,5 @@ class Hub(QObject):
     on_edit_pool_success_event = Signal(str)
     on_start_mining_event = Signal(str)
     on_stop_mining_event = Signal(str)
-    on_reset_addpool_form_event = Signal()
+    on_reset_addpool_form_event = Signal(str)
     on_edit_pool_event = Signal(str)
@@ -8,18 +8,26 @@ Misc classes for app and settings
 import os, uuid
 import json
 
-from settings import DATA_DIR, HASHING_ALGO
+from settings import DATA_DIR, HASHING_ALGO, WORKER_ENGINE_TYPES
 from utils.common import ensureDir, readFile, writeFile
+from miner.tuner import PROFILE_FILE_NAME, load_profile, profile_threads
 from multiprocessing import cpu_count
 
 CPU_COUNT = cpu_count()
 
 class Pools():
     all_pools_file_path = os.path.join(DATA_DIR, 'conf', 'all_pools.json')
+    hardware_profile_path = os.path.join(DATA_DIR, 'conf', PROFILE_FILE_NAME)
     def __init__(self, app_path):
         self.app_path = app_path
         ensureDir(self.all_pools_file_path)
         self.all_pools = []
+        self.hardware_profile = load_profile(self.hardware_profile_path)
+    
+    def default_num_cpus(self, algo):
+        """ tuned worker count (`miner_cli.py --tune`) if any, else all but one CPU """
+        return profile_threads(self.hardware_profile, algo, 
+                               CPU_COUNT - 1 if CPU_COUNT > 1 else CPU_COUNT)
     
     def _load_fixed_pools(self):
 #         fixed_pools = []
@@ -57,9 +65,10 @@ class Pools():
         p['is_hidden'] = p['is_hidden'] if 'is_hidden' in p else False
         p['is_fixed'] = p['is_fixed'] if 'is_fixed' in p else False
         p['ssl_enabled'] = p['ssl_enabled'] if 'ssl_enabled' in p else False
-        p['num_cpus'] = p['num_cpus'] if 'num_cpus' in p else \
-                                (CPU_COUNT - 1 if CPU_COUNT > 1 else CPU_COUNT)
+        p['num_cpus'] = p['num_cpus'] if 'num_cpus' in p else self.default_num_cpus(p['algo'])
         p['priority_level'] = p['priority_level'] if 'priority_level' in p else 'normal'    
+        p['worker_engine'] = p['worker_engine'] if 'worker_engine' in p and p['worker_engine'] in WORKER_ENGINE_TYPES else 'process'
+        p['failover_pool_ids'] = p['failover_pool_ids'] if 'failover_pool_ids' in p else []
     
     def find_pool(self, pool_id):
         for p in self.all_pools:
@@ -112,6 +121,8 @@ class Pools():
                 'num_cpus': p['num_cpus'],
                 'ssl_enabled': p['ssl_enabled'],
                 'priority_level': p['priority_level'],
+                'worker_engine': p['worker_engine'],
+                'failover_pool_ids': p['failover_pool_ids'],
             }
             _pools.append(_p)
             
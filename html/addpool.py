@@ -25,10 +25,15 @@ html = """
         
             function app_ready(){
                 console.log("Add pool dialog ready!");
-                app_hub.on_reset_addpool_form_event.connect(function(){
+                app_hub.on_reset_addpool_form_event.connect(function(pools_json){
                     $("input[type=text], textarea").val("");
                     $('#pool_id').val("");
                     $('#pool_algo').val("Cryptonight");
+                    $('#pool_worker_engine').val("process");
+                    var failover = $('#pool_failover').empty();
+                    $.each($.parseJSON(pools_json), function(i, pool){
+                        failover.append($('<option>').val(pool['id']).text(pool['name'] + ' (' + pool['algo'] + ')'));
+                    });
                     $('#pool_algo').prop('disabled', false);
                     $('#pool_display_name').prop('readonly', false);
                     $('#pool_url').prop('readonly', false);
@@ -44,6 +49,9 @@ html = """
                     $('#pool_username').val(pool_info['username']);
                     $('#pool_password').val(pool_info['password']);
                     $('#pool_ssl').prop('checked', pool_info['ssl_enabled']);
+                    $('#pool_worker_engine').val(pool_info['worker_engine']);
+                    $('#pool_failover option[value="' + pool_info['id'] + '"]').remove();
+                    $('#pool_failover').val(pool_info['failover_pool_ids']);
                     
                     if(pool_info['is_fixed']){
                         $('#pool_algo').prop('disabled', true);
@@ -61,8 +69,11 @@ html = """
                 var pool_password = $('#pool_password').val();
                 var pool_algo = $('#pool_algo').val();
                 var pool_ssl = $('#pool_ssl').is(':checked');
+                var pool_worker_engine = $('#pool_worker_engine').val();
+                var pool_failover_ids = ($('#pool_failover').val() || []).join(',');
                 
-                app_hub.add_edit_pool(pool_id, pool_display_name, pool_url, pool_username, pool_password, pool_algo, pool_ssl);
+                app_hub.add_edit_pool(pool_id, pool_display_name, pool_url, pool_username, pool_password, pool_algo, pool_ssl, 
+                                      pool_worker_engine, pool_failover_ids);
                 
                 return false;
             }
@@ -139,6 +150,11 @@ html = """
                 width: 100%;
                 color: #666;
             }
+            
+            .form-horizontal .form-group select[multiple]{
+                width: 100%;
+                height: 60px;
+            }
         </style>
     </head>
     <body>
@@ -189,12 +205,29 @@ html = """
                             <input type="password" id="pool_password" placeholder="just leave this blank if not required by the pool" maxlength="512">
                         </div>
                     </div>
+                    <div class="form-group">
+                        <label for="pool_worker_engine" class="col-xs-3 control-label">Workers <sup style="color:#333">2</sup></label>
+                        <div class="col-xs-9">
+                            <select id="pool_worker_engine">
+                                <option value="process">Processes</option>
+                                <option value="thread">Threads</option>
+                            </select>
+                        </div>
+                    </div>
+                    <div class="form-group">
+                        <label for="pool_failover" class="col-xs-3 control-label">Failover Pools <sup style="color:#333">3</sup></label>
+                        <div class="col-xs-9">
+                            <select id="pool_failover" multiple></select>
+                        </div>
+                    </div>
                     <div class="form-group">
                         <div class="col-xs-9 col-xs-offset-3">
                             <button id="btn_ok" type="button" class="btn btn-success" onclick="addEditPool(false)"><i class="fa fa-check"></i> OK</button>
                             <button id="btn_cancel" type="button" class="btn btn-warning" style="margin-left: 20px" onclick="closeDialog()"><i class="fa fa-close"></i> Cancel</button>
                             
-                            <label style="color:#999; padding-top: 15px; font-weight: normal; font-size: 90%">1. Select <strong>Cryptonight</strong> hashing algorithm for SUMO (Sumokoin), XMR (Monero) and many other cryptonote-based coins; select <strong>Cryptonight-Light</strong> for AEON coin</label>
+                            <label style="color:#999; padding-top: 15px; font-weight: normal; font-size: 90%">1. Select <strong>Cryptonight</strong> hashing algorithm for SUMO (Sumokoin), XMR (Monero) and many other cryptonote-based coins; select <strong>Cryptonight-Light</strong> for AEON coin<br>
+                            2. <strong>Processes</strong> suit most hash libraries; <strong>Threads</strong> pay off only with one releasing the GIL<br>
+                            3. Pools mined in turn, in list order, while this one gives no job (Ctrl+click to select several); pools of another hashing algo are skipped</label>
                         </div>
                     </div>
                 </fieldset>
@@ -2,4 +2,29 @@
 # -*- coding: utf-8 -*-
 ## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
 
-from cryptonite_hash import cpu_has_aes_in_supported, cryptolite_hash, cryptonite_hash
\ No newline at end of file
+import struct
+
+from cryptonite_hash import cpu_has_aes_in_supported, cryptolite_hash, cryptonite_hash
+
+_nonce_struct = struct.Struct("<I")
+
+def scan_nonces(blob_bin, start_nonce, count, target, is_cryptolite=False, aes_ni=True, stale=None):
+    ''' Hash up to `count` consecutive nonces of a 76-byte blob, starting at
+        `start_nonce`. `stale()`, if given, is checked before every hash and
+        ends the scan early when true (the job was replaced).
+        Returns (found, hashes done), found being a list of (nonce, hash) for
+        every hash whose last 32-bit word is below `target`.
+    '''
+    hash_func = cryptolite_hash if is_cryptolite else cryptonite_hash
+    blob_head = blob_bin[:39]
+    blob_tail = blob_bin[43:]
+    pack = _nonce_struct.pack
+    unpack_from = _nonce_struct.unpack_from
+    found = []
+    for nonce in xrange(start_nonce, start_nonce + count):
+        if stale is not None and stale():
+            return found, nonce - start_nonce
+        _hash = hash_func(blob_head + pack(nonce) + blob_tail, aes_ni)
+        if unpack_from(_hash, 28)[0] < target:
+            found.append((nonce, _hash))
+    return found, count
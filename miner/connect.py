@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Connection setup to pools: address resolution, connection racing and
+retry backoff
+'''
+
+import errno, os, random, select, socket, time
+
+ADDRESS_TTL = 300.      # seconds resolved pool addresses are reused
+CONNECT_TIMEOUT = 10.   # seconds for all addresses of a pool to answer
+RACE_STAGGER = .25      # seconds before racing the next address
+BACKOFF_BASE = .5       # seconds before the second attempt, doubled each attempt
+BACKOFF_CAP = 30.
+
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+               getattr(errno, 'WSAEWOULDBLOCK', 10035))
+
+
+def interleave(addresses):
+    ''' getaddrinfo entries alternating between address families, first
+        family first (RFC 8305), so a dead family does not hold up the other '''
+    by_family = []
+    for entry in addresses:
+        for entries in by_family:
+            if entries[0][0] == entry[0]:
+                entries.append(entry)
+                break
+        else:
+            by_family.append([entry])
+    result = []
+    while by_family:
+        for entries in list(by_family):
+            result.append(entries.pop(0))
+            if not entries:
+                by_family.remove(entries)
+    return result
+
+
+class AddressCache(object):
+    ''' Resolved addresses (A and AAAA) of pools, reused for `ttl` seconds.
+        The resolver does not tell the records' TTL, hence a fixed one. '''
+    def __init__(self, ttl=ADDRESS_TTL):
+        self._ttl = ttl
+        self._cache = {}    # (host, port): (expiry time, addresses)
+
+    def resolve(self, host, port):
+        ''' getaddrinfo entries of `host`, interleaved by family. Raises
+            socket.error if it can not be resolved and was never before '''
+        key = (host, port)
+        cached = self._cache.get(key)
+        now = time.time()
+        if cached is not None and cached[0] > now:
+            return list(cached[1])
+        try:
+            addresses = interleave(socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM))
+        except socket.error:
+            if cached is not None:
+                return list(cached[1])     # stale beats nothing while DNS is down
+            raise
+        self._cache[key] = (now + self._ttl, addresses)
+        return list(addresses)
+
+    def forget(self, host, port):
+        ''' Resolve again next time (none of the addresses answered) '''
+        cached = self._cache.get((host, port))
+        if cached is not None:
+            self._cache[(host, port)] = (0, cached[1])
+
+
+class Backoff(object):
+    ''' Delays before connection attempts: none for the first, then from
+        `base` doubling up to `cap`, each cut by a random jitter of up to
+        half so miners cut off together do not all come back together.
+        reset() once a connection works (logged in). '''
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+        self._base = base
+        self._cap = cap
+        self.attempts = 0
+
+    def next(self):
+        attempts = self.attempts
+        self.attempts += 1
+        if not attempts:
+            return 0.
+        delay = min(self._cap, self._base*2**(attempts - 1))
+        return delay/2 + random.uniform(0, delay/2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+def start_connect(address, setup=None):
+    ''' Non-blocking socket connecting to a getaddrinfo entry, raises
+        socket.error if the attempt failed right away '''
+    family, socktype, proto, _, sockaddr = address
+    sock = socket.socket(family, socktype, proto)
+    try:
+        if setup is not None:
+            setup(sock)
+        sock.setblocking(False)
+        err = sock.connect_ex(sockaddr)
+        if err and err not in IN_PROGRESS:
+            raise socket.error(err, os.strerror(err))
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def race_connect(addresses, timeout=CONNECT_TIMEOUT, stagger=RACE_STAGGER, setup=None, exit=None):
+    ''' Connect to the first of `addresses` (getaddrinfo entries) to answer.
+
+        Attempts start `stagger` seconds apart, or as soon as the previous
+        one failed, and race each other (happy eyeballs), the losers are
+        closed. `setup(sock)` is called on every socket before connecting.
+        Returns the connected socket in blocking mode, raises socket.error
+        if none connected within `timeout` (or when `exit` is set).
+    '''
+    addresses = list(addresses)
+    deadline = time.time() + timeout
+    pending = []
+    error = None
+    next_start = 0.
+    try:
+        while addresses or pending:
+            now = time.time()
+            if now >= deadline or (exit is not None and exit.is_set()):
+                break
+            if addresses and (now >= next_start or not pending):
+                try:
+                    pending.append(start_connect(addresses.pop(0), setup))
+                except socket.error, e:
+                    error = e
+                    next_start = 0.     # on to the next one right away
+                    continue
+                next_start = now + stagger
+            wait = min(deadline, next_start if addresses else deadline) - now
+            # failed connects are reported as writable, or exceptional on Windows
+            _, writable, failed = select.select([], pending, pending, max(0., min(wait, .1)))
+            for sock in set(writable + failed):
+                pending.remove(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    error = socket.error(err, os.strerror(err))
+                    sock.close()
+                    next_start = 0.
+                    continue
+                sock.setblocking(True)
+                return sock
+        raise error or socket.error(errno.ETIMEDOUT, "Connection timed out")
+    finally:
+        for sock in pending:
+            sock.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Pool failover groups
+'''
+
+import threading, time
+
+FAILOVER_DELAY = .5     # seconds the active pool may be without a job before switching
+FAILBACK_DELAY = 60.    # seconds a preferred pool must stay up before switching back
+STARTUP_DELAY = 10.     # seconds the first pool has to log in before failing over
+CHECK_INTERVAL = .1
+
+
+class FailoverGroup(object):
+    ''' Ordered pools mining into the same workers, first one preferred.
+
+        Every member is a MinerRPC connected and logged in to its own pool;
+        only the active one publishes its jobs to the workers and submits
+        their shares, the others are warm standbys. When the active pool has
+        no job (connection or login lost) for `failover_delay` seconds, the
+        first pool up takes over: its last job is published right away and
+        the workers switch to it, without being restarted. A pool before the
+        active one takes over again once up for `failback_delay` seconds.
+
+        Looks like a single MinerRPC to its owner (start or serve_forever,
+        shutdown, join). With `pool_info`, the error of the active member's
+        pool info (members are given copies) is shown on it.
+    '''
+    def __init__(self, members, pool_info=None, member_infos=None, failover_delay=FAILOVER_DELAY,
+                 failback_delay=FAILBACK_DELAY, startup_delay=STARTUP_DELAY, log=None):
+        self._members = members
+        self._pool_info = pool_info
+        self._member_infos = member_infos
+        self._failover_delay = failover_delay
+        self._failback_delay = failback_delay
+        self._startup_delay = startup_delay
+        self._log = log
+        self._active = 0
+        self._up_since = [None]*len(members)
+        self._down_since = [None]*len(members)
+        self._thread = None
+        self.exit = threading.Event()
+        self.daemon = True
+        self.switches = 0
+        for i, member in enumerate(members):
+            member.set_active(i == 0)
+
+    active = property(lambda s: s._members[s._active])
+
+    def set_thread_list(self, thr_list):
+        for member in self._members:
+            member.set_thread_list(thr_list)
+
+    def start(self):
+        ''' Start the members, and watch them in a thread of our own '''
+        self._start_members()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        ''' Start the members, and watch them in the calling thread until shutdown '''
+        self._start_members()
+        self._watch()
+
+    def shutdown(self):
+        self.exit.set()
+        for member in self._members:
+            member.shutdown()
+
+    def flush(self, timeout):
+        return self.active.flush(timeout)
+
+    def join(self, timeout=None):
+        ''' Wait for the watcher and all members, `timeout` is for them all '''
+        deadline = time.time() + timeout if timeout is not None else None
+        remaining = lambda: max(0., deadline - time.time()) if deadline is not None else None
+        if self._thread is not None:
+            self._thread.join(remaining())
+        for member in self._members:
+            if hasattr(member, 'join'):
+                member.join(remaining())
+
+    def is_alive(self):
+        return not self.exit.is_set()
+
+    def _start_members(self):
+        start = time.time()
+        for i, member in enumerate(self._members):
+            self._down_since[i] = start + self._startup_delay if i == 0 else start
+            if hasattr(member, 'start'):
+                member.daemon = self.daemon
+                member.start()      # a thread, or on the shared reactor
+            else:
+                t = threading.Thread(target=member.serve_forever)
+                t.daemon = True
+                t.start()
+
+    def _watch(self):
+        while not self.exit.is_set():
+            self._check()
+            self._show_error()
+            self.exit.wait(CHECK_INTERVAL)
+
+    def _check(self):
+        now = time.time()
+        for i, member in enumerate(self._members):
+            if member.has_job:
+                self._down_since[i] = None
+                if self._up_since[i] is None:
+                    self._up_since[i] = now
+            else:
+                self._up_since[i] = None
+                if self._down_since[i] is None:
+                    self._down_since[i] = now
+
+        active = self._active
+        if self._up_since[active] is None:
+            if now - self._down_since[active] < self._failover_delay:
+                return
+            # fail over to the first pool up
+            for i in range(len(self._members)):
+                if self._up_since[i] is not None:
+                    self._switch(i)
+                    return
+        else:
+            # fail back to a preferred pool up long enough
+            for i in range(active):
+                if self._up_since[i] is not None and now - self._up_since[i] >= self._failback_delay:
+                    self._switch(i)
+                    return
+
+    def _switch(self, i):
+        old, new = self._members[self._active], self._members[i]
+        if self._log is not None:
+            self._log("Switching to pool #%d of the failover group (%s)" % (i + 1, new.url))
+        old.set_active(False)
+        new.set_active(True)
+        self._active = i
+        self.switches += 1
+
+    def _show_error(self):
+        if self._pool_info is None or self._member_infos is None:
+            return
+        error = self._member_infos[self._active].get('error')
+        if self._pool_info.get('error') != error and not (error is None and 'error' not in self._pool_info):
+            self._pool_info['error'] = error
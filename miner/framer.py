@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Newline framing of the stratum stream
+'''
+
+RECV_SIZE = 64*1024
+MAX_LINE_SIZE = 64*1024     # stratum messages are well below 1KB
+
+
+class LineTooLong(Exception):
+    ''' `lines` are the complete lines of normal size received with the long one '''
+    def __init__(self, message, lines=()):
+        Exception.__init__(self, message)
+        self.lines = list(lines)
+
+
+class LineFramer(object):
+    ''' Splits a byte stream into lines, in one preallocated bytearray.
+
+        recv_from() receives straight into the free end of the buffer, lines()
+        finds the last newline in place (never re-scanning bytes already
+        checked) and splits all complete lines out in one go. Consumed bytes
+        are reclaimed by moving the (short) unfinished tail to the front.
+
+        A line longer than `max_line_size` raises LineTooLong once, then the
+        rest of it is discarded up to the next newline. The other lines
+        split out with it are on the exception.
+    '''
+    def __init__(self, max_line_size=MAX_LINE_SIZE, recv_size=RECV_SIZE):
+        self._max_line_size = max_line_size
+        self._recv_size = recv_size
+        self._buf = bytearray(max_line_size + recv_size)
+        self.reset()
+
+    def reset(self):
+        self._start = 0         # first byte of the unfinished line
+        self._end = 0           # end of received data
+        self._scan = 0          # no newline between _start and _scan
+        self._discarding = False
+
+    def _make_room(self):
+        if len(self._buf) - self._end >= self._recv_size:
+            return
+        tail = self._end - self._start
+        self._buf[0:tail] = self._buf[self._start:self._end]
+        self._scan -= self._start
+        self._start = 0
+        self._end = tail
+
+    def recv_from(self, sock):
+        ''' Receive once from `sock` into the buffer, returns the number of
+            bytes received (0 means the peer closed the connection) '''
+        self._make_room()
+        view = memoryview(self._buf)
+        try:
+            n = sock.recv_into(view[self._end:], self._recv_size)
+        finally:
+            view = None
+        self._end += n
+        return n
+
+    def _check_size(self):
+        if self._end - self._start > self._max_line_size:
+            # drop what we have and skip the rest of this line
+            self._start = self._scan = self._end
+            if not self._discarding:
+                self._discarding = True
+                raise LineTooLong("Line longer than %d bytes" % self._max_line_size)
+
+    def lines(self):
+        ''' Returns the list of complete lines received so far, without newlines '''
+        buf = self._buf
+        i = buf.rfind('\n', self._scan, self._end)
+        if i < 0:
+            self._scan = self._end
+            self._check_size()
+            return []
+        lines = str(buffer(buf, self._start, i - self._start)).split('\n')
+        self._start = self._scan = i + 1
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        if self._discarding:
+            # the first line is the end of the one too long
+            self._discarding = False
+            del lines[0]
+        # any line may be too long, the first one grew from a carried over tail
+        max_size = self._max_line_size
+        too_long = any(len(line) > max_size for line in lines)
+        # no newline after i, the unfinished tail is checked too
+        self._scan = self._end
+        try:
+            self._check_size()
+        except LineTooLong:
+            too_long = True
+        if too_long:
+            raise LineTooLong("Line longer than %d bytes" % max_size, 
+                              [line for line in lines if len(line) <= max_size])
+        return lines
+
+
+if __name__ == '__main__':
+    # Microbenchmark: frame a recorded pool stream (raw bytes as received
+    # from a pool) or, without a file, a synthetic one made of job bursts
+    # and submit replies. The stream is replayed through a socket pair, so
+    # receive calls cost what they cost on a pool connection.
+    import sys, os, json, socket, threading, timeit
+    from binascii import hexlify
+
+    def synthetic_traffic(bursts=200, jobs_per_burst=50):
+        lines = []
+        for b in range(bursts):
+            for j in range(jobs_per_burst):
+                lines.append(json.dumps({'jsonrpc': '2.0', 'method': 'job', 'params': {
+                    'blob': hexlify(os.urandom(76)), 'job_id': hexlify(os.urandom(16)), 'target': 'b88d0600'}}))
+            lines.append(json.dumps({'id': b, 'jsonrpc': '2.0', 'error': None, 'result': {'status': 'OK'}}))
+        return '\n'.join(lines) + '\n'
+
+    def replay(data, reader):
+        a, b = socket.socketpair()
+        sender = threading.Thread(target=lambda: (a.sendall(data), a.close()))
+        sender.start()
+        try:
+            return reader(b)
+        finally:
+            sender.join()
+            b.close()
+
+    def split_reader(recv_size):
+        def reader(sock):
+            ''' framing of SimpleJsonRpcClient._handle_incoming_rpc before LineFramer '''
+            data = ""
+            count = 0
+            while True:
+                if '\n' in data:
+                    (line, data) = data.split('\n', 1)
+                    count += 1
+                else:
+                    chunk = sock.recv(recv_size)
+                    if not chunk:
+                        return count
+                    data += chunk
+        return reader
+
+    def framer_reader(sock):
+        framer = LineFramer()
+        count = 0
+        while framer.recv_from(sock):
+            for line in framer.lines():
+                count += 1
+        return count
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            traffic = f.read()
+        source = sys.argv[1]
+    else:
+        traffic = synthetic_traffic()
+        source = 'synthetic job bursts'
+
+    lines = traffic.count('\n')
+    print 'Traffic: %s, %d bytes, %d lines' % (source, len(traffic), lines)
+    for name, reader in (('split, recv(1024)', split_reader(1024)),
+                         ('split, recv(64K)', split_reader(RECV_SIZE)),
+                         ('LineFramer', framer_reader)):
+        assert replay(traffic, reader) == lines
+        best = min(timeit.repeat(lambda: replay(traffic, reader), number=1, repeat=5))
+        print '%-18s %8.2f ms, %8.1f MB/s, %10.0f lines/s' % (name, best*1000,
+                                                             len(traffic)/best/1048576, lines/best)
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Jobs a pool still accepts shares for
+'''
+
+import time
+from collections import deque
+
+STALE_GRACE = 1.    # seconds a replaced job stays live
+RESUBMIT_SIZE = 16  # shares kept while reconnecting
+RESUBMIT_AGE = 30.  # seconds they are kept
+
+
+class LiveJobs(object):
+    ''' The current job of the current login, and the jobs it replaced for
+        `grace` seconds (pools keep accepting shares of a replaced job until
+        the block changes, which the miner can not see).
+
+        A new login or invalidate() (connection lost) leaves nothing live:
+        the pool refuses every share of a previous login. The jobs live when
+        the connection was lost are remembered (was_lost), shares found for
+        them can be resubmitted under the new login if the pool hands out
+        the same job again.
+    '''
+    def __init__(self, grace=STALE_GRACE):
+        self._grace = grace
+        self._login_id = None
+        self._current = None
+        self._replaced = {}     # job_id: time it stops being live
+        self._lost_login_id = None
+        self._lost = set()
+
+    current = property(lambda s: s._current)
+
+    def new_job(self, job_id, login_id):
+        now = time.time()
+        if login_id != self._login_id:
+            self._replaced = {}
+        elif self._current is not None and self._current != job_id:
+            self._replaced[self._current] = now + self._grace
+        self._login_id = login_id
+        self._current = job_id
+        self._replaced.pop(job_id, None)
+        for old_id, until in self._replaced.items():
+            if until <= now:
+                del self._replaced[old_id]
+
+    def invalidate(self):
+        if self._current is not None:
+            now = time.time()
+            self._lost_login_id = self._login_id
+            self._lost = set([self._current] + [job_id for job_id, until in self._replaced.items() if until > now])
+        self._login_id = self._current = None
+        self._replaced = {}
+
+    def was_lost(self, job_id, login_id):
+        ''' If the job was live when the connection was last lost '''
+        return login_id == self._lost_login_id and job_id in self._lost
+
+    def is_live(self, job_id, login_id):
+        if self._current is None or login_id != self._login_id:
+            return False
+        if job_id == self._current:
+            return True
+        until = self._replaced.get(job_id)
+        return until is not None and until > time.time()
+
+
+class ResubmitBuffer(object):
+    ''' Shares that could not be submitted because the connection was lost,
+        kept to resubmit after the relogin: at most the `size` newest ones,
+        for at most `max_age` seconds.
+    '''
+    def __init__(self, size=RESUBMIT_SIZE, max_age=RESUBMIT_AGE):
+        self._shares = deque(maxlen=size)   # (time found, submit params)
+        self._max_age = max_age
+        self._overflowed = 0
+
+    def __len__(self):
+        return len(self._shares)
+
+    def add(self, params, found_time=None):
+        if len(self._shares) == self._shares.maxlen:
+            self._overflowed += 1
+        self._shares.append((found_time or time.time(), params))
+
+    def take(self):
+        ''' Empties the buffer, returns (the shares young enough to resubmit,
+            the number of shares expired) '''
+        oldest = time.time() - self._max_age
+        shares = [params for found, params in self._shares if found >= oldest]
+        expired = len(self._shares) - len(shares) + self._overflowed
+        self._shares.clear()
+        self._overflowed = 0
+        return shares, expired
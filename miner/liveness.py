@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Liveness of a pool connection
+'''
+
+import time
+
+PROBE_METHOD = 'keepalived'     # the pools' keepalive request
+PROBE_IDLE_MIN = 10.    # seconds a connection may be quiet before a probe, at least
+PROBE_IDLE_MAX = 60.    # and at most
+PROBE_TIMEOUT = 5.      # seconds to wait for a probe's reply, at least
+MAX_MISSED = 3          # unanswered probes in a row before the connection is dead
+
+# poll() results
+PROBE = 'probe'
+DEAD = 'dead'
+
+
+class Liveness(object):
+    ''' When to probe a pool connection, and when it is dead.
+
+        Any message from the pool shows the connection alive, so only a
+        quiet one is probed: quiet for twice the usual gap between the
+        pool's messages (jobs, replies), within [idle_min, idle_max]. A probe
+        is the pool's keepalive request, its reply measures the round-trip
+        time. A probe not replied within 4 round-trips (at least `timeout`)
+        is missed and probed again right away; `max_missed` in a row and the
+        connection is dead.
+
+        Pools that answer the keepalive with an error are `supported` False:
+        they only get the bare '\\r' the miners always sent, which keeps NAT
+        mappings up but can not tell if the pool is there.
+    '''
+    def __init__(self, idle_min=PROBE_IDLE_MIN, idle_max=PROBE_IDLE_MAX, timeout=PROBE_TIMEOUT,
+                 max_missed=MAX_MISSED):
+        self._idle_min = idle_min
+        self._idle_max = idle_max
+        self._timeout = timeout
+        self._max_missed = max_missed
+        self.supported = None   # if the pool has the keepalive method, None until known
+        self.rtt = None         # smoothed round-trip time of the probes
+        self.probes = 0
+        self.missed_total = 0
+        self._gap = None        # smoothed time between the pool's messages, kept across connections
+        self.reset()
+
+    def reset(self):
+        ''' A new connection (login) '''
+        self._last_received = self._last_message = time.time()
+        self._probes = {}       # id: time sent, of the unreplied probes
+        self._last_probe = None # time the last probe was sent, until replied or missed
+        self._last_ping = 0.
+        self.missed = 0
+
+    @property
+    def idle_limit(self):
+        if self._gap is None:
+            return self._idle_min
+        return min(self._idle_max, max(self._idle_min, 2*self._gap))
+
+    @property
+    def probe_timeout(self):
+        if self.rtt is None:
+            return self._timeout
+        return max(self._timeout, 4*self.rtt)
+
+    def received(self):
+        ''' A message from the pool other than a probe reply '''
+        now = time.time()
+        gap = now - self._last_message
+        self._gap = gap if self._gap is None else .8*self._gap + .2*gap
+        self._last_message = now
+        self._alive(now)
+
+    def replied(self, request_id, error=None):
+        ''' The reply to a probe, late ones too '''
+        now = time.time()
+        sent = self._probes.pop(request_id, None)
+        if sent is None:
+            return
+        self.supported = error is None
+        rtt = now - sent
+        self.rtt = rtt if self.rtt is None else .875*self.rtt + .125*rtt
+        self._alive(now)
+
+    def _alive(self, now):
+        self._last_received = now
+        self._last_probe = None
+        self._probes.clear()
+        self.missed = 0
+
+    def probe_sent(self, request_id):
+        now = time.time()
+        self._probes[request_id] = now
+        self._last_probe = now
+        self.probes += 1
+
+    def ping_sent(self):
+        ''' A '\\r' sent instead of a probe (keepalive not supported) '''
+        self._last_ping = time.time()
+
+    def poll(self):
+        ''' PROBE when a probe is due, DEAD when too many were missed, else None '''
+        now = time.time()
+        if self._last_probe is not None:
+            if now - self._last_probe < self.probe_timeout:
+                return None
+            self._last_probe = None
+            self.missed += 1
+            self.missed_total += 1
+            return DEAD if self.missed >= self._max_missed else PROBE
+        if now - max(self._last_received, self._last_ping) >= self.idle_limit:
+            return PROBE
+        return None
+
+    def as_dict(self):
+        return {
+            'supported': self.supported,
+            'rtt': self.rtt,
+            'idle_limit': self.idle_limit,
+            'probes': self.probes,
+            'missed': self.missed_total,
+        }
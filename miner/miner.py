@@ -13,9 +13,18 @@ import errno
 import ssl
 import threading, time, urlparse, random, platform
 from multiprocessing import Process, Event, cpu_count
+from Queue import Empty
 #from threading import Timer
-from libs import cpu_has_aes_in_supported, cryptolite_hash, cryptonite_hash
+from libs import cpu_has_aes_in_supported, scan_nonces
 import settings
+from shared import HashRateMeter, MAX_NONCE
+from reactor import ReactorClientMixin
+from framer import LineFramer, LineTooLong
+from poolstats import ReconnectStats, ShareStats
+from livejobs import LiveJobs, ResubmitBuffer
+from pending import PendingRequests
+from connect import AddressCache, Backoff, race_connect
+from liveness import Liveness, PROBE_METHOD, PROBE, DEAD
 
 from utils.logger import log, LEVEL_DEBUG, LEVEL_ERROR, LEVEL_INFO, LEVEL_PROTOCOL
 
@@ -88,55 +97,78 @@ class SimpleJsonRpcClient(threading.Thread):
         self._lock = threading.RLock()
         self._rpc_thread = None
         self._message_id = 1
-        self._requests = dict()
+        self._requests = PendingRequests(settings.OPT_RPC_TIMEOUTS)
+        self._socket_changed = threading.Condition()
         
         self.exit = Event()
+        # set by the reader when the pool closed the connection or it failed
+        self.connection_lost = threading.Event()
         
     def _handle_incoming_rpc(self):
-        data = ""
+        framer = LineFramer()
         while not self.exit.is_set():
+            sock = self._socket
             try:
-                # Get the next line if we have one, otherwise, read and block
-                if '\n' in data:
-                    (line, data) = data.split('\n', 1)
-                
-                else:
-                    chunk = self._socket.recv(1024)
-                    if chunk: data += chunk
-                    continue
-#             except IOError as e:
-#                 if e.errno == 10053: # Error: An established connection was aborted by the software in your host machine
-#                     pass
-#                 time.sleep(1)
-#                 data = ""
-#                 continue
+                # read and block, then handle all complete lines
+                received = framer.recv_from(sock)
             except Exception, e:
                 #print >> sys.stderr, e
-                time.sleep(1)
-                data = ""
-                continue
+                received = 0
             
-            log('JSON-RPC Server > ' + line, LEVEL_PROTOCOL, self._pool_id)
-            
-            # Parse the JSON
-            try:
-                reply = json.loads(line)
-            except Exception, e:
-                log("JSON-RPC Error: Failed to parse JSON %r (skipping)" % line, LEVEL_ERROR, self._pool_id)
-                continue
-            
-            try:
-                request = None
-                with self._lock:
-                    if 'id' in reply and reply['id'] in self._requests:
-                        request = self._requests[reply['id']]
-                    self.handle_reply(request = request, reply = reply)
-            except self.RequestReplyWarning, e:
-                output = e.message
-                if e.request:
-                    output += '\n  ' + e.request
-                output += '\n  ' + e.reply
-                log(output, LEVEL_ERROR)
+            if received and sock is self._socket:
+                self._handle_lines(framer)
+            else:
+                # the pool closed the connection (empty read) or it failed,
+                # or the client reconnected meanwhile
+                framer.reset()
+                self._wait_new_socket(sock)
+    
+    def _wait_new_socket(self, sock):
+        ''' Signal that `sock` is dead and wait until connect() replaces it '''
+        with self._socket_changed:
+            if sock is self._socket:
+                self.connection_lost.set()
+            while sock is self._socket and not self.exit.is_set():
+                self._socket_changed.wait(.5)
+    
+    def _handle_lines(self, framer):
+        sock = self._socket
+        try:
+            lines = framer.lines()
+        except LineTooLong, e:
+            log("JSON-RPC Error: %s (skipping)" % e, LEVEL_ERROR, self._pool_id)
+            lines = e.lines
+        for line in lines:
+            self._handle_line(line)
+            if self._socket is not sock:
+                # the reply made the client reconnect (try_connect), the rest
+                # of the lines and the partial one came on the old connection
+                framer.reset()
+                return
+    
+    def _handle_line(self, line):
+        ''' Parse one message from the server and dispatch it to handle_reply '''
+        log('JSON-RPC Server > ' + line, LEVEL_PROTOCOL, self._pool_id)
+        
+        # Parse the JSON
+        try:
+            reply = json.loads(line)
+        except Exception, e:
+            log("JSON-RPC Error: Failed to parse JSON %r (skipping)" % line, LEVEL_ERROR, self._pool_id)
+            return
+        
+        try:
+            request = None
+            with self._lock:
+                if 'id' in reply:
+                    request = self._requests.pop(reply['id'])
+                self.handle_reply(request = request, reply = reply)
+        except self.RequestReplyWarning, e:
+            output = e.message
+            if e.request:
+                output += '\n  ' + e.request
+            output += '\n  ' + e.reply
+            log(output, LEVEL_ERROR)
 
 
     def handle_reply(self, request, reply):
@@ -163,7 +195,7 @@ class SimpleJsonRpcClient(threading.Thread):
         
         message = json.dumps(request)
         with self._lock:
-            self._requests[self._message_id] = request
+            self._requests.add(request)
             self._message_id += 1
             self._socket.send(message + '\n')
       
@@ -173,7 +205,11 @@ class SimpleJsonRpcClient(threading.Thread):
 
     def connect(self, socket):
         '''Connects to a remove JSON-RPC server'''
-        self._socket = socket
+        with self._socket_changed:
+            self._socket = socket
+            # a loss signaled for the previous socket is handled by now
+            self.connection_lost.clear()
+            self._socket_changed.notify_all()
 
         if not self._rpc_thread:
             self._rpc_thread = threading.Thread(target = self._handle_incoming_rpc)
@@ -221,12 +257,38 @@ class MinerRPC(SimpleJsonRpcClient):
 
         self._my_sock = None
         self._last_check_idle_time = time.time()
+        self._reconnect_stats = ReconnectStats()
+        self._share_stats = ShareStats()
+        self._live_jobs = LiveJobs(settings.OPT_STALE_GRACE)
+        self._resubmit_buffer = ResubmitBuffer(settings.OPT_RESUBMIT_SIZE, settings.OPT_RESUBMIT_AGE)
+        self._addresses = AddressCache(settings.OPT_ADDRESS_TTL)
+        self._backoff = Backoff(settings.OPT_RECONNECT_DELAY_MIN, settings.OPT_RECONNECT_DELAY_MAX)
+        self._liveness = Liveness(settings.OPT_PROBE_IDLE_MIN, settings.OPT_PROBE_IDLE_MAX, settings.OPT_PROBE_TIMEOUT, 
+                                  settings.OPT_PROBE_MAX_MISSED)
+        # a standby of a failover group stays logged in, but its jobs are only
+        # published (and shares submitted) once it is made active
+        self._active = True
+        self._job = None
+        # the pool fixes the top byte of the nonce, the workers share the rest
+        self._nicehash = False
+        
+        # hashrate views computed from the workers' shared hash counters
+        self._share_meter = self._idle_meter = None
+        if 'hash_report' in pool_info:
+            self._share_meter = HashRateMeter(pool_info['hash_report'])
+            self._idle_meter = HashRateMeter(pool_info['hash_report'], min_interval=0.)
         
         
     url = property(lambda s: s._url)
     username = property(lambda s: s._username)
     password = property(lambda s: s._password)
     login_id = property(lambda s: s._login_id)
+    reconnect_stats = property(lambda s: s._reconnect_stats.as_dict())
+    rpc_stats = property(lambda s: s._requests.as_dict())
+    share_stats = property(lambda s: s._share_stats.as_dict())
+    liveness_stats = property(lambda s: s._liveness.as_dict())
+    has_job = property(lambda s: s._live_jobs.current is not None)
+    is_active = property(lambda s: s._active)
   
     def set_thread_list(self, thr_list):
         self._thr_list = thr_list
@@ -234,11 +296,16 @@ class MinerRPC(SimpleJsonRpcClient):
     # Overridden from SimpleJsonRpcClient
     def handle_reply(self, request, reply):
         """ Handle login result"""
+        if request and request.get("method") == PROBE_METHOD:
+            self._liveness.replied(request['id'], reply.get("error"))
+            self._work_report['liveness_stats'] = self._liveness.as_dict()
+            return
+        self._liveness.received()
+        
         if request and request.get("method") == "login":
             error = reply.get("error")
             if error is not None:
-                self._pool_info['error'] = error.get('message')
-                log("Error %d: %s" % (error.get('code'), error.get('message')), LEVEL_ERROR, self._pool_id)
+                self._on_login_error(error)
                 # relogin after 10 seconds
                 if self._wait(10):
                     self._login()
@@ -249,6 +316,10 @@ class MinerRPC(SimpleJsonRpcClient):
                 job_params = result.get("job")
                 if job_params:
                     self._login_id = result.get("id")
+                    self._nicehash = 'nicehash' in (result.get("extensions") or [])
+                    self._reconnect_stats.logged_in()
+                    self._backoff.reset()
+                    self._liveness.reset()
                     """ handle job here """
                     self._set_new_job(job_params)
       
@@ -257,7 +328,8 @@ class MinerRPC(SimpleJsonRpcClient):
             self._work_report['work_submited'] = self._work_submited
             if reply.get("error") is not None:
                 error = reply.get("error")
-                log("rejected: %s, %d/%d, NO!!!" % (error.get("message"), 
+                reason = self._share_stats.reject(error.get("message"))
+                log("rejected (%s): %s, %d/%d, NO!!!" % (reason, error.get("message"), 
                                                   self._work_accepted, self._work_submited), LEVEL_ERROR, self._pool_id)
                 if error.get("message") in POOL_ERROR_MSGS:
                     #self._login()
@@ -267,19 +339,14 @@ class MinerRPC(SimpleJsonRpcClient):
                 res = reply.get("result")
                 if res.get("status") == "OK":
                     self._work_accepted += 1
+                    self._share_stats.accept()
                     accepted_percentage = self._work_accepted*100./self._work_submited
-#                     hash_rates = self._pool_info['hash_report'] if 'hash_report' in self._pool_info else {}
-#                     if len(hash_rates) > 0:
-#                         hash_rates = dict(hash_rates)
-#                         _total_hash_rate = reduce(lambda x, y: x+y, [hash_rates[k] for k in hash_rates])
-#                     else:
-#                         _total_hash_rate = 0.0
-                    _total_hash_rate = 0.0
-                    if 'total_hashrate' in self._pool_info:
-                        _total_hash_rate = self._pool_info['total_hashrate']
+                    _total_hash_rate = self._share_meter.update() if self._share_meter else 0.0
                     log("accepted %d/%d (%.2f%%), %s, YES!" % (self._work_accepted, self._work_submited, 
                         accepted_percentage, human_readable_hashrate(_total_hash_rate)), LEVEL_INFO, self._pool_id)
                     self._work_report['work_accepted'] = self._work_accepted
+            self._work_report['rpc_stats'] = self._requests.as_dict()
+            self._work_report['share_stats'] = self._share_stats.as_dict()
         
         elif reply.get("error") is not None:
             error = reply.get("error")
@@ -298,6 +365,9 @@ class MinerRPC(SimpleJsonRpcClient):
      
     def _set_new_job(self, job_params):
         job_id = job_params.get("job_id")
+        if not job_id:
+            log("Invalid stratum job id: %s" % job_id, LEVEL_ERROR, self._pool_id)
+            return
         try:
             target_hex = job_params.get("target")
             target, difficulty = decode_target_value(target_hex)
@@ -312,71 +382,216 @@ class MinerRPC(SimpleJsonRpcClient):
             nonce = long( hexlify(blob_bin[39:43]), 16)
             assert(len(blob_bin) == 76)
             assert(nonce >= 0)
+            if self._nicehash:
+                nonce = struct.unpack('<I', blob_bin[39:43])[0] & 0xff000000
+                nonce_end = nonce | 0xffffff
+            else:
+                nonce_end = MAX_NONCE
         except:
             log("Invalid stratum blob: %s" % blob_hex, LEVEL_ERROR, self._pool_id)
             return
           
-        self._g_work['login_id'] = self._login_id
-        self._g_work['target'] = target
-        self._g_work['blob_bin'] = blob_bin
-        self._g_work['nonce'] = nonce
-        self._g_work['num_thrs'] = len(self._thr_list)
-        self._g_work['job_id'] = job_id
-        self._g_work['is_cryptolite'] = self._pool_info['algo'] == "Cryptonight-Light"
+        job = (job_id, self._login_id, blob_bin, target, nonce, self._pool_info['algo'] == "Cryptonight-Light", 
+               nonce_end)
+        if self._active:
+            try:
+                self._publish_job(job)
+            except ValueError:
+                log("Invalid stratum job: %s" % job_id, LEVEL_ERROR, self._pool_id)
+                return
+        self._job = job
+        self._live_jobs.new_job(job_id, self._login_id)
+        if self._resubmit_buffer:
+            self._resubmit()
         
         log('New job recv: target="%s" blob="%s"' % (target_hex, blob_hex), LEVEL_INFO, self._pool_id)
+        if self._reconnect_stats.got_job() is not None:
+            self._report_reconnect()
         if difficulty != self._cur_stratum_diff:
             self._cur_stratum_diff = difficulty
-            self._work_report['difficulty'] = difficulty
+            if self._active:
+                self._work_report['difficulty'] = difficulty
             log("Stratum difficulty set to %.f" % difficulty, LEVEL_INFO, self._pool_id)
+    
+    def _publish_job(self, job):
+        job_id, login_id, blob_bin, target, nonce, is_cryptolite, nonce_end = job
+        # randomized scans start anywhere in the range (and wrap around)
+        start = random.randint(0, nonce_end - nonce) if settings.OPT_RANDOMIZE else 0
+        self._g_work.publish(job_id, login_id, blob_bin, target, nonce, len(self._thr_list), is_cryptolite, 
+                             nonce_end, start)
+    
+    def set_active(self, active):
+        """ make this client the one the workers mine for, or a standby (failover groups) """
+        with self._lock:
+            self._active = active
+            if not active:
+                return
+            # carry on the share counts of the pool row
+            self._work_accepted = self._work_report.get('work_accepted', 0)
+            self._work_submited = self._work_report.get('work_submited', 0)
+            if self._job is None or not self.has_job:
+                self._g_work.invalidate()
+                return
+            try:
+                self._publish_job(self._job)
+            except ValueError:
+                log("Invalid stratum job: %s" % self._job[0], LEVEL_ERROR, self._pool_id)
+                return
+            self._work_report['difficulty'] = self._cur_stratum_diff
+    
+    def flush(self, timeout):
+        """ wait up to `timeout` seconds for the queued shares to be sent and replied,
+            before a shutdown (the client must still be running) """
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.is_alive() and not self.connection_lost.is_set():
+            with self._lock:
+                if (not self._active or self._work_submit_queue.empty()) and not self._requests.count('submit'):
+                    return True
+            time.sleep(.05)
+        return False
+    
+    def _report_reconnect(self):
+        stats = self._reconnect_stats
+        log("Reconnected: relogin in %.3fs, first job in %.3fs (%d reconnects)" % (stats.last_relogin_time, 
+            stats.last_job_time, stats.reconnects), LEVEL_INFO, self._pool_id)
+        self._work_report['reconnect_stats'] = stats.as_dict()
   
     def run(self):
         self.try_connect()
-        start = time.time()
         while not self.exit.is_set():
-            if not self._work_submit_queue.empty():
-                work_submit = self._work_submit_queue.get()
+            if self.connection_lost.is_set():
+                # the reader saw the connection go, don't wait for a send to fail
+                self.try_connect()
+                continue
+            
+            work_submit = self._next_share()
+            if work_submit is not None:
                 try:
-                    self.send(method=work_submit['method'], params=work_submit['params'])
-                    start = time.time() + settings.OPT_PING_INTERVAL # to delay sending 'ping' by interval setting
+                    if not self._submit(work_submit):
+                        continue    # dropped as stale, on to the next one
                 except socket.error:
                     self.try_connect()
                     continue
-            elif settings.OPT_SEND_PING:
-                """ 'ping' stratum server periodically to detect disconnection """
-                elapsed = time.time() - start
-                if elapsed >= settings.OPT_PING_INTERVAL:
-                    try:
-                        self.send(method='ping', params=None)
-                    except socket.error:
-                        self.try_connect()
-                        continue
-                    finally:
-                        start = time.time()
             
-            """ relogin after 1 minute idle, i.e. receiving no new jobs for a long time, 
-                may be due to some pool's error other than network error """
-            if time.time() - self._last_check_idle_time >= 60:
-                if 'error' in self._pool_info and self._pool_info['error'] == NETWORK_ERROR_MSG:
-                    self._last_check_idle_time = time.time()
-                    continue
-                
-                hash_rates = self._pool_info['hash_report'] if 'hash_report' in self._pool_info else None
-                if hash_rates is not None and len(hash_rates) > 0: # it means mining is already on 
-                    total_hash_rate = reduce(lambda x, y: x+y, [hash_rates[k] for k in dict(hash_rates)])
-                    # but mining is now idle
-                    if total_hash_rate == 0.:
-                        self._login()
-                self._last_check_idle_time = time.time()
-                             
-            time.sleep(.1)
+            self._check_idle()
+            self._check_timeouts()
+            self._check_liveness()
         """ try to close socket before exit """
         try:
             self._my_sock.close()
         except:
             pass
     
-    def try_connect(self):
+    def _next_share(self):
+        """ the next share found by the workers, waiting up to .1s for one: the wait ends
+            the moment a share is queued, the timeout only paces the checks of the loop """
+        if not self._active:
+            # a standby of a failover group leaves the shares to the active member
+            self.connection_lost.wait(.1)
+            return None
+        try:
+            return self._work_submit_queue.get(timeout=.1)
+        except Empty:
+            return None
+    
+    def _submit(self, work_submit):
+        """ send a share found by the workers, unless the pool would refuse it as stale,
+            shares of the jobs live when the connection was lost are kept for the relogin """
+        params = work_submit['params']
+        job_id = params.get('job_id')
+        if not self._live_jobs.is_live(job_id, params.get('id')):
+            if not self._live_jobs.was_lost(job_id, params.get('id')):
+                self._share_stats.drop()
+                log("Stale share dropped (job %s)" % job_id, LEVEL_DEBUG, self._pool_id)
+                return None
+            with self._lock:
+                if self._live_jobs.current is None:
+                    # not logged in again yet
+                    self._resubmit_buffer.add(params, work_submit.get('found_time'))
+                    return None
+            if not self._live_jobs.is_live(job_id, self._login_id):
+                self._share_stats.expired += 1
+                return None
+            self._share_stats.recovered += 1
+            params = dict(params, id=self._login_id)
+        return self.send(method=work_submit['method'], params=params)
+    
+    def _resubmit(self):
+        """ resubmit the shares kept while reconnecting whose job the pool handed out again """
+        shares, expired = self._resubmit_buffer.take()
+        recovered = 0
+        for params in shares:
+            if self._live_jobs.is_live(params.get('job_id'), self._login_id):
+                self.send(method='submit', params=dict(params, id=self._login_id))
+                recovered += 1
+            else:
+                expired += 1
+        self._share_stats.recovered += recovered
+        self._share_stats.expired += expired
+        log("Shares found while reconnecting: %d resubmitted, %d expired" % (recovered, expired), LEVEL_INFO, self._pool_id)
+    
+    def _check_idle(self):
+        """ relogin after 1 minute idle, i.e. receiving no new jobs for a long time, 
+            may be due to some pool's error other than network error """
+        if not self._active:
+            return
+        if time.time() - self._last_check_idle_time >= 60:
+            if 'error' in self._pool_info and self._pool_info['error'] == NETWORK_ERROR_MSG:
+                self._last_check_idle_time = time.time()
+                return
+            
+            if self._idle_meter is not None:
+                total_hash_rate = self._idle_meter.update()
+                # it means mining is already on, but mining is now idle
+                if self._idle_meter.total_hashes() > 0 and total_hash_rate == 0.:
+                    self._login()
+            self._last_check_idle_time = time.time()
+    
+    def _check_timeouts(self):
+        """ reconnect when a login or submit got no reply in time """
+        with self._lock:
+            expired = self._requests.expired()
+            if not expired:
+                return
+            self._work_report['rpc_stats'] = self._requests.as_dict()
+        # unreplied probes are counted by the liveness check
+        methods = set(request.get('method') for request in expired) - set([PROBE_METHOD])
+        if not methods:
+            return
+        log("No reply to %s in time" % ", ".join(sorted(methods)), LEVEL_ERROR, self._pool_id)
+        # reconnect rather than relogin, shares of the old login would be rejected
+        self.try_connect()
+    
+    def _check_liveness(self):
+        """ probe the connection when the pool has been quiet for a while,
+            reconnect when probes go unreplied """
+        if not settings.OPT_SEND_PING:
+            return
+        with self._lock:
+            if not self.has_job:
+                return  # not logged in, the login timeout watches the connection
+            action = self._liveness.poll()
+            if action == PROBE:
+                try:
+                    self._probe()
+                except socket.error:
+                    action = DEAD
+        if action == DEAD:
+            log("No reply to %d keepalive probes, reconnecting" % self._liveness.missed, LEVEL_ERROR, self._pool_id)
+            self._work_report['liveness_stats'] = self._liveness.as_dict()
+            self.try_connect()
+    
+    def _probe(self):
+        if self._liveness.supported is False:
+            self.send(method='ping', params=None)
+            self._liveness.ping_sent()
+            return
+        request = self.send(method=PROBE_METHOD, params={'id': self._login_id})
+        if request is not None:
+            self._liveness.probe_sent(request['id'])
+    
+    def _pool_address(self):
+        """ (hostname, port) of the pool, None if the pool URL is invalid """
         url = urlparse.urlparse(self.url)
         hostname = url.hostname
         try:
@@ -384,66 +599,101 @@ class MinerRPC(SimpleJsonRpcClient):
         except:
             self._pool_info['error'] = "Invalid pool port"
             log("Invalid pool port!", LEVEL_ERROR)
-            return
+            return None
         
         if not hostname:
             self._pool_info['error'] = "Invalid pool URL"
             log("Invalid pool URL", LEVEL_ERROR)
+            return None
+        return (hostname, port)
+    
+    def _use_ssl(self):
+        return 'ssl_enabled' in self._pool_info and self._pool_info['ssl_enabled']
+    
+    def _on_connecting(self, hostname, port):
+        log('Connecting to RPC server [%s:%d]...' % (hostname, port), LEVEL_INFO, self._pool_id)
+    
+    def _on_connected(self):
+        if 'error' in self._pool_info: 
+            self._pool_info['error'] = None
+    
+    def _on_network_error(self):
+        self._reconnect_stats.lost()
+        # requests sent on the lost connection will never be replied,
+        # its unreplied shares are kept for resubmitting after the relogin
+        with self._lock:
+            for request in self._requests.clear():
+                if request.get('method') == 'submit':
+                    self._resubmit_buffer.add(request['params'])
+        log(NETWORK_ERROR_MSG, LEVEL_ERROR, self._pool_id)
+        self._pool_info['error'] = NETWORK_ERROR_MSG
+        # (try to) stop all mining jobs by setting global job_id as None
+        if self._active:
+            self._g_work.invalidate()
+        # shares still queued or in flight are dropped when taken from the queue
+        self._live_jobs.invalidate()
+    
+    def _on_login_error(self, error):
+        self._pool_info['error'] = error.get('message')
+        log("Error %d: %s" % (error.get('code'), error.get('message')), LEVEL_ERROR, self._pool_id)
+    
+    def try_connect(self):
+        address = self._pool_address()
+        if address is None:
             return
-          
-        while not self.exit.is_set():
-            if not self._my_sock:
-                log('Connecting to RPC server [%s:%d]...' % (hostname, port), LEVEL_INFO, self._pool_id)
-                self._my_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._sock_keep_alive()
-            else:
-                log(NETWORK_ERROR_MSG, LEVEL_ERROR, self._pool_id)
-                self._pool_info['error'] = NETWORK_ERROR_MSG
-                # (try to) stop all mining jobs by setting global job_id as None
-                self._g_work['job_id'] = None
-                # and clear submit works remain in queue if any
-                while not self._work_submit_queue.empty():
-                    _ = self._work_submit_queue.get()
-                
-                try:
-                    self._my_sock.close()
-                except:
-                    pass
-                else:
-                    self._my_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self._sock_keep_alive()
-              
-            if 'ssl_enabled' in self._pool_info and self._pool_info['ssl_enabled']:
-                self._my_sock = ssl.wrap_socket(self._my_sock)
-
+        hostname, port = address
+        
+        if not self._my_sock:
+            self._on_connecting(hostname, port)
+        else:
+            self._on_network_error()
+            self._close_sock()
+        while self._wait(self._backoff.next()) and not self.exit.is_set():
             try:
-                self._my_sock.connect((hostname, port))
+                # all addresses of the pool (IPv4 and IPv6) race, first to answer wins
+                self._my_sock = race_connect(self._addresses.resolve(hostname, port), 
+                                             setup=self._sock_keep_alive, exit=self.exit)
+                if self._use_ssl():
+                    self._my_sock = ssl.wrap_socket(self._my_sock)
                 self.connect(self._my_sock)
             except socket.error:
-                # wait 10 seconds
-                self._wait(10)
+                self._addresses.forget(hostname, port)
+                self._on_network_error()
+                self._close_sock()
             else:
                 self._login()
-                if 'error' in self._pool_info: 
-                    self._pool_info['error'] = None
+                self._on_connected()
                 break
-                
     
-    def _sock_keep_alive(self):
+    def _close_sock(self):
+        if self._my_sock is None:
+            return
+        try:
+            # close() alone doesn't wake the reader blocked on the socket
+            self._my_sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        try:
+            self._my_sock.close()
+        except:
+            pass
+        self._my_sock = None
+    
+    def _sock_keep_alive(self, sock):
         after_idle_sec = 1
         interval_sec= 3
         my_os = platform.system()
         try:
             if my_os == "Windows":
-                self._my_sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec*1000, interval_sec*1000))
+                sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec*1000, interval_sec*1000))
             elif my_os == "Linux":
-                self._my_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
             elif my_os == "Darwin":
                 TCP_KEEPALIVE = 0x10
-                self._my_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, TCP_KEEPALIVE, interval_sec)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.setsockopt(socket.IPPROTO_TCP, TCP_KEEPALIVE, interval_sec)
         except:
             pass
         
@@ -464,89 +714,103 @@ class MinerRPC(SimpleJsonRpcClient):
     def _wait(self, seconds=1):
         """ wait without blocking UI
         """
-        for _ in range(seconds*10):
+        for _ in range(int(seconds*10)):
             if self.exit.is_set(): return False
             time.sleep(.1)
         return True
       
       
-class MinerWork(Process):
-    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level):
-        Process.__init__(self)
+class AsyncMinerRPC(ReactorClientMixin, MinerRPC):
+    ''' MinerRPC running with all other pools on one shared reactor thread,
+        shares are sent as soon as workers put them in the channel '''
+    def __init__(self, pool_info, work_submit_queue, g_work, work_report):
+        MinerRPC.__init__(self, pool_info, work_submit_queue, g_work, work_report)
+        self._reactor_init(log=lambda msg: log(msg, LEVEL_ERROR))
+    
+    def _periodic(self):
+        self._check_idle()
+        self._check_timeouts()
+        self._check_liveness()
+
+
+RPC_ENGINES = {'thread': MinerRPC, 'reactor': AsyncMinerRPC}
+
+      
+class MinerWorkBase(object):
+    ''' Hashing loop shared by all worker engines '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report):
         self._cur_job_id = None
         self._hash_rate = 0.0
         self._thr_id = thr_id
         self._work_submit_queue = work_submit_queue
         self._g_work = g_work
-        self._hash_report_queue = hash_report
-        self.exit = Event()
-                
-        _p = psutil.Process(self.pid)
-        _cpu_affinity = [CPU_COUNT - (thr_id % CPU_COUNT) - 1]
-        if sys.platform == "win32":
-            _p.cpu_affinity(_cpu_affinity)
-        #_p.nice(cpu_priority_level)
+        self._hash_counters = hash_report
   
     def run(self):
+        self._work()
+    
+    def _work(self):
+        self._mine()
+    
+    def _running(self):
+        return not self.exit.is_set()
+    
+    def _mine(self):
         _total_hashes = 0
           
         blob_bin = None
-        nonce = 1
-        max_nonce = target = login_id = 0
-        #end_nonce = MAX_INT - 0x20
-        end_nonce = 0
+        target = login_id = 0
         is_cryptolite = 0        # (if) is cryptonight-lite algo
 #         max_int32 = 2**32        # =4294967296
-          
-        while not self.exit.is_set():
-            if not 'job_id' in self._g_work or self._g_work['job_id'] is None:
+        
+        job_version = None
+        work = None
+        while self._running():
+            """ check job version locally, take a snapshot only if it has changed """
+            if self._g_work.version != job_version:
+                job_version, work = self._g_work.read()
+            
+            if work is None:
+                self._cur_job_id = None
                 self._hash_rate = 0.
-                self._shareHashRate()
-                time.sleep(.1)
+                self._hash_counters.beat(self._thr_id)    # heartbeat for the supervisor
+                # sleep until a new job is published (or shutdown)
+                self._g_work.wait(job_version, timeout=1.)
                 continue
             
                                  
-            if self._g_work['job_id'] != self._cur_job_id:
-                self._cur_job_id = self._g_work['job_id']
-                nonce = self._g_work['nonce']
-                blob_bin = self._g_work['blob_bin']
-                target = self._g_work['target']
-                login_id = self._g_work['login_id']
-                is_cryptolite = self._g_work['is_cryptolite']
-                end_nonce = MAX_INT /self._g_work['num_thrs']*(self._thr_id + 1) - 0x20
-                nonce += MAX_INT/self._g_work['num_thrs']*self._thr_id
-                """ randomize nonce start"""
-                if settings.OPT_RANDOMIZE:
-                    offset = int(settings.OPT_SCANTIME*self._hash_rate) if self._hash_rate > 0 else 64*settings.OPT_SCANTIME
-                    nonce += random.randint(0, MAX_INT/self._g_work['num_thrs'] - offset)
-                if nonce > MAX_INT - 0x20:
-                    nonce = end_nonce
+            if work['job_id'] != self._cur_job_id:
+                self._cur_job_id = work['job_id']
+                blob_bin = work['blob_bin']
+                target = work['target']
+                login_id = work['login_id']
+                is_cryptolite = work['is_cryptolite']
                 
             max64 = int(settings.OPT_SCANTIME*self._hash_rate) if self._hash_rate > 0 else 64    
-            if nonce + max64 > end_nonce:
-                max_nonce = end_nonce
-            else:
-                max_nonce = nonce + max64
-                
-            if max_nonce > MAX_INT: 
-                max_nonce = MAX_INT
             
             """ start _hash scan """
+            stale = lambda: self._g_work.version != job_version or not self._running()
             total_hashes_done = 0
             _hashes_done = 0
             start = _start = time.time()
-            while nonce <= max_nonce and not self.exit.is_set():
-                nonce_bin = struct.pack("<I", nonce)
-                blob_bin = blob_bin[:39] + nonce_bin + blob_bin[43:]
+            while total_hashes_done < max64 and self._running():
+                """ claim a time-budgeted chunk of the job's nonces, scan it unless the job is replaced """
+                count = int(settings.OPT_BATCH_TIME*self._hash_rate) if self._hash_rate > 0 else 1
+                claimed = self._g_work.claim(job_version, max(count, 1))
+                if claimed is None:
+                    break   # a new job, or all nonces of this one taken
+                nonce, count = claimed
+                found, count = scan_nonces(blob_bin, nonce, count, target, is_cryptolite, HAS_AES_NI, stale)
                 
-                if is_cryptolite:
-                    _hash = cryptolite_hash(blob_bin, HAS_AES_NI)
-                else:
-                    _hash = cryptonite_hash(blob_bin, HAS_AES_NI)
+                for found_nonce, _hash in found:
+                    """ Yes, hash found! """
+                    params = dict(id=login_id, job_id = self._cur_job_id, 
+                                  nonce=hexlify(struct.pack("<I", found_nonce)), result=hexlify(_hash))
+                    self._work_submit_queue.put({'method': 'submit', 'params': params, 'found_time': time.time()})
               
-                nonce += 1
-                _hashes_done += 1
-                total_hashes_done += 1
+                self._hash_counters.add(self._thr_id, count)
+                _hashes_done += count
+                total_hashes_done += count
                 
                 """ calculate _hash rate"""
                 if _hashes_done >= self._hash_rate/2:
@@ -554,44 +818,59 @@ class MinerWork(Process):
                     elapsed = time.time() - _start
                     if elapsed > 0:
                         self._hash_rate = _hashes_done/elapsed
-                        """ share _hash rate """
-                        self._shareHashRate()
                         log('CPU #%d: %.2f H/s' % (self._thr_id, self._hash_rate), LEVEL_DEBUG)
                         _start = time.time()
                         _hashes_done = 0
                   
-                if struct.unpack("<I", _hash[28:])[0] < target:
-                    """ Yes, hash found! """
-                    params = dict(id=login_id, job_id = self._cur_job_id, 
-                                  nonce=hexlify(nonce_bin), result=hexlify(_hash))
-                    self._work_submit_queue.put({'method': 'submit', 'params': params})
-                    break
-                  
                 """ if there is a new work, break scan """
-                if self._g_work['job_id'] != self._cur_job_id:
+                if self._g_work.version != job_version:
                     break
             
             
             elapsed = time.time() - start
             self._hash_rate = total_hashes_done/elapsed if elapsed > 0 else 0.
-            """ share _hash rate """
-            self._shareHashRate()
             log('CPU #%d: %.2f H/s' % (self._thr_id, self._hash_rate), LEVEL_DEBUG)
             
-            """ if idle: """
+            """ if idle: all nonces of the job are taken, wait for the next one """
             if total_hashes_done == 0:
-                time.sleep(.1)
-        
-        ## Set hash_rate to 0.0 before exit
-        self._hash_rate = 0.        
-        self._shareHashRate()
+                self._hash_counters.beat(self._thr_id)
+                self._g_work.wait(job_version, timeout=1.)
     
-    def _shareHashRate(self):
-        self._hash_report_queue.update({'%d' % self._thr_id: self._hash_rate})
+    def _pin(self, cpu):
+        pass
                 
     def shutdown(self):
         log("Miner thread# %d shutdown initiated" % self._thr_id, LEVEL_DEBUG)
         self.exit.set()
+        self._g_work.wake()
+
+
+class MinerWork(MinerWorkBase, Process):
+    ''' Worker engine running each mining thread in its own process '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level, cpu=None):
+        Process.__init__(self)
+        MinerWorkBase.__init__(self, thr_id, work_submit_queue, g_work, hash_report)
+        self.exit = Event()
+        self._cpu = cpu
+                
+        _p = psutil.Process(self.pid)
+        _cpu_affinity = [CPU_COUNT - (thr_id % CPU_COUNT) - 1]
+        if sys.platform == "win32":
+            _p.cpu_affinity(_cpu_affinity)
+        #_p.nice(cpu_priority_level)
+        
+    def run(self):
+        self._pin(self._cpu)
+        MinerWorkBase.run(self)
+    
+    def _pin(self, cpu):
+        """ pin to the logical CPU chosen by the placement engine (Linux) """
+        if cpu is not None:
+            try:
+                psutil.Process().cpu_affinity([cpu])
+                log('CPU #%d: pinned to logical CPU %d' % (self._thr_id, cpu), LEVEL_DEBUG)
+            except Exception, e:
+                log('CPU #%d: failed to set CPU affinity: %s' % (self._thr_id, e), LEVEL_ERROR)
         
     def set_cpu_priority(self, cpu_priority_level):
         _p = psutil.Process(self.pid)
@@ -599,4 +878,92 @@ class MinerWork(Process):
     
     def show_priority(self):
         _p = psutil.Process(self.pid)
-        print "PID", _p.pid, "Priority", _p.nice()
\ No newline at end of file
+        print "PID", _p.pid, "Priority", _p.nice()
+
+
+class MinerThread(MinerWorkBase, threading.Thread):
+    ''' Worker engine running mining threads inside the calling process.
+        Much lighter to start and stop than processes, but only scales with
+        hash backends releasing the GIL while hashing.
+    '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level, cpu=None):
+        # `cpu` placement is not applied to threads, they float within the process
+        threading.Thread.__init__(self)
+        MinerWorkBase.__init__(self, thr_id, work_submit_queue, g_work, hash_report)
+        self.daemon = True
+        self.exit = threading.Event()
+        
+    def set_cpu_priority(self, cpu_priority_level):
+        # threads run at the priority of the hosting (UI) process
+        pass
+
+
+WORKER_ENGINES = {'process': MinerWork, 'thread': MinerThread}
+
+
+class PooledWorkBase(object):
+    ''' Worker of a WorkerPool: parked until assigned one of `lanes`, the
+        (work_submit_queue, g_work, hash_report) of the pools, mines it as
+        told by its Assignment and goes back to park, without exiting '''
+    def _pool_init(self, lanes, assignment):
+        self._lanes = lanes
+        self._assignment = assignment
+        self._assigned = None
+        self._cpu_pinned = None
+        self.lane = None    # as last assigned, seen from the pool's side
+    
+    lane_count = property(lambda s: len(s._lanes))
+    
+    def assign(self, lane, thr_id=0, cpu=None):
+        ''' Mine `lane` as worker `thr_id` on `cpu`, lane None parks.
+            Called by the pool, takes effect within a hashing batch '''
+        old, self.lane = self.lane, lane
+        self._assignment.set(lane, thr_id, cpu)
+        if old is not None and self._lanes[old] is not None:
+            self._lanes[old][1].wake()      # out of an idle wait on the old job slot
+    
+    def drop_lane(self, lane):
+        ''' Forget a lane removed from the pool (a forked process still has its copy) '''
+        if lane < len(self._lanes):
+            self._lanes[lane] = None
+    
+    def _running(self):
+        return not self.exit.is_set() and self._assignment.version == self._assigned
+    
+    def _work(self):
+        while not self.exit.is_set():
+            self._assigned, lane, thr_id, cpu = self._assignment.read()
+            if lane is None:
+                self._assignment.wait(self._assigned, timeout=1.)
+                continue
+            self._thr_id = thr_id
+            self._work_submit_queue, self._g_work, self._hash_counters = self._lanes[lane]
+            self._cur_job_id = None
+            if cpu is not None and cpu != self._cpu_pinned:
+                self._pin(cpu)
+                self._cpu_pinned = cpu
+            self._mine()
+    
+    def shutdown(self):
+        log("Pooled worker shutdown initiated", LEVEL_DEBUG)
+        self.exit.set()
+        self._assignment.wake()
+        if self.lane is not None and self._lanes[self.lane] is not None:
+            self._lanes[self.lane][1].wake()
+
+
+class PooledMinerWork(PooledWorkBase, MinerWork):
+    def __init__(self, slot, lanes, assignment, cpu_priority_level):
+        MinerWork.__init__(self, slot, None, None, None, cpu_priority_level)
+        # once forked, the process only has the lanes of the time
+        self._pool_init(list(lanes), assignment)
+
+
+class PooledMinerThread(PooledWorkBase, MinerThread):
+    def __init__(self, slot, lanes, assignment, cpu_priority_level):
+        MinerThread.__init__(self, slot, None, None, None, cpu_priority_level)
+        # sees the pool's lanes as they are added
+        self._pool_init(lanes, assignment)
+
+
+POOLED_WORKER_ENGINES = {'process': PooledMinerWork, 'thread': PooledMinerThread}
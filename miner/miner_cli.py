@@ -5,16 +5,51 @@
 Miner client
 '''
 
-import sys
+import sys, os
 import psutil
 import binascii, json, socket, struct 
 import threading, time, urlparse, random, platform
-from multiprocessing import Process, Queue, Manager, cpu_count, Event
+from multiprocessing import Process, Queue, cpu_count, Event
+from Queue import Empty
 #from threading import Timer
 try:
-    from cryptonite_hash import cpu_has_aes_in_supported, cryptolite_hash, cryptonite_hash
-except:
-    from libs import cpu_has_aes_in_supported, cryptolite_hash, cryptonite_hash
+    from libs import cpu_has_aes_in_supported, scan_nonces
+except ImportError:
+    # run as a script from miner/, libs is in the parent directory
+    sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from libs import cpu_has_aes_in_supported, scan_nonces
+try:
+    from shared import JobSlot, HashCounters, HashRateMeter, ShareChannel, MAX_NONCE
+    from reactor import ReactorClientMixin
+    from framer import LineFramer, LineTooLong
+    from poolstats import ReconnectStats, ShareStats
+    from livejobs import LiveJobs, ResubmitBuffer
+    from pending import PendingRequests
+    from connect import AddressCache, Backoff, race_connect
+    from liveness import Liveness, PROBE_METHOD, PROBE, DEAD
+    from failover import FailoverGroup
+    from proxy import StratumProxy
+    from supervisor import WorkerSupervisor, stop_workers
+    from topology import worker_cpu, SCRATCHPAD_SIZE, SCRATCHPAD_SIZE_LIGHT
+    import tuner
+except ImportError:
+    from miner.shared import JobSlot, HashCounters, HashRateMeter, ShareChannel, MAX_NONCE
+    from miner.reactor import ReactorClientMixin
+    from miner.framer import LineFramer, LineTooLong
+    from miner.poolstats import ReconnectStats, ShareStats
+    from miner.livejobs import LiveJobs, ResubmitBuffer
+    from miner.pending import PendingRequests
+    from miner.connect import AddressCache, Backoff, race_connect
+    from miner.liveness import Liveness, PROBE_METHOD, PROBE, DEAD
+    from miner.failover import FailoverGroup
+    from miner.proxy import StratumProxy
+    from miner.supervisor import WorkerSupervisor, stop_workers
+    from miner.topology import worker_cpu, SCRATCHPAD_SIZE, SCRATCHPAD_SIZE_LIGHT
+    from miner import tuner
+try:
+    from settings import DATA_DIR
+except ImportError:
+    DATA_DIR = os.path.join(os.path.expanduser('~'), 'SumoMiner')
 
 USER_AGENT = "SumoMiner-CLI"
 VERSION = [1, 0]
@@ -23,18 +58,41 @@ ALGORITHM_CRYPTONIGHT      = 'cryptonight'
 ALGORITHM_CRYPTOLIGHT     = 'cryptonight-light'
 
 ALGORITHMS = [ ALGORITHM_CRYPTONIGHT, ALGORITHM_CRYPTOLIGHT ]
+# algorithm names as in the app settings (HASHING_ALGO), used by the hardware profile
+ALGORITHM_NAMES = { ALGORITHM_CRYPTONIGHT: 'Cryptonight', ALGORITHM_CRYPTOLIGHT: 'Cryptonight-Light' }
+
+HARDWARE_PROFILE_PATH = os.path.join(DATA_DIR, 'conf', tuner.PROFILE_FILE_NAME)
 
 OPT_RANDOMIZE = False  # Randomize scan range start to reduce duplicates
 OPT_SCANTIME = 60
+OPT_BATCH_TIME = 0.1 # Time budget (in second) of each nonce-range scan call
+OPT_CPU_PLACEMENT = True # Pin workers to cores by cache topology (Linux)
 OPT_REPLY_WITH_RPC2_EXPLICIT = True # support for explicit RPC 2.0 in reply
-OPT_SEND_PING = True
-OPT_PING_INTERVAL = 1 # Ping interval in second
+OPT_SEND_PING = True # Probe quiet pool connections (keepalived) to detect dead ones
+OPT_PROBE_IDLE_MIN = 10 # Seconds a pool may be quiet before a probe, adapted to its traffic,
+OPT_PROBE_IDLE_MAX = 60 # between these two
+OPT_PROBE_TIMEOUT = 5 # Seconds to wait for a probe's reply, at least (4 round-trips)
+OPT_PROBE_MAX_MISSED = 3 # Unreplied probes in a row before reconnecting
+OPT_STALE_GRACE = 1. # Seconds shares of a replaced job are still submitted
+OPT_RESUBMIT_SIZE = 16 # Shares found while reconnecting kept for resubmitting after relogin
+OPT_RESUBMIT_AGE = 30 # and for how many seconds
+OPT_RPC_TIMEOUTS = {'login': 10, 'submit': 10} # Seconds to wait for a reply before reconnecting
+OPT_RECONNECT_DELAY_MIN = .5 # Seconds before retrying a failed connection, doubled at each failure
+OPT_RECONNECT_DELAY_MAX = 30 # up to this
+OPT_ADDRESS_TTL = 300 # Seconds resolved pool addresses are reused
+OPT_FAILOVER_DELAY = .5 # Seconds a pool may be without a job before its failover pool takes over
+OPT_FAILBACK_DELAY = 60 # Seconds a preferred pool must be back up before switching back to it
+OPT_WORKER_HANG_TIMEOUT = 60 # Seconds without a heartbeat before a worker is restarted as hung
+OPT_WORKER_RESTART_DELAY_MIN = 1 # Seconds before restarting a worker again, doubled at each restart
+OPT_WORKER_RESTART_DELAY_MAX = 60 # up to this
+OPT_STOP_TIMEOUT = 2 # Seconds stopping the workers may take, late ones are killed
 
 # Verbosity and log level
 QUIET           = False
 DEBUG           = False
 DEBUG_PROTOCOL  = False
 INFO            = True
+LOG_STREAM      = sys.stdout    # stderr when stdout carries the benchmark report
 
 LEVEL_PROTOCOL  = 'protocol'
 LEVEL_INFO      = 'info'
@@ -61,12 +119,13 @@ else:
     VERY_HIGH_CPU_PRIORITY_LEVEL = -20
 
 def log(message, level):
-    '''Conditionally write a message to stdout based on command line options and level.'''
+    '''Conditionally write a message to LOG_STREAM (stdout) based on command line options and level.'''
     
     global DEBUG
     global DEBUG_PROTOCOL
     global QUIET
     global INFO
+    global LOG_STREAM
     
     if QUIET and level != LEVEL_ERROR: return
     if not DEBUG_PROTOCOL and level == LEVEL_PROTOCOL: return
@@ -75,7 +134,7 @@ def log(message, level):
     
     if level != LEVEL_PROTOCOL: message = '[%s] %s' % (level.upper(), message)
     
-    print ("[%s] %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), message))
+    print >> LOG_STREAM, "[%s] %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), message)
 
 
 # Convert from/to binary and hexidecimal strings (could be replaced with .encode('hex') and .decode('hex'))
@@ -139,48 +198,77 @@ class SimpleJsonRpcClient(object):
         self._lock = threading.RLock()
         self._rpc_thread = None
         self._message_id = 1
-        self._requests = dict()
+        self._requests = PendingRequests(OPT_RPC_TIMEOUTS)
+        self._socket_changed = threading.Condition()
         self.exit = Event()
+        # set by the reader when the pool closed the connection or it failed
+        self.connection_lost = threading.Event()
 
     def _handle_incoming_rpc(self):
-        data = ""
+        framer = LineFramer()
         while not self.exit.is_set():
+            sock = self._socket
             try:
-                # Get the next line if we have one, otherwise, read and block
-                if '\n' in data:
-                    (line, data) = data.split('\n', 1)
-                
-                else:
-                    chunk = self._socket.recv(1024)
-                    if chunk: data += chunk
-                    continue
+                # read and block, then handle all complete lines
+                received = framer.recv_from(sock)
             except Exception, e:
                 #print >> sys.stderr, e
-                time.sleep(10)
-                data = ""
-                continue
-            
-            log('JSON-RPC Server > ' + line, LEVEL_PROTOCOL)
+                received = 0
             
-            # Parse the JSON
-            try:
-                reply = json.loads(line)
-            except Exception, e:
-                log("JSON-RPC Error: Failed to parse JSON %r (skipping)" % line, LEVEL_ERROR)
-                continue
-            
-            try:
-                request = None
-                with self._lock:
-                    if 'id' in reply and reply['id'] in self._requests:
-                        request = self._requests[reply['id']]
-                    self.handle_reply(request = request, reply = reply)
-            except self.RequestReplyWarning, e:
-                output = e.message
-                if e.request:
-                    output += '\n  ' + e.request
-                output += '\n  ' + e.reply
-                log(output, LEVEL_ERROR)
+            if received and sock is self._socket:
+                self._handle_lines(framer)
+            else:
+                # the pool closed the connection (empty read) or it failed,
+                # or the client reconnected meanwhile
+                framer.reset()
+                self._wait_new_socket(sock)
+    
+    def _wait_new_socket(self, sock):
+        '''Signal that `sock` is dead and wait until connect() replaces it.'''
+        with self._socket_changed:
+            if sock is self._socket:
+                self.connection_lost.set()
+            while sock is self._socket and not self.exit.is_set():
+                self._socket_changed.wait(.5)
+    
+    def _handle_lines(self, framer):
+        sock = self._socket
+        try:
+            lines = framer.lines()
+        except LineTooLong, e:
+            log("JSON-RPC Error: %s (skipping)" % e, LEVEL_ERROR)
+            lines = e.lines
+        for line in lines:
+            self._handle_line(line)
+            if self._socket is not sock:
+                # the reply made the client reconnect (try_connect), the rest
+                # of the lines and the partial one came on the old connection
+                framer.reset()
+                return
+    
+    def _handle_line(self, line):
+        '''Parse one message from the server and dispatch it to handle_reply.'''
+        log('JSON-RPC Server > ' + line, LEVEL_PROTOCOL)
+        
+        # Parse the JSON
+        try:
+            reply = json.loads(line)
+        except Exception, e:
+            log("JSON-RPC Error: Failed to parse JSON %r (skipping)" % line, LEVEL_ERROR)
+            return
+        
+        try:
+            request = None
+            with self._lock:
+                if 'id' in reply:
+                    request = self._requests.pop(reply['id'])
+                self.handle_reply(request = request, reply = reply)
+        except self.RequestReplyWarning, e:
+            output = e.message
+            if e.request:
+                output += '\n  ' + e.request
+            output += '\n  ' + e.reply
+            log(output, LEVEL_ERROR)
 
 
     def handle_reply(self, request, reply):
@@ -206,7 +294,7 @@ class SimpleJsonRpcClient(object):
         
         message = json.dumps(request)
         with self._lock:
-            self._requests[self._message_id] = request
+            self._requests.add(request)
             self._message_id += 1
             self._socket.send(message + '\n')
       
@@ -216,7 +304,11 @@ class SimpleJsonRpcClient(object):
 
     def connect(self, socket):
         '''Connects to a remove JSON-RPC server'''
-        self._socket = socket
+        with self._socket_changed:
+            self._socket = socket
+            # a loss signaled for the previous socket is handled by now
+            self.connection_lost.clear()
+            self._socket_changed.notify_all()
 
         if not self._rpc_thread:
             self._rpc_thread = threading.Thread(target = self._handle_incoming_rpc)
@@ -256,9 +348,26 @@ class MinerRPC(SimpleJsonRpcClient):
       
         self._my_sock = None
         #self._stopped = False
+        self._reconnect_stats = ReconnectStats()
+        self._share_stats = ShareStats()
+        self._live_jobs = LiveJobs(OPT_STALE_GRACE)
+        self._resubmit_buffer = ResubmitBuffer(OPT_RESUBMIT_SIZE, OPT_RESUBMIT_AGE)
+        self._addresses = AddressCache(OPT_ADDRESS_TTL)
+        self._backoff = Backoff(OPT_RECONNECT_DELAY_MIN, OPT_RECONNECT_DELAY_MAX)
+        self._liveness = Liveness(OPT_PROBE_IDLE_MIN, OPT_PROBE_IDLE_MAX, OPT_PROBE_TIMEOUT, 
+                                  OPT_PROBE_MAX_MISSED)
+        # a standby of a failover group stays logged in, but its jobs are only
+        # published (and shares submitted) once it is made active
+        self._active = True
+        self._job = None
+        # the pool fixes the top byte of the nonce, the workers share the rest
+        self._nicehash = False
+        # called with (request, error) on each submit reply, by a stratum proxy
+        self.on_share_reply = None
        
         
         self._hash_report = hash_report_queue
+        self._share_meter = HashRateMeter(hash_report_queue)
     
 #         self._rpc_thread2 = threading.Thread(target = self.serve_forever)
 #         self._rpc_thread2.daemon = True
@@ -270,6 +379,12 @@ class MinerRPC(SimpleJsonRpcClient):
     username = property(lambda s: s._username)
     password = property(lambda s: s._password)
     login_id = property(lambda s: s._login_id)
+    reconnect_stats = property(lambda s: s._reconnect_stats.as_dict())
+    rpc_stats = property(lambda s: s._requests.as_dict())
+    share_stats = property(lambda s: s._share_stats.as_dict())
+    liveness_stats = property(lambda s: s._liveness.as_dict())
+    has_job = property(lambda s: s._live_jobs.current is not None)
+    is_active = property(lambda s: s._active)
   
     def stop(self):
         self._stopped = True
@@ -280,10 +395,15 @@ class MinerRPC(SimpleJsonRpcClient):
     # Overridden from SimpleJsonRpcClient
     def handle_reply(self, request, reply):
         """ Handle login result"""
+        if request and request.get("method") == PROBE_METHOD:
+            self._liveness.replied(request['id'], reply.get("error"))
+            return
+        self._liveness.received()
+        
         if request and request.get("method") == "login":
             error = reply.get("error")
             if not error is None:
-                log("Error %d: %s" % (error.get('code'), error.get('message')), LEVEL_ERROR)
+                self._on_login_error(error)
                 # relogin after 10 seconds
                 time.sleep(10)
                 self._login()
@@ -294,14 +414,21 @@ class MinerRPC(SimpleJsonRpcClient):
                 job_params = result.get("job")
                 if job_params:
                     self._login_id = result.get("id")
+                    self._nicehash = 'nicehash' in (result.get("extensions") or [])
+                    self._reconnect_stats.logged_in()
+                    self._backoff.reset()
+                    self._liveness.reset()
                     """ handle job here """
                     self._set_new_job(job_params)
       
         elif request and request.get("method") == "submit":
             self._work_submited += 1
+            if self.on_share_reply is not None:
+                self.on_share_reply(request, reply.get("error"))
             if reply.get("error") is not None:
                 error = reply.get("error")
-                log("rejected: %s, %d/%d, NO!!!" % (error.get("message"), 
+                reason = self._share_stats.reject(error.get("message"))
+                log("rejected (%s): %s, %d/%d, NO!!!" % (reason, error.get("message"), 
                                                   self._work_accepted, self._work_submited), LEVEL_ERROR)
                 if error.get("message") in POOL_ERROR_MSGS:
                     #self._login()
@@ -311,10 +438,8 @@ class MinerRPC(SimpleJsonRpcClient):
                 res = reply.get("result")
                 if res.get("status") == "OK":
                     self._work_accepted += 1
-                    _total_hash_rate = 0.
-                    if len(self._hash_report) > 0:
-                        _total_hash_rate = reduce(lambda x, y: x+y, [self._hash_report[k] for k in dict(self._hash_report)])
-                    
+                    self._share_stats.accept()
+                    _total_hash_rate = self._share_meter.update()
                     readable_hashrate = human_readable_hashrate(_total_hash_rate)
                     accepted_percentage = self._work_accepted*100./self._work_submited
                     log("accepted %d/%d (%.2f%%), %s YES!" % (self._work_accepted, self._work_submited, 
@@ -337,6 +462,9 @@ class MinerRPC(SimpleJsonRpcClient):
      
     def _set_new_job(self, job_params):
         job_id = job_params.get("job_id")
+        if not job_id:
+            log("Invalid stratum job id: %s" % job_id, LEVEL_ERROR)
+            return
         try:
             target_hex = job_params.get("target")
             target, difficulty = decode_target_value(target_hex)
@@ -351,100 +479,274 @@ class MinerRPC(SimpleJsonRpcClient):
             nonce = long( hexlify(blob_bin[39:43]), 16)
             assert(len(blob_bin) == 76)
             assert(nonce >= 0)
+            if self._nicehash:
+                nonce = struct.unpack('<I', blob_bin[39:43])[0] & 0xff000000
+                nonce_end = nonce | 0xffffff
+            else:
+                nonce_end = MAX_NONCE
         except:
             log("Invalid stratum blob: %s" % blob_hex, LEVEL_ERROR)
             return
           
-        self._g_work['login_id'] = self._login_id
-        self._g_work['target'] = target
-        self._g_work['blob_bin'] = blob_bin
-        self._g_work['nonce'] = nonce
-        self._g_work['num_thrs'] = len(self._thr_list)
-        self._g_work['job_id'] = job_id
-        self._g_work['is_cryptolite'] = self._is_cryptolite
+        job = (job_id, self._login_id, blob_bin, target, nonce, self._is_cryptolite, nonce_end)
+        if self._active:
+            try:
+                self._publish_job(job)
+            except ValueError:
+                log("Invalid stratum job: %s" % job_id, LEVEL_ERROR)
+                return
+        self._job = job
+        self._live_jobs.new_job(job_id, self._login_id)
+        if self._resubmit_buffer:
+            self._resubmit()
         
         log('New job recv: target="%s" blob="%s"' % (target_hex, blob_hex), LEVEL_DEBUG)
+        if self._reconnect_stats.got_job() is not None:
+            stats = self._reconnect_stats
+            log("Reconnected: relogin in %.3fs, first job in %.3fs (%d reconnects)" % (stats.last_relogin_time, 
+                stats.last_job_time, stats.reconnects), LEVEL_INFO)
         if difficulty != self._cur_stratum_diff:
             log("Stratum difficulty set to %.f" % difficulty, LEVEL_INFO)
             self._cur_stratum_diff = difficulty
+    
+    def _publish_job(self, job):
+        job_id, login_id, blob_bin, target, nonce, is_cryptolite, nonce_end = job
+        # randomized scans start anywhere in the range (and wrap around)
+        start = random.randint(0, nonce_end - nonce) if OPT_RANDOMIZE else 0
+        self._g_work.publish(job_id, login_id, blob_bin, target, nonce, len(self._thr_list), is_cryptolite, 
+                             nonce_end, start)
+    
+    def set_active(self, active):
+        '''Make this client the one the workers mine for, or a standby (failover groups).'''
+        with self._lock:
+            self._active = active
+            if not active:
+                return
+            if self._job is None or not self.has_job:
+                self._g_work.invalidate()
+                return
+            try:
+                self._publish_job(self._job)
+            except ValueError:
+                log("Invalid stratum job: %s" % self._job[0], LEVEL_ERROR)
+    
+    def flush(self, timeout):
+        '''Wait up to `timeout` seconds for the queued shares to be sent and replied,
+        before a shutdown (serve_forever must still be running).'''
+        deadline = time.time() + timeout
+        while time.time() < deadline and not self.exit.is_set() and not self.connection_lost.is_set():
+            with self._lock:
+                if (not self._active or self._work_submit_queue.empty()) and not self._requests.count('submit'):
+                    return True
+            time.sleep(.05)
+        return False
         
   
     def serve_forever(self):
         self.try_connect()
-        start = time.time()
         while not self.exit.is_set():
-            if not self._work_submit_queue.empty():
-                work_submit = self._work_submit_queue.get()
+            if self.connection_lost.is_set():
+                # the reader saw the connection go, don't wait for a send to fail
+                self.try_connect()
+                continue
+            
+            work_submit = self._next_share()
+            if work_submit is not None:
                 try:
-                    self.send(method=work_submit['method'], params=work_submit['params'])
-                    start = time.time() + OPT_PING_INTERVAL # delay sending 'ping'
+                    if not self._submit(work_submit):
+                        continue    # dropped as stale, on to the next one
                 except socket.error, e:
                     #print >> sys.stderr, e
                     self.try_connect()
                     continue
-            elif OPT_SEND_PING:
-                """ 'ping' stratum server periodically to detect disconnection """
-                elapsed = time.time() - start
-                if elapsed >= OPT_PING_INTERVAL:
-                    try:
-                        self.send(method='ping', params=None)
-                    except socket.error:
-                        self.try_connect()
-                        continue
-                    finally:
-                        start = time.time()            
-            time.sleep(.1)
+            
+            self._check_timeouts()
+            self._check_liveness()
     
-    def try_connect(self):
-        url = urlparse.urlparse(self.url)
-        hostname = url.hostname or ''
-        port = url.port or 3333
-          
-        while not self.exit.is_set():
-            if not self._my_sock:
-                log('Connecting to RPC server [%s:%d]...' % (hostname, port), LEVEL_INFO)
-                self._my_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._sock_keep_alive()
+    def _next_share(self):
+        '''The next share found by the workers, waiting up to .1s for one.
+        The wait ends the moment a share is queued, the timeout only paces the checks of the loop.'''
+        if not self._active:
+            # a standby of a failover group leaves the shares to the active member
+            self.connection_lost.wait(.1)
+            return None
+        try:
+            return self._work_submit_queue.get(timeout=.1)
+        except Empty:
+            return None
+    
+    def _submit(self, work_submit):
+        '''Send a share found by the workers, unless the pool would refuse it as stale.
+        Shares of the jobs live when the connection was lost are kept for the relogin.'''
+        params = work_submit['params']
+        job_id = params.get('job_id')
+        if not self._live_jobs.is_live(job_id, params.get('id')):
+            if not self._live_jobs.was_lost(job_id, params.get('id')):
+                self._share_stats.drop()
+                log("Stale share dropped (job %s)" % job_id, LEVEL_DEBUG)
+                return None
+            with self._lock:
+                if self._live_jobs.current is None:
+                    # not logged in again yet
+                    self._resubmit_buffer.add(params, work_submit.get('found_time'))
+                    return None
+            if not self._live_jobs.is_live(job_id, self._login_id):
+                self._share_stats.expired += 1
+                return None
+            self._share_stats.recovered += 1
+            params = dict(params, id=self._login_id)
+        return self.send(method=work_submit['method'], params=params)
+    
+    def submit_share(self, params):
+        '''Submit a share found by someone else (proxied miners) for the current login.
+        Returns the request sent, None if its job is no longer live or the pool is away.'''
+        with self._lock:
+            if not self._live_jobs.is_live(params.get('job_id'), self._login_id):
+                return None
+            try:
+                return self.send(method='submit', params=dict(params, id=self._login_id))
+            except (socket.error, self.ClientException):
+                return None
+    
+    def _resubmit(self):
+        '''Resubmit the shares kept while reconnecting whose job the pool handed out again.'''
+        shares, expired = self._resubmit_buffer.take()
+        recovered = 0
+        for params in shares:
+            if self._live_jobs.is_live(params.get('job_id'), self._login_id):
+                self.send(method='submit', params=dict(params, id=self._login_id))
+                recovered += 1
             else:
-                log("Network error! Reconnecting...", LEVEL_ERROR)
-                # (try to) stop all mining jobs by setting global job_id as None
-                self._g_work['job_id'] = None
-                # and clear submit works remain in queue if any
-                while not self._work_submit_queue.empty():
-                    _ = self._work_submit_queue.get()
-                
+                expired += 1
+        self._share_stats.recovered += recovered
+        self._share_stats.expired += expired
+        log("Shares found while reconnecting: %d resubmitted, %d expired" % (recovered, expired), LEVEL_INFO)
+    
+    def _check_timeouts(self):
+        '''Reconnect when a login or submit got no reply in time.'''
+        with self._lock:
+            expired = self._requests.expired()
+        # unreplied probes are counted by the liveness check
+        methods = set(request.get('method') for request in expired) - set([PROBE_METHOD])
+        if not methods:
+            return
+        log("No reply to %s in time" % ", ".join(sorted(methods)), LEVEL_ERROR)
+        # reconnect rather than relogin, shares of the old login would be rejected
+        self.try_connect()
+    
+    def _check_liveness(self):
+        '''Probe the connection when the pool has been quiet for a while,
+        reconnect when probes go unreplied.'''
+        if not OPT_SEND_PING:
+            return
+        with self._lock:
+            if not self.has_job:
+                return  # not logged in, the login timeout watches the connection
+            action = self._liveness.poll()
+            if action == PROBE:
                 try:
-                    self._my_sock.close()
-                except:
-                    pass
-                else:
-                    self._my_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self._sock_keep_alive()
-              
+                    self._probe()
+                except socket.error:
+                    action = DEAD
+        if action == DEAD:
+            log("No reply to %d keepalive probes, reconnecting" % self._liveness.missed, LEVEL_ERROR)
+            self.try_connect()
+    
+    def _probe(self):
+        if self._liveness.supported is False:
+            self.send(method='ping', params=None)
+            self._liveness.ping_sent()
+            return
+        request = self.send(method=PROBE_METHOD, params={'id': self._login_id})
+        if request is not None:
+            self._liveness.probe_sent(request['id'])
+    
+    def _pool_address(self):
+        url = urlparse.urlparse(self.url)
+        return (url.hostname or '', url.port or 3333)
+    
+    def _use_ssl(self):
+        return False
+    
+    def _on_connecting(self, hostname, port):
+        log('Connecting to RPC server [%s:%d]...' % (hostname, port), LEVEL_INFO)
+    
+    def _on_connected(self):
+        pass
+    
+    def _on_network_error(self):
+        self._reconnect_stats.lost()
+        # requests sent on the lost connection will never be replied,
+        # its unreplied shares are kept for resubmitting after the relogin
+        with self._lock:
+            for request in self._requests.clear():
+                if request.get('method') == 'submit':
+                    self._resubmit_buffer.add(request['params'])
+        log("Network error! Reconnecting...", LEVEL_ERROR)
+        # (try to) stop all mining jobs by setting global job_id as None
+        if self._active:
+            self._g_work.invalidate()
+        # shares still queued or in flight are dropped when taken from the queue
+        self._live_jobs.invalidate()
+    
+    def _on_login_error(self, error):
+        log("Error %d: %s" % (error.get('code'), error.get('message')), LEVEL_ERROR)
+    
+    def try_connect(self):
+        hostname, port = self._pool_address()
+        
+        if not self._my_sock:
+            self._on_connecting(hostname, port)
+        else:
+            self._on_network_error()
+            self._close_sock()
+        while not self.exit.is_set():
+            self.exit.wait(self._backoff.next())
+            if self.exit.is_set():
+                break
             try:
-                self._my_sock.connect((hostname, port))
+                # all addresses of the pool (IPv4 and IPv6) race, first to answer wins
+                self._my_sock = race_connect(self._addresses.resolve(hostname, port), 
+                                             setup=self._sock_keep_alive, exit=self.exit)
                 self.connect(self._my_sock)
             except socket.error:
-                time.sleep(10)
+                self._addresses.forget(hostname, port)
+                self._on_network_error()
+                self._close_sock()
             else:
                 self._login()
+                self._on_connected()
                 break
     
-    def _sock_keep_alive(self):
+    def _close_sock(self):
+        if self._my_sock is None:
+            return
+        try:
+            # close() alone doesn't wake the reader blocked on the socket
+            self._my_sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        try:
+            self._my_sock.close()
+        except:
+            pass
+        self._my_sock = None
+    
+    def _sock_keep_alive(self, sock):
         after_idle_sec = 1
         interval_sec= 3
         my_os = platform.system()
         try:
             if my_os == "Windows":
-                self._my_sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec*1000, interval_sec*1000))
+                sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec*1000, interval_sec*1000))
             elif my_os == "Linux":
-                self._my_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
             elif my_os == "Darwin":
                 TCP_KEEPALIVE = 0x10
-                self._my_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                self._my_sock.setsockopt(socket.IPPROTO_TCP, TCP_KEEPALIVE, interval_sec)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.setsockopt(socket.IPPROTO_TCP, TCP_KEEPALIVE, interval_sec)
         except:
             pass
     
@@ -463,125 +765,159 @@ class MinerRPC(SimpleJsonRpcClient):
             self._last_check_idle_time = time.time()
 
       
-class MinerWork(Process):
-    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level):
-        Process.__init__(self)
+class AsyncMinerRPC(ReactorClientMixin, MinerRPC):
+    '''MinerRPC running on a reactor in the serve_forever() thread, shares
+    are sent as soon as workers put them in the channel.'''
+    def __init__(self, *args, **kwargs):
+        MinerRPC.__init__(self, *args, **kwargs)
+        self._reactor_init(log=lambda msg: log(msg, LEVEL_ERROR))
+    
+    def _periodic(self):
+        self._check_timeouts()
+        self._check_liveness()
+
+
+RPC_ENGINE_THREAD = 'thread'
+RPC_ENGINE_REACTOR = 'reactor'
+RPC_ENGINES = {RPC_ENGINE_THREAD: MinerRPC, RPC_ENGINE_REACTOR: AsyncMinerRPC}
+
+      
+class MinerWorkBase(object):
+    ''' Hashing loop shared by all worker engines '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report):
         self._cur_job_id = None
         self._hash_rate = 0.0
         self._thr_id = thr_id
         self._work_submit_queue = work_submit_queue
         self._g_work = g_work
-        self._hash_report_queue = hash_report
-        self.exit = Event()
-        
-        _p = psutil.Process(self.pid)
-        _cpu_affinity = [CPU_COUNT - (thr_id % CPU_COUNT) - 1]
-        if sys.platform == "win32":
-            _p.cpu_affinity(_cpu_affinity)
-        _p.nice(cpu_priority_level)
+        self._hash_counters = hash_report
+        self.aes_ni = HAS_AES_NI
   
     def run(self):
         _total_hashes = 0
           
         blob_bin = None
-        nonce = 1
-        max_nonce = target = login_id = 0
-        #end_nonce = 0xffffffff - 0x20
-        end_nonce = 0
+        target = login_id = 0
         is_cryptolite = 0        # (if) is cryptonight-lite algo
-          
+        
+        job_version = None
+        work = None
         while not self.exit.is_set():
             try:
-                if not 'job_id' in self._g_work or self._g_work['job_id'] is None:
+                """ check job version locally, take a snapshot only if it has changed """
+                if self._g_work.version != job_version:
+                    job_version, work = self._g_work.read()
+                
+                if work is None:
+                    self._cur_job_id = None
                     self._hash_rate = 0.
-                    self._shareHashRate()
-                    time.sleep(.1)
+                    self._hash_counters.beat(self._thr_id)    # heartbeat for the supervisor
+                    # sleep until a new job is published (or shutdown)
+                    self._g_work.wait(job_version, timeout=1.)
                     continue
                 
-                if self._g_work['job_id'] != self._cur_job_id:
-                    self._cur_job_id = self._g_work['job_id']
-                    nonce = self._g_work['nonce']
-                    blob_bin = self._g_work['blob_bin']
-                    target = self._g_work['target']
-                    login_id = self._g_work['login_id']
-                    is_cryptolite = self._g_work['is_cryptolite']
-                    end_nonce = 0xffffffff /self._g_work['num_thrs']*(self._thr_id + 1) - 0x20
-                    nonce += 0xffffffff/self._g_work['num_thrs']*self._thr_id
-                    """ randomize nonce start"""
-                    if OPT_RANDOMIZE:
-                        offset = int(OPT_SCANTIME*self._hash_rate) if self._hash_rate > 0 else OPT_SCANTIME*64
-                        nonce += random.randint(0, 0xffffffff/self._g_work['num_thrs'] - offset)
-                    if nonce > 0xffffffff:
-                        nonce = end_nonce
+                if work['job_id'] != self._cur_job_id:
+                    self._cur_job_id = work['job_id']
+                    blob_bin = work['blob_bin']
+                    target = work['target']
+                    login_id = work['login_id']
+                    is_cryptolite = work['is_cryptolite']
                 
                 max64 = int(OPT_SCANTIME*self._hash_rate) if self._hash_rate > 0 else 64                     
-                if nonce + max64 > end_nonce:
-                    #nonce = end_nonce - max64*2
-                    max_nonce = end_nonce
-                else:
-                    max_nonce = nonce + max64                
                 
                 """ start hash scan """
                 start = _start = time.time()
                 hashes_done = total_hashes_done = 0
-                while nonce <= max_nonce and not self.exit.is_set():
-                    nonce_bin = struct.pack("<I", nonce)
-                    blob_bin = blob_bin[:39] + nonce_bin + blob_bin[43:]
+                stale = lambda: self._g_work.version != job_version or self.exit.is_set()
+                while total_hashes_done < max64 and not self.exit.is_set():
+                    """ claim a time-budgeted chunk of the job's nonces, scan it unless the job is replaced """
+                    count = int(OPT_BATCH_TIME*self._hash_rate) if self._hash_rate > 0 else 1
+                    claimed = self._g_work.claim(job_version, max(count, 1))
+                    if claimed is None:
+                        break   # a new job, or all nonces of this one taken
+                    nonce, count = claimed
+                    found, count = scan_nonces(blob_bin, nonce, count, target, is_cryptolite, self.aes_ni, stale)
                     
-                    if is_cryptolite:
-                        _hash = cryptolite_hash(blob_bin, HAS_AES_NI)
-                    else:
-                        _hash = cryptonite_hash(blob_bin, HAS_AES_NI)
+                    for found_nonce, _hash in found:
+                        """ Yes, hash found! """
+                        params = dict(id=login_id, job_id = self._cur_job_id, 
+                                      nonce=hexlify(struct.pack("<I", found_nonce)), result=hexlify(_hash))
+                        self._work_submit_queue.put({'method': 'submit', 'params': params, 'found_time': time.time()})
                   
-                    nonce += 1
-                    hashes_done += 1
-                    total_hashes_done += 1
+                    self._hash_counters.add(self._thr_id, count)
+                    hashes_done += count
+                    total_hashes_done += count
                     
                     """ calculate hashrate regularly """
                     if hashes_done > self._hash_rate*2:
                         elapsed = time.time() - _start
                         if elapsed > 0.1:
                             self._hash_rate = hashes_done/elapsed
-                            """ share _hash rate """
-                            self._shareHashRate()
                             log('CPU #%d: %.2f H/s' % (self._thr_id, self._hash_rate), LEVEL_DEBUG)
                             _start = time.time()
                             hashes_done = 0
                       
-                    if struct.unpack("<I", _hash[28:])[0] < target:
-                        """ Yes, hash found! """
-                        params = dict(id=login_id, job_id = self._cur_job_id, 
-                                      nonce=hexlify(nonce_bin), result=hexlify(_hash))
-                        self._work_submit_queue.put({'method': 'submit', 'params': params})
-                        break
-                      
                     """ if there is a new work, break scan """
-                    if self._g_work['job_id'] != self._cur_job_id:
+                    if self._g_work.version != job_version:
                         break
                 
                 """ calculate hashrate """
                 elapsed = time.time() - start
                 self._hash_rate = total_hashes_done/elapsed if elapsed > 0 else 0.
                 log('CPU #%d: %.2f H/s' % (self._thr_id, self._hash_rate), LEVEL_DEBUG)
-                self._shareHashRate()
                 
-                """ if idle: """
+                """ if idle: all nonces of the job are taken, wait for the next one """
                 if total_hashes_done == 0:
-                    time.sleep(.1)
+                    self._hash_counters.beat(self._thr_id)
+                    self._g_work.wait(job_version, timeout=1.)
             
             except KeyboardInterrupt:
-                return
-        
-        ## Set hash_rate to 0.0 before exit
-        self._hash_rate = 0.        
-        self._shareHashRate()
-    
-    def _shareHashRate(self):
-        self._hash_report_queue.update({'%d' % self._thr_id: self._hash_rate})
+                break
         
     def shutdown(self):
         log("Miner thread# %d shutdown initiated" % self._thr_id, LEVEL_DEBUG)
         self.exit.set()
+        self._g_work.wake()
+
+
+class MinerWork(MinerWorkBase, Process):
+    ''' Worker engine running each mining thread in its own process '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level, cpu=None):
+        Process.__init__(self)
+        MinerWorkBase.__init__(self, thr_id, work_submit_queue, g_work, hash_report)
+        self.exit = Event()
+        self._cpu = cpu
+        
+        _p = psutil.Process(self.pid)
+        _cpu_affinity = [CPU_COUNT - (thr_id % CPU_COUNT) - 1]
+        if sys.platform == "win32":
+            _p.cpu_affinity(_cpu_affinity)
+        _p.nice(cpu_priority_level)
+    
+    def run(self):
+        """ pin to the logical CPU chosen by the placement engine (Linux) """
+        if self._cpu is not None:
+            try:
+                psutil.Process().cpu_affinity([self._cpu])
+                log('CPU #%d: pinned to logical CPU %d' % (self._thr_id, self._cpu), LEVEL_DEBUG)
+            except Exception, e:
+                log('CPU #%d: failed to set CPU affinity: %s' % (self._thr_id, e), LEVEL_ERROR)
+        MinerWorkBase.run(self)
+
+
+class MinerThread(MinerWorkBase, threading.Thread):
+    ''' Worker engine running mining threads inside this process '''
+    def __init__(self, thr_id, work_submit_queue, g_work, hash_report, cpu_priority_level, cpu=None):
+        # `cpu` placement is not applied to threads, they float within the process
+        threading.Thread.__init__(self)
+        MinerWorkBase.__init__(self, thr_id, work_submit_queue, g_work, hash_report)
+        self.daemon = True
+        self.exit = threading.Event()
+
+
+WORKER_ENGINE_PROCESS = 'process'
+WORKER_ENGINE_THREAD = 'thread'
+WORKER_ENGINES = {WORKER_ENGINE_PROCESS: MinerWork, WORKER_ENGINE_THREAD: MinerThread}
 
 def get_cpu_priority_level(priority_level):
     cpu_priority_level = NORMAL_CPU_PRIORITY_LEVEL
@@ -595,6 +931,155 @@ def get_cpu_priority_level(priority_level):
         cpu_priority_level = VERY_HIGH_CPU_PRIORITY_LEVEL
     return cpu_priority_level
 
+def get_worker_cpu(thr_id, is_cryptolite):
+    '''Logical CPU to pin a worker to, None to let the OS decide.'''
+    if not OPT_CPU_PLACEMENT:
+        return None
+    return worker_cpu(thr_id, SCRATCHPAD_SIZE_LIGHT if is_cryptolite else SCRATCHPAD_SIZE)
+
+# fixed job for offline benchmarks: 76-byte hashing blob, nonce at [39:43]
+BENCHMARK_BLOB = unhexlify('0606a1b3c2d205' 
+                           '3c5e2a4b6f1d8e0a9b7c3d2e1f0a4b5c6d7e8f9a0b1c2d3e4f5a6b7c8d9e0f1a'
+                           '00000000'
+                           '9d1f2e3c4b5a69788796a5b4c3d2e1f00f1e2d3c4b5a69788796a5b4c3d2e1f0'
+                           '05')
+BENCHMARK_TARGET = 0xffffffff/5000  # difficulty 5000
+
+def _memory_usage(proc):
+    '''RSS of a process and all its children, in bytes'''
+    rss = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+def run_benchmark(engine, threads, duration, is_cryptolite=False, warm_up=1., aes_ni=HAS_AES_NI, 
+                  sample_interval=.5):
+    '''Hash the fixed benchmark job locally (no network) with `threads` workers
+    of the given engine, returns a dict of measured stats.
+    
+    Warm-up time is how long the slowest worker took to report its first
+    hashes; sampling starts `warm_up` seconds later, every `sample_interval`
+    seconds for `duration` seconds.'''
+    g_work = JobSlot()
+    work_submit_queue = Queue()
+    hash_counters = HashCounters()
+    proc = psutil.Process()
+    
+    start = time.time()
+    thr_list = []
+    for thr_id in range(threads):
+        p = WORKER_ENGINES[engine](thr_id, work_submit_queue, g_work, hash_counters, 
+                                   proc.nice(), cpu=get_worker_cpu(thr_id, is_cryptolite))
+        p.aes_ni = aes_ni
+        p.start()
+        thr_list.append(p)
+    start_time = time.time() - start
+    
+    start = time.time()
+    g_work.publish('benchmark', 'benchmark', BENCHMARK_BLOB, BENCHMARK_TARGET, 0, threads, is_cryptolite)
+    while not all(hash_counters.hashes(thr_id) for thr_id in range(threads)):
+        if time.time() - start > duration + 60:
+            break
+        time.sleep(.01)
+    warm_up_time = time.time() - start
+    time.sleep(warm_up)
+    
+    first_hashes = hash_counters.snapshot()
+    first_time = time.time()
+    meter = HashRateMeter(hash_counters, min_interval=0.)
+    samples = []
+    while time.time() - first_time < duration:
+        time.sleep(min(sample_interval, max(duration - (time.time() - first_time), 0.01)))
+        samples.append(meter.update())
+    elapsed = time.time() - first_time
+    thread_hashrates = [(h - f)/elapsed for h, f in zip(hash_counters.snapshot()[:threads], first_hashes)]
+    memory = _memory_usage(proc)
+    
+    shares = 0
+    start = time.time()
+    for p in thr_list:
+        p.shutdown()
+    while any(p.is_alive() for p in thr_list):
+        # drain found shares, so process workers can flush their queue and exit
+        while not work_submit_queue.empty():
+            _ = work_submit_queue.get()
+            shares += 1
+        time.sleep(.01)
+    for p in thr_list:
+        p.join()
+    stop_time = time.time() - start
+    
+    hashrate = sum(thread_hashrates)
+    mean = sum(samples)/len(samples)
+    variance = sum((x - mean)**2 for x in samples)/len(samples)
+    return {
+        'engine': engine,
+        'algo': ALGORITHM_CRYPTOLIGHT if is_cryptolite else ALGORITHM_CRYPTONIGHT,
+        'aes_ni': aes_ni,
+        'threads': threads,
+        'hashrate': hashrate,
+        'thread_hashrates': thread_hashrates,
+        'hashrate_variance': variance,
+        'hashrate_stdev': variance**.5,
+        'samples': samples,
+        'warm_up_time': warm_up_time,
+        'shares': shares,
+        'memory': memory,
+        'start_time': start_time,
+        'stop_time': stop_time,
+    }
+
+def run_benchmark_suite(algos, thread_counts, aes_modes, engines, duration):
+    '''Run the benchmark for every combination, returns the list of results.'''
+    results = []
+    for algo in algos:
+        for threads in thread_counts:
+            for aes_ni in aes_modes:
+                for engine in engines:
+                    log("Benchmarking %s, %d threads, %s, %s engine (%.1fs)..." % (algo, threads, 
+                        'AES-NI' if aes_ni else 'software AES', engine, duration), LEVEL_INFO)
+                    res = run_benchmark(engine, threads, duration, algo == ALGORITHM_CRYPTOLIGHT, 
+                                        aes_ni=aes_ni)
+                    results.append(res)
+                    log("%s +/- %s (per thread: %s), warm-up %.3fs, start %.3fs, stop %.3fs, memory %.1f MB" % (
+                        human_readable_hashrate(res['hashrate']), human_readable_hashrate(res['hashrate_stdev']), 
+                        ', '.join(human_readable_hashrate(r) for r in res['thread_hashrates']), 
+                        res['warm_up_time'], res['start_time'], res['stop_time'], res['memory']/1048576.), LEVEL_INFO)
+    return results
+
+def benchmark_report(results):
+    '''Machine readable benchmark report'''
+    return {
+        'version': '%s v.%s' % (USER_AGENT, '.'.join(str(v) for v in VERSION)),
+        'hardware': tuner.hardware_id(),
+        'has_aes_ni': HAS_AES_NI,
+        'time': int(time.time()),
+        'results': results,
+    }
+
+def run_tuner(engine, max_threads, duration):
+    '''Find the best worker count of each algorithm on this host and store
+    it in the hardware profile, used as default by the app and this client.'''
+    profile = tuner.new_profile(engine)
+    for algo in ALGORITHMS:
+        def measure(threads):
+            res = run_benchmark(engine, threads, duration, algo == ALGORITHM_CRYPTOLIGHT)
+            log("%s, %d threads: %s" % (algo, threads, human_readable_hashrate(res['hashrate'])), LEVEL_INFO)
+            return res['hashrate']
+        
+        log("Tuning %s (%s engine, up to %d threads, %.1fs per step)..." % (algo, engine, 
+                                                                          max_threads, duration), LEVEL_INFO)
+        knee, steps = tuner.tune_algo(measure, max_threads)
+        tuner.set_algo_result(profile, ALGORITHM_NAMES[algo], knee, steps)
+        log("%s: best with %d threads (%s)" % (algo, knee, 
+                human_readable_hashrate(dict(steps)[knee])), LEVEL_INFO)
+    
+    tuner.save_profile(HARDWARE_PROFILE_PATH, profile)
+    log("Hardware profile saved to %s" % HARDWARE_PROFILE_PATH, LEVEL_INFO)
+
 if __name__ == '__main__':
     import argparse
     
@@ -608,8 +1093,22 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--url', help = 'stratum mining server url (eg: stratum+tcp://foobar.com:3333)')
     parser.add_argument('-u', '--user', dest = 'username', help = 'username for mining server')
     parser.add_argument('-p', '--pass', dest = 'password', default = 'x', help = 'password for mining server')
+    parser.add_argument('--failover', dest = 'failover_urls', action = 'append', default = [], metavar = 'URL', 
+                        help = 'pool to switch to when the previous ones are down, kept logged in (same user, can be repeated)')
+    parser.add_argument('--proxy', metavar = '[HOST:]PORT', 
+                        help = 'serve the pool to other miners on this port (stratum proxy, one pool login), no local mining')
     parser.add_argument('-t', '--threads', dest = 'threads', default = '0', help = 'number of mining threads')
     parser.add_argument('-prio', '--priority', dest = 'priority', default = 'normal', help = 'thread priority levels: idle, low, normal (default), high, very_high')
+    parser.add_argument('-e', '--engine', dest = 'engine', default = WORKER_ENGINE_PROCESS, choices = sorted(WORKER_ENGINES), 
+                        help = 'worker engine: process (default) or thread (for hash libraries releasing the GIL)')
+    parser.add_argument('--rpc-engine', dest = 'rpc_engine', default = RPC_ENGINE_THREAD, choices = sorted(RPC_ENGINES), 
+                        help = 'pool client: thread (default) or reactor (event loop, sends shares as soon as found)')
+    parser.add_argument('--no-placement', dest = 'placement', action ='store_false', help = 'do not pin workers to cores by cache topology (Linux)')
+    parser.add_argument('--benchmark', action ='store_true', help = 'hash a fixed job locally for each algorithm, thread count, AES path and worker engine, no pool needed')
+    parser.add_argument('--benchmark-threads', dest = 'benchmark_threads', help = 'comma separated thread counts to benchmark (default: -t)')
+    parser.add_argument('--benchmark-json', dest = 'benchmark_json', help = 'write benchmark results as JSON to this file (- for stdout)')
+    parser.add_argument('--benchmark-time', dest = 'benchmark_time', type = float, default = 10., help = 'seconds to hash per benchmark run (default: 10)')
+    parser.add_argument('--tune', action ='store_true', help = 'find the best number of threads for each algorithm and save it as default, no pool needed')
     
     parser.add_argument('-q', '--quiet', action ='store_true', help = 'suppress non-errors')
     parser.add_argument('-P', '--dump-protocol', dest = 'protocol', action ='store_true', help = 'show all JSON-RPC chatter')
@@ -622,7 +1121,9 @@ if __name__ == '__main__':
     options = parser.parse_args(sys.argv[1:])
         
     message = None
-    if not options.url:
+    if options.benchmark or options.tune:
+        pass
+    elif not options.url:
         message = "Pool URL must be supplied to start mining!"
     elif not options.username:
         message = "Username must be supplied to start mining!"
@@ -637,18 +1138,24 @@ if __name__ == '__main__':
     if options.debug: DEBUG = True
     if options.protocol: DEBUG_PROTOCOL = True
     if options.quiet: QUIET = True
+    if options.benchmark_json == '-': LOG_STREAM = sys.stderr
     if options.randomize: OPT_RANDOMIZE = True
+    OPT_CPU_PLACEMENT = options.placement
     
-    manager = Manager()
-    g_work = manager.dict()
-    work_submit_queue = Queue()
-    hash_report_queue = manager.dict()
+    g_work = JobSlot()
+    work_submit_queue = ShareChannel() if options.rpc_engine == RPC_ENGINE_REACTOR else Queue()
+    hash_report_queue = HashCounters()
            
-    threads = int(options.threads) if int(options.threads) > 0 else CPU_COUNT
+    threads = int(options.threads)
+    if threads <= 0:
+        # tuned default from `--tune`, else all CPUs
+        threads = tuner.profile_threads(tuner.load_profile(HARDWARE_PROFILE_PATH), 
+                                        ALGORITHM_NAMES[options.algo], CPU_COUNT)
     is_cryptolite = options.algo == ALGORITHM_CRYPTOLIGHT
     
     thr_list = []
     rpc = None
+    rpc_thread = None
     
     log('Starting [%s] in %d threads...' % (version, threads), LEVEL_INFO)
     log('CPU Supports AES-NI: %s' % ('YES' if HAS_AES_NI else 'NO'), LEVEL_INFO)
@@ -656,29 +1163,99 @@ if __name__ == '__main__':
     cpu_priority_level = get_cpu_priority_level(options.priority)
     psutil.Process().nice(cpu_priority_level)
     
+    if options.tune:
+        run_tuner(options.engine, int(options.threads) if int(options.threads) > 0 else CPU_COUNT, 
+                  options.benchmark_time)
+        sys.exit()
+    
+    if options.benchmark:
+        if options.benchmark_threads:
+            thread_counts = [int(t) for t in options.benchmark_threads.split(',') if t.strip()]
+        else:
+            thread_counts = [threads]
+        aes_modes = [True, False] if HAS_AES_NI else [False]
+        results = run_benchmark_suite(ALGORITHMS, thread_counts, aes_modes, 
+                                      [WORKER_ENGINE_PROCESS, WORKER_ENGINE_THREAD], options.benchmark_time)
+        if options.benchmark_json:
+            report = json.dumps(benchmark_report(results), indent=2)
+            if options.benchmark_json == '-':
+                print report
+            else:
+                with open(options.benchmark_json, 'w') as f:
+                    f.write(report)
+                log("Benchmark results saved to %s" % options.benchmark_json, LEVEL_INFO)
+        sys.exit()
+    
+    if options.proxy:
+        host, _, port = options.proxy.rpartition(':')
+        upstream = MinerRPC(options.url, options.username, options.password, Queue(), g_work, 
+                            hash_report_queue, is_cryptolite)
+        upstream.set_thread_list([])
+        proxy = StratumProxy(upstream, g_work, host.strip('[]') or '0.0.0.0', int(port), 
+                             log=lambda msg: log(msg, LEVEL_INFO))
+        log("Stratum proxy listening on %s" % proxy.url, LEVEL_INFO)
+        proxy.start()
+        try:
+            upstream.serve_forever()
+        except KeyboardInterrupt:
+            log("(Ctrl+C) Stop proxy...", LEVEL_INFO)
+            proxy.shutdown()
+            upstream.shutdown()
+        sys.exit()
+    
+    def start_worker(thr_id):
+        p = WORKER_ENGINES[options.engine](thr_id, work_submit_queue, g_work, hash_report_queue, 
+                                           cpu_priority_level, cpu=get_worker_cpu(thr_id, is_cryptolite))
+        p.start()
+        return p
+    
+    def respawn_worker(thr_id, old):
+        thr_list[thr_id] = start_worker(thr_id)
+        return thr_list[thr_id]
+    
+    supervisor = WorkerSupervisor(hang_timeout=OPT_WORKER_HANG_TIMEOUT, restart_delay=OPT_WORKER_RESTART_DELAY_MIN, 
+                                  restart_delay_max=OPT_WORKER_RESTART_DELAY_MAX)
     try:
         for thr_id in range(threads):
-            p = MinerWork(thr_id, work_submit_queue, g_work, hash_report_queue, cpu_priority_level)
-            p.start()
-            thr_list.append(p)
+            thr_list.append(start_worker(thr_id))
             log("Thread# %d started" % thr_id, LEVEL_DEBUG)
             time.sleep(0.2)      # stagger threads
+        # restart crashed or hung workers
+        supervisor.watch(options.url, thr_list, hash_report_queue, respawn_worker, 
+                         log=lambda msg: log(msg, LEVEL_ERROR), 
+                         report=lambda restarts: log("Worker restarts: %d" % restarts, LEVEL_INFO))
+        supervisor.start()
       
-        rpc = MinerRPC(options.url, options.username, options.password, 
-                       work_submit_queue, g_work, hash_report_queue, is_cryptolite)
+        members = [RPC_ENGINES[options.rpc_engine](url, options.username, options.password, 
+                                                   work_submit_queue, g_work, hash_report_queue, is_cryptolite)
+                   for url in [options.url] + options.failover_urls]
+        if len(members) > 1:
+            rpc = FailoverGroup(members, failover_delay=OPT_FAILOVER_DELAY, failback_delay=OPT_FAILBACK_DELAY, 
+                                log=lambda msg: log(msg, LEVEL_INFO))
+        else:
+            rpc = members[0]
         rpc.set_thread_list(thr_list)
-        rpc.serve_forever()
+        # served in a thread of its own, so it still runs to send the last shares after Ctrl+C
+        rpc_thread = threading.Thread(target=rpc.serve_forever)
+        rpc_thread.daemon = True
+        rpc_thread.start()
+        while rpc_thread.is_alive():
+            rpc_thread.join(1.)
     
     except KeyboardInterrupt:
         log("(Ctrl+C) Stop mining...", LEVEL_INFO)
-        for thr_proc in thr_list:
-            thr_proc.shutdown()
-            thr_proc.join()
+        supervisor.shutdown()
+        supervisor.unwatch(options.url)
+        # all at once, however many they are
+        stragglers = stop_workers(thr_list, OPT_STOP_TIMEOUT)
+        if stragglers:
+            log("%d workers did not stop in time and were killed" % len(stragglers), LEVEL_ERROR)
         
-        if rpc:
+        if rpc_thread is not None:
+            # the shares found until the workers stopped
+            if not rpc.flush(OPT_STOP_TIMEOUT):
+                log("Shares still unsent or unreplied at exit", LEVEL_ERROR)
             rpc.shutdown()
-
-        if manager: 
-            manager.shutdown()
+            rpc_thread.join(OPT_STOP_TIMEOUT)
         
     sys.exit()
\ No newline at end of file
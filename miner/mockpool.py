@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Local mock stratum pool, speaking the login/job/submit/keepalive dialect
+of MinerRPC, for end-to-end tests without a live pool
+'''
+
+import os, json, socket, struct, threading, time, uuid
+from binascii import hexlify, unhexlify
+
+try:
+    from cryptonite_hash import cryptolite_hash, cryptonite_hash
+except ImportError:
+    cryptolite_hash = cryptonite_hash = None
+
+MAX_INT = 0xffffffff
+
+ERROR_UNAUTHENTICATED = "Unauthenticated"
+ERROR_INVALID_JOB_ID = "Invalid job id"
+ERROR_STALE = "Block expired"
+ERROR_DUPLICATE = "Duplicate share"
+ERROR_LOW_DIFFICULTY = "Low difficulty share"
+ERROR_INVALID_RESULT = "Invalid share"
+
+def target_hex(difficulty):
+    ''' Compact stratum target ("b88d0600") of a difficulty '''
+    return hexlify(struct.pack('<I', int(MAX_INT/difficulty)))
+
+def random_blob():
+    ''' 76-byte hashing blob with the nonce (blob[39:43]) zeroed '''
+    return os.urandom(39) + '\0'*4 + os.urandom(33)
+
+
+class MockPool(object):
+    ''' Scriptable stand-in for a stratum pool.
+
+        Issues jobs on demand (new_job) or every `job_interval` seconds,
+        validates submitted shares (job, login id, duplicates, and the hash
+        itself if the hash library is available) and can inject pool errors
+        (inject_error) or drop all connections (disconnect).
+
+        With `stable_jobs` all clients share the pool's current job, which
+        stays the same across logins until new_job (like pools keyed on the
+        block template), otherwise every client gets jobs of its own.
+
+        Every login, job, submit and disconnect is recorded with its time in
+        `events`, and share outcomes are counted in `stats`.
+    '''
+    def __init__(self, host='127.0.0.1', port=0, difficulty=5000, job_interval=None,
+                 is_cryptolite=False, validate=True, stable_jobs=False):
+        self._difficulty = difficulty
+        self._job_interval = job_interval
+        self._is_cryptolite = is_cryptolite
+        self._validate = validate and cryptonite_hash is not None
+        self._stable_jobs = stable_jobs
+        self._job = None
+
+        self._lock = threading.RLock()
+        self._clients = []
+        self._errors = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self.exit = threading.Event()
+
+        self.events = {'logins': [], 'jobs': [], 'submits': [], 'disconnects': []}
+        self.stats = {'accepted': 0, 'rejected': 0, 'stale': 0, 'invalid': 0}
+
+    address = property(lambda s: s._server.getsockname())
+    url = property(lambda s: 'stratum+tcp://%s:%d' % s.address)
+
+    def start(self):
+        for target in [self._accept_loop] + ([self._job_loop] if self._job_interval else []):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        self.exit.set()
+        try:
+            self._server.close()
+        except socket.error:
+            pass
+        self.disconnect()
+
+    def inject_error(self, message, count=1):
+        ''' Reply `message` as error to the next `count` submits '''
+        with self._lock:
+            self._errors.extend([message]*count)
+
+    def disconnect(self):
+        ''' Drop all client connections, returns the time it happened '''
+        with self._lock:
+            clients, self._clients = self._clients, []
+            now = time.time()
+            if clients:
+                self.events['disconnects'].append(now)
+        for client in clients:
+            client.close()
+        return now
+
+    def new_job(self):
+        ''' Push a new job to all logged in clients, returns the time it was sent '''
+        now = time.time()
+        with self._lock:
+            if self._stable_jobs:
+                self._job = None
+            for client in self._clients:
+                if client.login_id:
+                    client.send_job()
+        return now
+
+    def _job_loop(self):
+        while not self.exit.wait(self._job_interval):
+            self.new_job()
+
+    def _accept_loop(self):
+        while not self.exit.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except socket.error:
+                break
+            client = _PoolClient(self, sock)
+            with self._lock:
+                self._clients.append(client)
+            client.start()
+
+    def _create_job(self):
+        ''' (job_id, job) of a new job '''
+        job_id = uuid.uuid4().hex
+        job = {
+            'blob': random_blob(),
+            'target': int(MAX_INT/self._difficulty),
+            'nonces': set(),
+        }
+        self._record('jobs', job_id, time.time())
+        return job_id, job
+
+    def _next_job(self):
+        ''' (job_id, job) to send a client '''
+        if not self._stable_jobs:
+            return self._create_job()
+        with self._lock:
+            if self._job is None:
+                self._job = self._create_job()
+            return self._job
+
+    def _remove_client(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def _record(self, event, *args):
+        with self._lock:
+            self.events[event].append(args)
+
+    def _next_error(self):
+        with self._lock:
+            return self._errors.pop(0) if self._errors else None
+
+    def _check_share(self, client, params):
+        ''' Returns the error message of an invalid share, None if valid '''
+        error = self._next_error()
+        if error:
+            return error
+        if params.get('id') != client.login_id:
+            return ERROR_UNAUTHENTICATED
+        job = client.jobs.get(params.get('job_id'))
+        if job is None:
+            return ERROR_INVALID_JOB_ID
+        if job is not client.jobs[client.last_job_id]:
+            return ERROR_STALE
+        nonce = params.get('nonce', '')
+        if nonce in job['nonces']:
+            return ERROR_DUPLICATE
+        try:
+            nonce_bin = unhexlify(nonce)
+            result_bin = unhexlify(params.get('result', ''))
+            assert len(nonce_bin) == 4 and len(result_bin) == 32
+        except (TypeError, AssertionError):
+            return ERROR_INVALID_RESULT
+        if self._validate:
+            hash_func = cryptolite_hash if self._is_cryptolite else cryptonite_hash
+            if hash_func(job['blob'][:39] + nonce_bin + job['blob'][43:], True) != result_bin:
+                return ERROR_INVALID_RESULT
+        if struct.unpack_from('<I', result_bin, 28)[0] >= job['target']:
+            return ERROR_LOW_DIFFICULTY
+        job['nonces'].add(nonce)
+        return None
+
+    def _count_share(self, error):
+        with self._lock:
+            if error is None:
+                self.stats['accepted'] += 1
+            else:
+                self.stats['rejected'] += 1
+                if error == ERROR_STALE:
+                    self.stats['stale'] += 1
+                elif error != ERROR_UNAUTHENTICATED:
+                    self.stats['invalid'] += 1
+
+
+class _PoolClient(threading.Thread):
+    ''' One miner connection of a MockPool '''
+    def __init__(self, pool, sock):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._pool = pool
+        self._sock = sock
+        self._send_lock = threading.Lock()
+        self.login_id = None
+        self.jobs = {}
+        self.last_job_id = None
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+            self._sock.close()
+        except socket.error:
+            pass
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self._sock.sendall(json.dumps(message) + '\n')
+            except socket.error:
+                pass
+
+    def _make_job(self):
+        job_id, job = self._pool._next_job()
+        self.jobs[job_id] = job
+        self.last_job_id = job_id
+        return {
+            'blob': hexlify(job['blob']),
+            'job_id': job_id,
+            'target': target_hex(self._pool._difficulty),
+        }
+
+    def send_job(self):
+        self._send({'jsonrpc': '2.0', 'method': 'job', 'params': self._make_job()})
+
+    def _reply(self, request, result=None, error=None):
+        self._send({'id': request.get('id'), 'jsonrpc': '2.0',
+                    'error': {'code': -1, 'message': error} if error else None,
+                    'result': result})
+
+    def run(self):
+        data = ''
+        while not self._pool.exit.is_set():
+            try:
+                chunk = self._sock.recv(4096)
+            except socket.error:
+                chunk = ''
+            if not chunk:
+                break
+            data += chunk
+            while '\n' in data:
+                line, data = data.split('\n', 1)
+                line = line.strip()     # keepalive pings are bare '\r'
+                if line:
+                    self._handle(line)
+        self._pool._remove_client(self)
+        self.close()
+
+    def _handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return
+        method = request.get('method')
+        params = request.get('params') or {}
+
+        if method == 'login':
+            if not params.get('login'):
+                self._reply(request, error=ERROR_UNAUTHENTICATED)
+                return
+            self.login_id = uuid.uuid4().hex
+            self._pool._record('logins', self.login_id, time.time())
+            self._reply(request, result={'id': self.login_id, 'job': self._make_job(), 'status': 'OK'})
+
+        elif method == 'submit':
+            received = time.time()
+            error = self._pool._check_share(self, params)
+            self._pool._count_share(error)
+            self._pool._record('submits', params.get('job_id'), params.get('nonce'), received, error)
+            if error:
+                self._reply(request, error=error)
+            else:
+                self._reply(request, result={'status': 'OK'})
+
+        elif method == 'keepalived':
+            self._reply(request, result={'status': 'KEEPALIVED'})
+
+        else:
+            self._reply(request, error="Unknown method")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Local mock stratum pool")
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on')
+    parser.add_argument('--port', type = int, default = 3333, help = 'port to listen on (default: 3333)')
+    parser.add_argument('--difficulty', type = float, default = 5000, help = 'share difficulty (default: 5000)')
+    parser.add_argument('--job-interval', dest = 'job_interval', type = float, default = 30., help = 'seconds between jobs (default: 30)')
+    parser.add_argument('--light', action ='store_true', help = 'validate shares as cryptonight-light')
+    parser.add_argument('--stable-jobs', dest = 'stable_jobs', action ='store_true', help = 'same job for all clients and logins until the next one')
+    options = parser.parse_args()
+
+    pool = MockPool(options.host, options.port, options.difficulty, options.job_interval, options.light,
+                    stable_jobs = options.stable_jobs).start()
+    print "Mock pool listening on %s" % pool.url
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
+        print json.dumps(pool.stats)
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Table of the JSON-RPC requests waiting for a reply
+'''
+
+import time
+from collections import OrderedDict
+
+from poolstats import LatencyHistogram
+
+DEFAULT_DEADLINE = 30       # seconds, for methods without a deadline of their own
+MAX_PENDING = 256           # the oldest requests are dropped beyond this
+
+
+class PendingRequests(object):
+    ''' Requests sent and not replied yet, keyed by id.
+
+        A request leaves the table when its reply arrives (pop), when its
+        deadline passes (expired) or, oldest first, when the table is full.
+        Round-trip times of the replied requests are kept per method in
+        `latency`, and the requests that timed out are counted in `timeouts`.
+    '''
+    def __init__(self, deadlines=None, default_deadline=DEFAULT_DEADLINE, max_size=MAX_PENDING):
+        self._deadlines = deadlines or {}
+        self._default_deadline = default_deadline
+        self._max_size = max_size
+        self._pending = OrderedDict()   # id: (request, sent time, deadline)
+        self.latency = {}
+        self.timeouts = {}
+        self.evicted = 0
+
+    def count(self, method):
+        ''' Pending requests of `method` '''
+        return sum(1 for request, _, _ in self._pending.itervalues() if request.get('method') == method)
+
+    def add(self, request):
+        now = time.time()
+        deadline = now + self._deadlines.get(request.get('method'), self._default_deadline)
+        self._pending[request['id']] = (request, now, deadline)
+        while len(self._pending) > self._max_size:
+            self._pending.popitem(last=False)
+            self.evicted += 1
+
+    def pop(self, request_id):
+        ''' The request replied by `request_id`, None if not pending '''
+        try:
+            entry = self._pending.pop(request_id, None)
+        except TypeError:   # not an id of ours
+            return None
+        if entry is None:
+            return None
+        request, sent, _ = entry
+        method = request.get('method')
+        if method not in self.latency:
+            self.latency[method] = LatencyHistogram()
+        self.latency[method].add(time.time() - sent)
+        return request
+
+    def expired(self):
+        ''' Removes and returns the requests past their deadline '''
+        now = time.time()
+        expired = [request_id for request_id, (_, _, deadline) in self._pending.iteritems() if deadline <= now]
+        requests = []
+        for request_id in expired:
+            request = self._pending.pop(request_id)[0]
+            method = request.get('method')
+            self.timeouts[method] = self.timeouts.get(method, 0) + 1
+            requests.append(request)
+        return requests
+
+    def clear(self):
+        ''' Forget all requests (their connection is gone, no reply will come),
+            returns them '''
+        requests = [request for request, _, _ in self._pending.itervalues()]
+        self._pending.clear()
+        return requests
+
+    def as_dict(self):
+        return {
+            'pending': len(self._pending),
+            'evicted': self.evicted,
+            'timeouts': dict(self.timeouts),
+            'latency': dict((method, h.as_dict()) for method, h in self.latency.iteritems()),
+        }
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+End-to-end performance harness: runs the miner of the app (miner.py) or of
+the command line client (miner_cli.py) against a local MockPool and measures
+
+  - job arrival to first hash: job sent by the pool until the first worker
+    starts hashing it (end of its last batch of the previous job), and until
+    all workers did
+  - share found to reply: share found by a worker until the pool's reply
+    is handled by the RPC client
+  - stale share rate: shares submitted for a job already replaced, and
+    the shares the client dropped instead of submitting
+  - reconnect time: disconnect or pool error until relogin, and until the
+    new job reached the workers
+
+Run from the app directory, e.g.:
+    python -m miner.pool_harness --client cli --json report.json
+'''
+
+import sys, json, threading, time
+from multiprocessing import Queue
+
+from shared import JobSlot, HashCounters, ShareChannel
+from mockpool import MockPool, ERROR_INVALID_JOB_ID, ERROR_UNAUTHENTICATED
+
+CLIENT_APP = 'app'
+CLIENT_CLI = 'cli'
+CLIENTS = [CLIENT_APP, CLIENT_CLI]
+
+FAULT_DISCONNECT = 'disconnect'
+FAULTS = [FAULT_DISCONNECT, ERROR_INVALID_JOB_ID, ERROR_UNAUTHENTICATED]
+
+
+class TimedSubmitQueue(object):
+    ''' Client side view of the workers' submit queue, remembering when each
+        share was found (`found_time` of the worker) by (job_id, nonce)
+    '''
+    def __init__(self, queue):
+        self._queue = queue
+        self.found = {}
+        if hasattr(queue, 'fileno'):
+            self.fileno = queue.fileno
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def empty(self):
+        return self._queue.empty()
+
+    def get(self, timeout=None):
+        item = self._queue.get(timeout=timeout)
+        params = item.get('params') or {}
+        if 'found_time' in item:
+            self.found[(params.get('job_id'), params.get('nonce'))] = item['found_time']
+        return item
+
+
+def timed_rpc_class(base, replies):
+    ''' MinerRPC sub-class recording when each submit reply is handled '''
+    class TimedMinerRPC(base):
+        def handle_reply(self, request, reply):
+            if request and request.get('method') == 'submit':
+                params = request.get('params') or {}
+                replies.append((params.get('job_id'), params.get('nonce'), time.time()))
+            base.handle_reply(self, request, reply)
+    return TimedMinerRPC
+
+
+class MinerClient(object):
+    ''' Workers and RPC client of either miner, connected to `url` '''
+    def __init__(self, client, url, threads, engine, rpc_engine='thread', is_cryptolite=False, debug=False):
+        self.g_work = JobSlot()
+        self.hash_counters = HashCounters()
+        self.threads = threads
+        self.replies = []
+        work_submit_queue = ShareChannel() if rpc_engine == 'reactor' else Queue()
+        self.submit_queue = TimedSubmitQueue(work_submit_queue)
+
+        if client == CLIENT_CLI:
+            import miner_cli as m
+            m.QUIET = not debug
+            m.DEBUG = debug
+            self.rpc = timed_rpc_class(m.RPC_ENGINES[rpc_engine], self.replies)(url, 'harness', 'x', self.submit_queue,
+                                                                  self.g_work, self.hash_counters, is_cryptolite)
+            self._rpc_thread = threading.Thread(target=self.rpc.serve_forever)
+        else:
+            import miner as m       # miner/miner.py, the app's miner
+            pool_info = {
+                'id': 'harness',
+                'url': url,
+                'username': 'harness',
+                'password': 'x',
+                'algo': 'Cryptonight-Light' if is_cryptolite else 'Cryptonight',
+                'hash_report': self.hash_counters,
+            }
+            self.rpc = timed_rpc_class(m.RPC_ENGINES[rpc_engine], self.replies)(pool_info, self.submit_queue,
+                                                                  self.g_work, {})
+            self._rpc_thread = self.rpc     # a thread, or started on the shared reactor
+        self._rpc_thread.daemon = True
+
+        self.thr_list = []
+        for thr_id in range(threads):
+            p = m.WORKER_ENGINES[engine](thr_id, work_submit_queue, self.g_work, self.hash_counters, 0)
+            p.start()
+            self.thr_list.append(p)
+        self.rpc.set_thread_list(self.thr_list)
+
+    def start(self):
+        self._rpc_thread.start()
+
+    def stop(self):
+        for p in self.thr_list:
+            p.shutdown()
+        self.rpc.shutdown()
+        while any(p.is_alive() for p in self.thr_list):
+            # drain found shares, so process workers can flush their queue and exit
+            while not self.submit_queue.empty():
+                self.submit_queue.get()
+            time.sleep(.01)
+
+
+def _wait(condition, timeout, interval=.001):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            return False
+        time.sleep(interval)
+    return True
+
+def _stats(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values)/len(values),
+        'median': values[len(values)//2],
+        'max': values[-1],
+    }
+
+def measure_job_switch(pool, miner, timeout):
+    ''' Send a new job, returns (first worker, all workers) switch latency '''
+    version = miner.g_work.version
+    sent = pool.new_job()
+    if not _wait(lambda: miner.g_work.version != version, timeout):
+        return None, None
+    published = time.time()
+    # a worker notices the job at the end of the batch it was hashing when the
+    # job was published, i.e. at its first hash counter update after that
+    switched = {}
+    def all_switched():
+        for thr_id in range(miner.threads):
+            if thr_id not in switched and miner.hash_counters.last_update(thr_id) >= published:
+                switched[thr_id] = miner.hash_counters.last_update(thr_id)
+        return len(switched) == miner.threads
+    _wait(all_switched, timeout)
+    if not switched:
+        return None, None
+    return min(switched.values()) - sent, max(switched.values()) - sent
+
+def measure_fault(pool, miner, fault, timeout):
+    ''' Inject a fault, returns (time to relogin, time to new job in the workers' slot) '''
+    logins = len(pool.events['logins'])
+    if fault == FAULT_DISCONNECT:
+        start = pool.disconnect()
+    else:
+        submits = len(pool.events['submits'])
+        pool.inject_error(fault)
+        rejected = lambda: [s for s in pool.events['submits'][submits:] if s[3] == fault]
+        if not _wait(rejected, timeout):
+            return None, None
+        start = rejected()[0][2]
+
+    relogins = lambda: [t for _, t in pool.events['logins'][logins:] if t >= start]
+    if not _wait(relogins, timeout):
+        return None, None
+    relogin = relogins()[0] - start
+
+    new_jobs = lambda: set(job_id for job_id, sent in pool.events['jobs'] if sent >= start)
+    if not _wait(lambda: miner.g_work.read()[1] is not None and
+                         miner.g_work.read()[1]['job_id'] in new_jobs(), timeout):
+        return relogin, None
+    return relogin, time.time() - start
+
+def run_harness(client, threads=2, engine='process', difficulty=1000, jobs=10, job_time=1.,
+                is_cryptolite=False, timeout=60., debug=False, rpc_engine='thread'):
+    pool = MockPool(difficulty=difficulty, is_cryptolite=is_cryptolite).start()
+    miner = MinerClient(client, pool.url, threads, engine, rpc_engine, is_cryptolite, debug)
+    miner.start()
+    try:
+        if not _wait(lambda: miner.g_work.read()[1] is not None, timeout):
+            raise RuntimeError("%s miner did not log in to the mock pool" % client)
+
+        first_hash = []
+        all_workers = []
+        for _ in range(jobs):
+            time.sleep(job_time)
+            first, last = measure_job_switch(pool, miner, timeout)
+            if first is not None:
+                first_hash.append(first)
+                all_workers.append(last)
+
+        reconnects = {}
+        for fault in FAULTS:
+            time.sleep(job_time)
+            relogin, new_job = measure_fault(pool, miner, fault, timeout)
+            reconnects[fault] = {'relogin': relogin, 'new_job': new_job}
+        time.sleep(job_time)
+    finally:
+        miner.stop()
+        pool.stop()
+
+    share_reply = []
+    for job_id, nonce, replied in miner.replies:
+        found = miner.submit_queue.found.get((job_id, nonce))
+        if found is not None:
+            share_reply.append(replied - found)
+    submitted = pool.stats['accepted'] + pool.stats['rejected']
+    return {
+        'client': client,
+        'engine': engine,
+        'rpc_engine': rpc_engine,
+        'threads': threads,
+        'difficulty': difficulty,
+        'job_to_first_hash': _stats(first_hash),
+        'job_to_all_workers': _stats(all_workers),
+        'share_found_to_reply': _stats(share_reply),
+        'shares': pool.stats,
+        'stale_rate': float(pool.stats['stale'])/submitted if submitted else 0.,
+        'client_shares': miner.rpc.share_stats,
+        'reconnects': reconnects,
+    }
+
+def _print_report(report):
+    def fmt(stats):
+        if not stats:
+            return 'n/a'
+        return 'mean %.1f ms, median %.1f ms, max %.1f ms (%d)' % (stats['mean']*1000, stats['median']*1000,
+                                                                  stats['max']*1000, stats['count'])
+    print '[%s miner, %s engine, %d threads, %s client]' % (report['client'], report['engine'], report['threads'],
+                                                          report['rpc_engine'])
+    print '  job to first hash:    %s' % fmt(report['job_to_first_hash'])
+    print '  job to all workers:   %s' % fmt(report['job_to_all_workers'])
+    print '  share found to reply: %s' % fmt(report['share_found_to_reply'])
+    print '  stale share rate:     %.2f%% (%s)' % (report['stale_rate']*100, json.dumps(report['shares']))
+    shares = report['client_shares']
+    print '  dropped before submit: %d, rejects seen: %s' % (shares['dropped'],
+        json.dumps(dict((r, n) for r, n in shares['rejected'].items() if n)))
+    print '  found while reconnecting: %d resubmitted, %d expired' % (shares['recovered'], shares['expired'])
+    for fault, times in sorted(report['reconnects'].items()):
+        print '  reconnect on %-16s relogin %s, new job %s' % (fault + ':',
+            '%.3fs' % times['relogin'] if times['relogin'] is not None else 'FAILED',
+            '%.3fs' % times['new_job'] if times['new_job'] is not None else 'FAILED')
+
+def check_limits(report, max_first_hash=None, max_share_reply=None, max_reconnect=None):
+    ''' Returns a list of failed limits '''
+    failures = []
+    if max_first_hash is not None and (not report['job_to_first_hash'] or
+                                       report['job_to_first_hash']['max'] > max_first_hash):
+        failures.append('job to first hash')
+    if max_share_reply is not None and (not report['share_found_to_reply'] or
+                                        report['share_found_to_reply']['max'] > max_share_reply):
+        failures.append('share found to reply')
+    if max_reconnect is not None:
+        for fault, times in report['reconnects'].items():
+            if times['new_job'] is None or times['new_job'] > max_reconnect:
+                failures.append('reconnect on %s' % fault)
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Measure miner latencies against a local mock stratum pool")
+    parser.add_argument('-c', '--client', choices = CLIENTS + ['all'], default = 'all', help = 'miner to test (default: all)')
+    parser.add_argument('-t', '--threads', type = int, default = 2, help = 'number of mining threads (default: 2)')
+    parser.add_argument('-e', '--engine', default = 'process', choices = ['process', 'thread'], help = 'worker engine (default: process)')
+    parser.add_argument('-r', '--rpc-engine', dest = 'rpc_engine', default = 'thread', choices = ['thread', 'reactor'], help = 'pool client engine (default: thread)')
+    parser.add_argument('--difficulty', type = float, default = 1000, help = 'share difficulty (default: 1000)')
+    parser.add_argument('--jobs', type = int, default = 10, help = 'number of job switches to measure (default: 10)')
+    parser.add_argument('--job-time', dest = 'job_time', type = float, default = 1., help = 'seconds to mine on each job (default: 1)')
+    parser.add_argument('--light', action ='store_true', help = 'mine cryptonight-light')
+    parser.add_argument('--timeout', type = float, default = 60., help = 'seconds to wait for each event (default: 60)')
+    parser.add_argument('--max-first-hash', dest = 'max_first_hash', type = float, help = 'fail if a job takes longer (seconds) to be hashed')
+    parser.add_argument('--max-share-reply', dest = 'max_share_reply', type = float, help = 'fail if a share reply takes longer (seconds)')
+    parser.add_argument('--max-reconnect', dest = 'max_reconnect', type = float, help = 'fail if a reconnect takes longer (seconds)')
+    parser.add_argument('--json', help = 'write the reports as JSON to this file (- for stdout)')
+    parser.add_argument('-d', '--debug', action ='store_true', help = 'show miner output')
+    options = parser.parse_args()
+
+    reports = []
+    failures = []
+    for client in (CLIENTS if options.client == 'all' else [options.client]):
+        report = run_harness(client, options.threads, options.engine, options.difficulty, options.jobs,
+                             options.job_time, options.light, options.timeout, options.debug, options.rpc_engine)
+        reports.append(report)
+        _print_report(report)
+        failures += ['%s: %s' % (client, f) for f in check_limits(report, options.max_first_hash,
+                                                                  options.max_share_reply, options.max_reconnect)]
+    if options.json:
+        if options.json == '-':
+            print json.dumps(reports, indent=2)
+        else:
+            with open(options.json, 'w') as f:
+                json.dump(reports, f, indent=2)
+    if failures:
+        print >> sys.stderr, 'FAILED: ' + ', '.join(failures)
+        sys.exit(1)
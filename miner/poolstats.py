@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Per-pool connection counters
+'''
+
+import time
+
+
+class ReconnectStats(object):
+    ''' Counts reconnects of one pool and measures how long each took.
+
+        lost() starts the clock when the connection is found dead (repeated
+        calls while reconnecting are ignored), logged_in() and got_job() stop
+        it for the relogin and the first job on the new connection.
+    '''
+    def __init__(self):
+        self.reconnects = 0
+        self.last_relogin_time = None
+        self.last_job_time = None
+        self._relogins = 0
+        self._relogin_total = 0.
+        self._job_total = 0.
+        self._lost_at = None
+        self._logged_in = False
+
+    reconnecting = property(lambda s: s._lost_at is not None)
+
+    def lost(self):
+        if self._lost_at is None:
+            self._lost_at = time.time()
+            self._logged_in = False
+
+    def logged_in(self):
+        ''' Returns the relogin time if this login ends a reconnect '''
+        if self._lost_at is None or self._logged_in:
+            return None
+        self._logged_in = True
+        self.last_relogin_time = time.time() - self._lost_at
+        self._relogins += 1
+        self._relogin_total += self.last_relogin_time
+        return self.last_relogin_time
+
+    def got_job(self):
+        ''' Returns the time to the first job if this job ends a reconnect '''
+        if self._lost_at is None or not self._logged_in:
+            return None
+        self.last_job_time = time.time() - self._lost_at
+        self._job_total += self.last_job_time
+        self._lost_at = None
+        self.reconnects += 1
+        return self.last_job_time
+
+    def as_dict(self):
+        return {
+            'reconnects': self.reconnects,
+            'last_relogin_time': self.last_relogin_time,
+            'avg_relogin_time': self._relogin_total/self._relogins if self._relogins else None,
+            'last_job_time': self.last_job_time,
+            'avg_job_time': self._job_total/self.reconnects if self.reconnects else None,
+        }
+
+
+# upper bounds (in seconds) of the latency histogram buckets, the last one is open
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+class LatencyHistogram(object):
+    ''' Round-trip times of one request method, in fixed buckets '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._bounds = buckets
+        self.buckets = [0]*(len(buckets) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        i = 0
+        while i < len(self._bounds) and seconds > self._bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        ''' Upper bound of the bucket holding the p-th percentile (max for the open bucket) '''
+        if not self.count:
+            return None
+        rank = p/100.*self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self._bounds[i] if i < len(self._bounds) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total/self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': zip(list(self._bounds) + [None], self.buckets),
+        }
+
+
+REJECT_STALE = 'stale'
+REJECT_DUPLICATE = 'duplicate'
+REJECT_LOW_DIFFICULTY = 'low_difficulty'
+REJECT_UNAUTHENTICATED = 'unauthenticated'
+REJECT_OTHER = 'other'
+REJECT_REASONS = [REJECT_STALE, REJECT_DUPLICATE, REJECT_LOW_DIFFICULTY, REJECT_UNAUTHENTICATED, REJECT_OTHER]
+
+# substrings of the pools' reject messages, first match wins
+_REJECT_PATTERNS = [
+    ('expired', REJECT_STALE),          # "Block expired"
+    ('stale', REJECT_STALE),
+    ('job id', REJECT_STALE),           # "Invalid job id", the pool dropped the job
+    ('job not found', REJECT_STALE),
+    ('duplicate', REJECT_DUPLICATE),
+    ('low diff', REJECT_LOW_DIFFICULTY),
+    ('unauthenticated', REJECT_UNAUTHENTICATED),
+    ('unauthorized', REJECT_UNAUTHENTICATED),
+]
+
+def classify_reject(message):
+    ''' One of REJECT_REASONS for a pool's reject message '''
+    message = (message or '').lower()
+    for pattern, reason in _REJECT_PATTERNS:
+        if pattern in message:
+            return reason
+    return REJECT_OTHER
+
+
+class ShareStats(object):
+    ''' Shares of one pool: rejects by reason, the shares dropped before
+        submitting because their job was no longer live, and the shares found
+        while reconnecting that were resubmitted (recovered) or not (expired) '''
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = dict((reason, 0) for reason in REJECT_REASONS)
+        self.dropped = 0
+        self.recovered = 0
+        self.expired = 0
+
+    def accept(self):
+        self.accepted += 1
+
+    def reject(self, message):
+        ''' Count a reject, returns its reason '''
+        reason = classify_reject(message)
+        self.rejected[reason] += 1
+        return reason
+
+    def drop(self):
+        self.dropped += 1
+
+    def as_dict(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': dict(self.rejected),
+            'dropped': self.dropped,
+            'recovered': self.recovered,
+            'expired': self.expired,
+        }
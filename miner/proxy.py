@@ -0,0 +1,400 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Stratum proxy: many local miners mining through a single pool login
+'''
+
+import json, socket, struct, threading, time, uuid
+from binascii import hexlify, unhexlify
+
+from framer import LineFramer, LineTooLong
+from shared import MAX_NONCE
+
+MAX_MINERS = 256        # one top nonce byte each
+SHARE_TIMEOUT = 15.     # seconds to wait for the pool's reply to a forwarded share
+KEPT_JOBS = 4           # jobs whose shares are remembered for duplicates
+REPORT_INTERVAL = 300.  # seconds between the per-miner summaries in the log
+
+ERROR_UNAUTHENTICATED = "Unauthenticated"
+ERROR_STALE = "Block expired"
+ERROR_DUPLICATE = "Duplicate share"
+ERROR_INVALID_NONCE = "Invalid nonce"
+ERROR_LOST = "Share lost upstream"
+ERROR_NONCE_RANGE = "Pool fixes part of the nonce, it can not be proxied"
+
+
+def target_hex(target):
+    ''' Stratum target of a decoded target value, compact when it fits '''
+    return hexlify(struct.pack('<I' if target <= 0xffffffff else '<Q', target))
+
+
+class StratumProxy(object):
+    ''' Serves the upstream pool's jobs to downstream miners on a local port.
+
+        `upstream` is a MinerRPC logged in to the pool and publishing its
+        jobs to `g_work`, without workers of its own. Every downstream miner
+        gets a slot: the top byte of the nonce, fixed in the blob of its jobs
+        and announced with the "nicehash" login extension, so the miners hash
+        disjoint ranges of the same job (up to MAX_MINERS of them).
+
+        Shares are checked (login, job, slot, duplicates across all miners)
+        before being forwarded under the upstream login, the pool's reply
+        goes back to the miner who found the share. Shares are counted per
+        miner, see `stats`.
+
+        A pool that fixes part of the nonce itself (nicehash) leaves no
+        byte to split: its jobs are not served, and logins are answered
+        with an error until it sends whole-range jobs again.
+    '''
+    def __init__(self, upstream, g_work, host='127.0.0.1', port=3333, log=None):
+        self._upstream = upstream
+        self._g_work = g_work
+        self._log = log
+        self._lock = threading.RLock()
+        self._miners = []
+        self._free_slots = range(MAX_MINERS)
+        self._job = None            # (job_id, blob_bin, target hex) of the upstream job
+        self._refusal = None        # error logins are answered with, None while jobs are served
+        self._nonces = {}           # job_id: nonces submitted, of the last KEPT_JOBS jobs
+        self._job_order = []
+        self._forwarded = {}        # upstream request id: (miner, request, time sent)
+        self._early_replies = {}    # upstream request id: (error message, time replied)
+        self._server = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self.exit = threading.Event()
+        upstream.on_share_reply = self._on_share_reply
+
+    address = property(lambda s: s._server.getsockname())
+    url = property(lambda s: 'stratum+tcp://%s:%d' % s.address[:2])
+
+    @property
+    def stats(self):
+        ''' Share counters of the connected miners, by slot '''
+        with self._lock:
+            return dict((miner.slot, dict(miner.snapshot(), login=miner.login)) for miner in self._miners)
+
+    def start(self):
+        for target in (self._accept_loop, self._job_loop):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+        return self
+
+    def shutdown(self):
+        self.exit.set()
+        try:
+            self._server.close()
+        except socket.error:
+            pass
+        with self._lock:
+            miners = list(self._miners)
+        for miner in miners:
+            miner.close()
+
+    def _accept_loop(self):
+        while not self.exit.is_set():
+            try:
+                sock, address = self._server.accept()
+            except socket.error:
+                break
+            with self._lock:
+                if not self._free_slots:
+                    self._info("Proxy full (%d miners), refusing %s" % (MAX_MINERS, address[0]))
+                    sock.close()
+                    continue
+                miner = _Miner(self, sock, address, self._free_slots.pop(0))
+                self._miners.append(miner)
+            miner.start()
+
+    def _remove_miner(self, miner):
+        with self._lock:
+            if miner not in self._miners:
+                return
+            self._miners.remove(miner)
+            self._free_slots.append(miner.slot)
+            for request_id, (owner, _, _) in self._forwarded.items():
+                if owner is miner:
+                    del self._forwarded[request_id]
+        if miner.login_id:
+            self._info("Miner #%d (%s) left: %s" % (miner.slot, miner.login, self._format_stats(miner.snapshot())))
+
+    def _job_loop(self):
+        ''' Sends the upstream jobs on, expires unreplied shares, reports '''
+        version = None
+        last_report = time.time()
+        while not self.exit.is_set():
+            if self._g_work.version != version:
+                version, work = self._g_work.read()
+                if work is not None:
+                    self._new_job(work)
+            self._expire_shares()
+            if time.time() - last_report >= REPORT_INTERVAL:
+                last_report = time.time()
+                self._report()
+            self._g_work.wait(version, 1.)
+
+    def _new_job(self, work):
+        if work['nonce_end'] != MAX_NONCE:
+            with self._lock:
+                refused = self._refusal is not None
+                self._refusal = ERROR_NONCE_RANGE
+                self._job = None
+                miners = list(self._miners)
+            if not refused:
+                self._info("Pool gave a nonce range, can not split it between miners: refusing logins")
+            for miner in miners:
+                miner.refuse_login(ERROR_NONCE_RANGE)
+            return
+        job = (work['job_id'], work['blob_bin'], target_hex(work['target']))
+        with self._lock:
+            self._refusal = None
+            if self._job is not None and self._job[:2] == job[:2]:
+                return
+            self._job = job
+            if job[0] not in self._nonces:
+                self._nonces[job[0]] = set()
+                self._job_order.append(job[0])
+                while len(self._job_order) > KEPT_JOBS:
+                    del self._nonces[self._job_order.pop(0)]
+            miners = list(self._miners)
+        for miner in miners:
+            miner.send_job()
+
+    def login_error(self):
+        ''' The error to answer logins with, None if they are served '''
+        with self._lock:
+            return self._refusal
+
+    def job_for(self, slot):
+        ''' Job params of the current job for the miner in `slot`, None if no job yet '''
+        with self._lock:
+            if self._job is None:
+                return None
+            job_id, blob_bin, target = self._job
+        blob_bin = blob_bin[:39] + '\0\0\0' + chr(slot) + blob_bin[43:]
+        return {'blob': hexlify(blob_bin), 'job_id': job_id, 'target': target}
+
+    def submit(self, miner, request):
+        ''' Forwards a miner's share, returns an error message if refused here '''
+        params = request.get('params') or {}
+        if params.get('id') != miner.login_id:
+            return ERROR_UNAUTHENTICATED
+        job_id = params.get('job_id')
+        nonce = params.get('nonce', '')
+        try:
+            nonce_bin = unhexlify(nonce)
+            assert len(nonce_bin) == 4
+        except (TypeError, AssertionError):
+            return ERROR_INVALID_NONCE
+        if ord(nonce_bin[3]) != miner.slot:
+            return ERROR_INVALID_NONCE
+        # one spelling of each nonce, for duplicates and upstream
+        nonce = hexlify(nonce_bin)
+        with self._lock:
+            nonces = self._nonces.get(job_id)
+            if nonces is None:
+                return ERROR_STALE
+            if nonce in nonces:
+                return ERROR_DUPLICATE
+            nonces.add(nonce)
+        # not under our lock: the upstream calls _on_share_reply under its own
+        forwarded = self._upstream.submit_share(dict(params, nonce=nonce))
+        if forwarded is None:
+            return ERROR_STALE
+        with self._lock:
+            early = forwarded['id'] in self._early_replies
+            if early:
+                error, _ = self._early_replies.pop(forwarded['id'])
+            else:
+                self._forwarded[forwarded['id']] = (miner, request, time.time())
+        if early:
+            miner.share_result(request, error)
+        return None
+
+    def _on_share_reply(self, request, error):
+        ''' Called by the upstream with the pool's reply to a share '''
+        message = error.get('message') if error else None
+        with self._lock:
+            forwarded = self._forwarded.pop(request['id'], None)
+            if forwarded is None:
+                # replied before submit() mapped it, or after it expired
+                self._early_replies[request['id']] = (message, time.time())
+                return
+        miner, miner_request, _ = forwarded
+        miner.share_result(miner_request, message)
+
+    def _expire_shares(self):
+        now = time.time()
+        with self._lock:
+            expired = [(request_id, miner, request) for request_id, (miner, request, sent) in self._forwarded.items()
+                       if now - sent >= SHARE_TIMEOUT]
+            for request_id, _, _ in expired:
+                del self._forwarded[request_id]
+            for request_id, (_, replied) in self._early_replies.items():
+                if now - replied >= SHARE_TIMEOUT:
+                    del self._early_replies[request_id]
+        for _, miner, request in expired:
+            miner.share_lost(request)
+
+    def _report(self):
+        with self._lock:
+            miners = [miner for miner in self._miners if miner.login_id]
+        if not miners:
+            return
+        self._info("Proxy: %d miners" % len(miners))
+        for miner in miners:
+            self._info("  #%d (%s): %s" % (miner.slot, miner.login, self._format_stats(miner.snapshot())))
+
+    def _format_stats(self, stats):
+        return "%(accepted)d/%(submitted)d accepted, %(rejected)d rejected, %(duplicate)d duplicate, " \
+               "%(stale)d stale, %(invalid)d invalid, %(lost)d lost" % stats
+
+    def _info(self, message):
+        if self._log is not None:
+            self._log(message)
+
+
+class _Miner(threading.Thread):
+    ''' One downstream miner connection of a StratumProxy '''
+    def __init__(self, proxy, sock, address, slot):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._proxy = proxy
+        self._sock = sock
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()  # stats, counted by the reader and the upstream reply threads
+        self.address = address
+        self.slot = slot
+        self.login = None
+        self.login_id = None
+        self._pending_login = None  # login request waiting for the first job
+        self.stats = dict((key, 0) for key in ('submitted', 'accepted', 'rejected', 'duplicate', 'stale',
+                                               'invalid', 'lost'))
+
+    def snapshot(self):
+        ''' Copy of the share counters '''
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+            self._sock.close()
+        except socket.error:
+            pass
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self._sock.sendall(json.dumps(message) + '\n')
+            except socket.error:
+                pass
+
+    def _reply(self, request, result=None, error=None):
+        self._send({'id': request.get('id'), 'jsonrpc': '2.0',
+                    'error': {'code': -1, 'message': error} if error else None,
+                    'result': result})
+
+    def _login_reply(self, request, job):
+        self._reply(request, result={'id': self.login_id, 'job': job, 'status': 'OK',
+                                     'extensions': ['nicehash']})
+
+    def send_job(self):
+        job = self._proxy.job_for(self.slot)
+        if job is None or self.login_id is None:
+            return
+        with self._send_lock:
+            request, self._pending_login = self._pending_login, None
+        if request is not None:
+            self._login_reply(request, job)
+        else:
+            self._send({'jsonrpc': '2.0', 'method': 'job', 'params': job})
+
+    def refuse_login(self, error):
+        ''' Answer the login waiting for the first job, if any, with `error` '''
+        with self._send_lock:
+            request, self._pending_login = self._pending_login, None
+        if request is not None:
+            self.login_id = None
+            self._reply(request, error=error)
+
+    def share_result(self, request, error):
+        if error is None:
+            self._count('accepted')
+            self._reply(request, result={'status': 'OK'})
+        else:
+            self._count('rejected')
+            self._reply(request, error=error)
+
+    def share_lost(self, request):
+        self._count('lost')
+        self._reply(request, error=ERROR_LOST)
+
+    def run(self):
+        framer = LineFramer()
+        while not self._proxy.exit.is_set():
+            try:
+                received = framer.recv_from(self._sock)
+            except socket.error:
+                received = 0
+            if not received:
+                break
+            try:
+                lines = framer.lines()
+            except LineTooLong, e:
+                lines = e.lines
+            for line in lines:
+                line = line.strip()     # keepalive pings are bare '\r'
+                if line:
+                    self._handle(line)
+        self._proxy._remove_miner(self)
+        self.close()
+
+    def _handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return
+        method = request.get('method')
+        params = request.get('params') or {}
+
+        if method == 'login':
+            error = self._proxy.login_error()
+            if error is not None:
+                self._reply(request, error=error)
+                return
+            self.login = params.get('login') or self.address[0]
+            self.login_id = uuid.uuid4().hex
+            job = self._proxy.job_for(self.slot)
+            if job is None:
+                # answered with the first job from the pool
+                with self._send_lock:
+                    self._pending_login = request
+                # or a job, or a refusal, that came meanwhile
+                error = self._proxy.login_error()
+                if error is not None:
+                    self.refuse_login(error)
+                else:
+                    self.send_job()
+            else:
+                self._login_reply(request, job)
+
+        elif method == 'submit':
+            self._count('submitted')
+            error = self._proxy.submit(self, request)
+            if error is not None:
+                self._count({ERROR_DUPLICATE: 'duplicate', ERROR_STALE: 'stale'}.get(error, 'invalid'))
+                self._reply(request, error=error)
+
+        elif method == 'keepalived':
+            self._reply(request, result={'status': 'KEEPALIVED'})
+
+        else:
+            self._reply(request, error="Unknown method")
@@ -0,0 +1,540 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Event loop (select based) multiplexing stratum connections of all pools
+in one thread
+'''
+
+import sys, errno, heapq, select, socket, ssl, threading, time, traceback
+
+from framer import LineFramer
+from connect import CONNECT_TIMEOUT, RACE_STAGGER, start_connect
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS, errno.EALREADY,
+                getattr(errno, 'WSAEWOULDBLOCK', 10035))
+_SSL_WANT = (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+
+# pipes (of multiprocessing) can only be waited on with select() outside Windows
+SELECTABLE_PIPES = sys.platform != 'win32'
+
+def socketpair():
+    ''' Connected pair of sockets, also on platforms without socket.socketpair '''
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    a = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    a.connect(listener.getsockname())
+    b, _ = listener.accept()
+    listener.close()
+    return a, b
+
+
+class Timer(object):
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Reactor(object):
+    ''' select() based event loop.
+
+        Readers and writers are objects with a fileno() (sockets, pipes),
+        their callbacks run in the loop thread when they are ready. Timers
+        run callbacks after a delay. Other threads hand work to the loop
+        with call_soon_threadsafe(), which wakes it up through a socket pair.
+
+        A callback raising is logged with its traceback through `log` (a
+        callable taking the message), the loop goes on.
+    '''
+    def __init__(self, log=None):
+        self._log = log
+        self._readers = {}
+        self._writers = {}
+        self._timers = []
+        self._timer_seq = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread_ident = None
+        self._wake_r, self._wake_w = socketpair()
+        self._wake_r.setblocking(False)
+        self._readers[self._wake_r] = self._drain_wake
+        self.exit = threading.Event()
+
+    def add_reader(self, fileobj, callback):
+        self._readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        self._readers.pop(fileobj, None)
+
+    def add_writer(self, fileobj, callback):
+        self._writers[fileobj] = callback
+
+    def remove_writer(self, fileobj):
+        self._writers.pop(fileobj, None)
+
+    def call_later(self, delay, callback, *args):
+        ''' Run `callback(*args)` in `delay` seconds, returns a cancellable Timer '''
+        timer = Timer(callback, args)
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (time.time() + delay, self._timer_seq, timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self._lock:
+            self._pending.append((callback, args))
+        self.wake()
+
+    def in_loop_thread(self):
+        return threading.current_thread().ident == self._thread_ident
+
+    def call(self, callback, *args):
+        ''' Run `callback(*args)` now if in the loop thread, else as soon as possible in it '''
+        if self.in_loop_thread():
+            callback(*args)
+        else:
+            self.call_soon_threadsafe(callback, *args)
+
+    def wake(self):
+        try:
+            self._wake_w.send('\0')
+        except socket.error:
+            pass
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _run(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            if self._log is None:
+                traceback.print_exc()
+                return
+            self._log("Reactor callback %s failed:\n%s" % (getattr(callback, '__name__', callback), 
+                                                          traceback.format_exc().rstrip()))
+
+    def run_forever(self):
+        self._thread_ident = threading.current_thread().ident
+        while not self.exit.is_set():
+            timeout = None
+            if self._timers:
+                timeout = max(0., self._timers[0][0] - time.time())
+            if self._pending:
+                timeout = 0.
+            try:
+                readable, writable, _ = select.select(list(self._readers), list(self._writers), [], timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                self._prune()
+                continue
+            except (ValueError, socket.error, IOError):
+                # a file object was closed while registered
+                self._prune()
+                continue
+
+            for fileobj in readable:
+                callback = self._readers.get(fileobj)
+                if callback is not None:
+                    self._run(callback)
+            for fileobj in writable:
+                callback = self._writers.get(fileobj)
+                if callback is not None:
+                    self._run(callback)
+
+            now = time.time()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    self._run(timer.callback, *timer.args)
+
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for callback, args in pending:
+                self._run(callback, *args)
+
+    def _prune(self):
+        for registry in (self._readers, self._writers):
+            for fileobj in list(registry):
+                try:
+                    select.select([fileobj], [], [], 0)
+                except Exception:
+                    del registry[fileobj]
+
+    def start(self):
+        ''' Run the loop in a new (daemon) thread '''
+        thread = threading.Thread(target=self.run_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.exit.set()
+        self.wake()
+
+
+_shared_reactor = None
+_shared_reactor_lock = threading.Lock()
+
+def shared_reactor(log=None):
+    ''' The process wide reactor all pool connections of the app run on,
+        `log` is used if it has to be started '''
+    global _shared_reactor
+    with _shared_reactor_lock:
+        if _shared_reactor is None or _shared_reactor.exit.is_set():
+            _shared_reactor = Reactor(log).start()
+        return _shared_reactor
+
+
+class _SocketWriter(object):
+    ''' Stands in for the socket of SimpleJsonRpcClient, send() queues data
+        on the reactor instead of blocking '''
+    def __init__(self, client):
+        self._client = client
+
+    def send(self, data):
+        self._client._reactor.call(self._client._write, data)
+        return len(data)
+
+
+class ReactorClientMixin(object):
+    ''' Runs a MinerRPC on a Reactor instead of its own threads.
+
+        Connecting, reading, pings, timeouts and reconnects are all callbacks
+        on the reactor, and the work submit channel is waited on along with
+        the pool socket, so found shares are sent right away. Replies are
+        handled by the MinerRPC unchanged (handle_reply).
+
+        Mix in before MinerRPC and call _reactor_init() after its __init__,
+        with the `log` of the reactor it starts (see Reactor), override
+        _periodic() for the checks to run every PERIODIC_INTERVAL.
+        Uses these MinerRPC methods: _handle_lines, _login, _submit,
+        set_active, _pool_address, _use_ssl, _sock_keep_alive, _on_connecting, _on_connected,
+        _on_network_error and _on_login_error, and its _addresses (AddressCache) and _backoff.
+    '''
+    RELOGIN_DELAY = 10
+    SHARE_POLL_INTERVAL = .01   # submit channels select() can not wait on
+    PERIODIC_INTERVAL = 1.
+
+    def _reactor_init(self, reactor=None, log=None):
+        self._reactor = reactor
+        self._reactor_log = log
+        self._owns_reactor = False
+        self._sock = None
+        self._connected = False
+        self._attempted = False
+        self._framer = LineFramer()
+        self._wbuf = ''
+        self._timers = {}
+        self._closed = threading.Event()
+        self._watching = False
+        self._racing = []           # sockets still connecting
+        self._race_addresses = []   # addresses not tried yet
+
+    def _periodic(self):
+        pass
+
+    # MinerRPC API
+    def start(self):
+        ''' Start on the shared reactor (app) '''
+        if self._reactor is None:
+            self._reactor = shared_reactor(self._reactor_log)
+        self._reactor.call_soon_threadsafe(self._open)
+
+    def serve_forever(self):
+        ''' Run a reactor of our own in the calling thread until shutdown (CLI) '''
+        if self._reactor is None:
+            self._reactor = Reactor(self._reactor_log)
+            self._owns_reactor = True
+        self._open()
+        self._reactor.run_forever()
+
+    def shutdown(self):
+        self.exit.set()
+        if self._reactor is not None:
+            self._reactor.call_soon_threadsafe(self._close)
+        else:
+            self._closed.set()
+
+    def join(self, timeout=None):
+        self._closed.wait(timeout)
+
+    def is_alive(self):
+        return self._reactor is not None and not self._closed.is_set()
+
+    def try_connect(self):
+        self._reactor.call(self._reconnect)
+
+    def set_active(self, active):
+        if self._reactor is None:
+            super(ReactorClientMixin, self).set_active(active)
+        else:
+            self._reactor.call(self._set_active, active)
+
+    # reactor callbacks
+    def _set_timer(self, name, delay, callback):
+        self._cancel_timer(name)
+        self._timers[name] = self._reactor.call_later(delay, callback)
+
+    def _cancel_timer(self, name):
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _open(self):
+        if self.exit.is_set():
+            self._close()
+            return
+        self._watch_shares()
+        self._tick()
+        self._connect()
+
+    def _set_active(self, active):
+        super(ReactorClientMixin, self).set_active(active)
+        if not self._closed.is_set():
+            self._watch_shares()
+
+    def _watch_shares(self):
+        ''' Take shares from the submit channel while active (a standby of a
+            failover group leaves them to the active client) '''
+        channel = self._work_submit_queue
+        self._unwatch_shares()
+        if not self._active or self.exit.is_set():
+            return
+        if SELECTABLE_PIPES and hasattr(channel, 'fileno'):
+            # readers are keyed by channel, which the group's clients share
+            self._reactor.add_reader(channel, self._on_share)
+            self._watching = True
+        else:
+            self._poll_shares()
+
+    def _unwatch_shares(self):
+        if self._watching:
+            self._reactor.remove_reader(self._work_submit_queue)
+            self._watching = False
+        self._cancel_timer('shares')
+
+    def _close(self):
+        for name in list(self._timers):
+            self._cancel_timer(name)
+        self._stop_race()
+        self._unwatch_shares()
+        self._close_socket()
+        self._closed.set()
+        if self._owns_reactor:
+            self._reactor.stop()
+
+    def _tick(self):
+        self._periodic()
+        self._set_timer('periodic', self.PERIODIC_INTERVAL, self._tick)
+
+    def _connect(self):
+        self._cancel_timer('retry')
+        if self.exit.is_set():
+            return
+        address = self._pool_address()
+        if address is None:
+            return
+        hostname, port = address
+        if not self._attempted:
+            self._attempted = True
+            self._on_connecting(hostname, port)
+        try:
+            self._race_addresses = self._addresses.resolve(hostname, port)
+        except socket.error:
+            self._connect_failed()
+            return
+        self._set_timer('connect', CONNECT_TIMEOUT, self._connect_failed)
+        self._race_next()
+
+    def _race_next(self):
+        ''' Start connecting to the next address of the pool, and to the one
+            after if no attempt succeeded within RACE_STAGGER (happy eyeballs) '''
+        self._cancel_timer('race')
+        while self._race_addresses:
+            try:
+                sock = start_connect(self._race_addresses.pop(0), self._sock_keep_alive)
+            except socket.error:
+                continue
+            self._racing.append(sock)
+            self._reactor.add_writer(sock, lambda sock=sock: self._on_connect_done(sock))
+            if self._race_addresses:
+                self._set_timer('race', RACE_STAGGER, self._race_next)
+            return
+        if not self._racing:
+            self._connect_failed()
+
+    def _stop_race(self):
+        self._cancel_timer('race')
+        for sock in self._racing:
+            self._reactor.remove_writer(sock)
+            sock.close()
+        self._racing = []
+        self._race_addresses = []
+
+    def _on_connect_done(self, sock):
+        self._reactor.remove_writer(sock)
+        self._racing.remove(sock)
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            sock.close()
+            self._race_next()   # on to the next address right away
+            return
+        self._stop_race()
+        self._cancel_timer('connect')
+        self._sock = self._my_sock = sock
+        if self._use_ssl():
+            self._sock = self._my_sock = ssl.wrap_socket(self._sock, do_handshake_on_connect=False)
+            self._set_timer('connect', CONNECT_TIMEOUT, self._connect_failed)
+            self._do_handshake()
+        else:
+            self._connection_made()
+
+    def _do_handshake(self):
+        self._reactor.remove_reader(self._sock)
+        self._reactor.remove_writer(self._sock)
+        try:
+            self._sock.do_handshake()
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._reactor.add_reader(self._sock, self._do_handshake)
+            elif e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._reactor.add_writer(self._sock, self._do_handshake)
+            else:
+                self._connect_failed()
+            return
+        except socket.error:
+            self._connect_failed()
+            return
+        self._cancel_timer('connect')
+        self._connection_made()
+
+    def _connect_failed(self):
+        self._cancel_timer('connect')
+        self._stop_race()
+        hostname, port = self._pool_address()
+        self._addresses.forget(hostname, port)
+        self._reconnect()
+
+    def _connection_made(self):
+        self._connected = True
+        self._framer.reset()
+        self._wbuf = ''
+        self._socket = _SocketWriter(self)
+        self._reactor.add_reader(self._sock, self._on_readable)
+        self._login()
+        self._on_connected()
+
+    def _close_socket(self):
+        self._connected = False
+        self._socket = None
+        if self._sock is not None:
+            self._reactor.remove_reader(self._sock)
+            self._reactor.remove_writer(self._sock)
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+            self._sock = None
+
+    def _reconnect(self):
+        if self.exit.is_set():
+            return
+        self._stop_race()
+        self._close_socket()
+        if self._attempted:
+            self._on_network_error()
+        delay = self._backoff.next()
+        if delay:
+            self._set_timer('retry', delay, self._connect)
+        else:
+            self._connect()
+
+    def _connection_lost(self):
+        if self._connected:
+            self._reconnect()
+
+    def _on_readable(self):
+        sock = self._sock
+        while sock is self._sock:
+            try:
+                received = self._framer.recv_from(sock)
+            except ssl.SSLError, e:
+                if e.args[0] in _SSL_WANT:
+                    return
+                self._connection_lost()
+                return
+            except socket.error, e:
+                if e.args[0] in _WOULD_BLOCK:
+                    return
+                self._connection_lost()
+                return
+            if not received:
+                self._connection_lost()
+                return
+            self._handle_lines(self._framer)
+            if not isinstance(sock, ssl.SSLSocket) or not sock.pending():
+                return
+
+    def _write(self, data):
+        if not self._connected:
+            return
+        self._wbuf += data
+        self._flush()
+
+    def _flush(self):
+        sock = self._sock
+        while self._wbuf:
+            try:
+                sent = sock.send(self._wbuf)
+            except ssl.SSLError, e:
+                if e.args[0] in _SSL_WANT:
+                    break
+                self._connection_lost()
+                return
+            except socket.error, e:
+                if e.args[0] in _WOULD_BLOCK:
+                    break
+                self._connection_lost()
+                return
+            self._wbuf = self._wbuf[sent:]
+        if self._wbuf:
+            self._reactor.add_writer(sock, self._flush)
+        else:
+            self._reactor.remove_writer(sock)
+
+    def _on_share(self):
+        channel = self._work_submit_queue
+        while not channel.empty():
+            self._submit(channel.get())
+
+    def _poll_shares(self):
+        self._on_share()
+        self._set_timer('shares', self.SHARE_POLL_INTERVAL, self._poll_shares)
+
+    def handle_reply(self, request, reply):
+        if request and request.get("method") == "login" and reply.get("error") is not None:
+            # relogin later without blocking the reactor
+            self._on_login_error(reply.get("error"))
+            self._set_timer('relogin', self.RELOGIN_DELAY, self._relogin)
+            return
+        super(ReactorClientMixin, self).handle_reply(request, reply)
+
+    def _handle_line(self, line):
+        # drop what is left of a batch read before we reconnected
+        if self._connected:
+            super(ReactorClientMixin, self)._handle_line(line)
+
+    def _relogin(self):
+        if self._connected:
+            self._login()
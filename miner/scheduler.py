@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Machine-wide scheduling of mining workers between pools
+'''
+
+import threading
+
+from supervisor import stop_workers, STOP_TIMEOUT
+
+
+def allocate(weights, budget):
+    ''' Worker count of each pool from `weights`, a list of (pool id, weight)
+        in start order: the weights themselves when they fit in `budget`,
+        else shares of the budget proportional to them (largest remainders
+        first), at least one worker per pool as far as the budget goes. '''
+    weights = [(pool_id, max(0, int(weight))) for pool_id, weight in weights]
+    total = sum(weight for _, weight in weights)
+    if total <= budget:
+        return dict(weights)
+    counts = {}
+    fractions = []
+    for pool_id, weight in weights:
+        share = float(weight)*budget/total
+        counts[pool_id] = int(share)
+        fractions.append((share - int(share), pool_id))
+    left = budget - sum(counts.values())
+    # earlier pools first on equal remainders (stable sort)
+    for _, pool_id in sorted(fractions, key=lambda f: -f[0]):
+        if left <= 0:
+            break
+        counts[pool_id] += 1
+        left -= 1
+    # take from the biggest shares for pools left without a worker
+    for pool_id, weight in weights:
+        if counts[pool_id] or not weight:
+            continue
+        donor = max(counts, key=lambda p: counts[p])
+        if counts[donor] <= 1:
+            break
+        counts[donor] -= 1
+        counts[pool_id] = 1
+    return counts
+
+
+class _PoolShare(object):
+    def __init__(self, weight, workers, spawn, resized, log):
+        self.weight = weight
+        self.workers = workers
+        self.slots = []
+        self.spawn = spawn
+        self.resized = resized
+        self.log = log
+        self.logged = weight    # worker count last told in the log
+
+
+class CpuScheduler(object):
+    ''' Owns the workers of all pools mining at once, and shares a budget of
+        cores (the tuned worker count) between them.
+
+        Each pool asks for `weight` workers (its CPU setting). While the
+        requests fit in the budget every pool gets what it asks for, else
+        the budget is split in proportion to them (see allocate). Pools are
+        rebalanced live when one starts, stops or changes its weight:
+        shrinking pools stop their last workers before growing ones start
+        new ones, so the workers never exceed the budget.
+
+        Workers hold a slot, 0 to budget - 1, unique across pools: the
+        worker on slot `s` is pinned to the `s`-th CPU of the placement
+        order, so pools do not share cores (and their caches). A pool's
+        workers are numbered 0 to n - 1 among themselves for splitting its
+        nonce space, `workers` is kept in that order.
+
+        Workers taken off a pool are given to `stop(workers, timeout)`, which
+        returns those it had to kill: stop_workers, or the park method of a
+        WorkerPool spawning them.
+    '''
+    def __init__(self, budget, stop_timeout=STOP_TIMEOUT, stop=stop_workers):
+        self._budget = budget
+        self._stop_timeout = stop_timeout
+        self._stop_workers = stop
+        self._pools = {}
+        self._order = []
+        self._lock = threading.RLock()
+
+    budget = property(lambda s: s._budget)
+
+    def add(self, pool_id, weight, workers, spawn, resized=None, log=None):
+        ''' Start mining a pool.
+
+            `workers` is the pool's worker list, kept up to date in place,
+            `spawn(thr_id, slot)` returns a new started worker,
+            `resized(count)` is called before workers are added and after
+            they are removed, `log(message)` tells when the pool gets fewer
+            workers than asked for.
+        '''
+        with self._lock:
+            self._pools[pool_id] = _PoolShare(weight, workers, spawn, resized, log)
+            self._order.append(pool_id)
+            self._rebalance()
+
+    def remove(self, *pool_ids):
+        ''' Stop all workers of the pools, all at once, and give their cores
+            to the others. Returns the workers that had to be killed '''
+        with self._lock:
+            shares = [self._pools.pop(pool_id) for pool_id in pool_ids if pool_id in self._pools]
+            for pool_id in pool_ids:
+                if pool_id in self._order:
+                    self._order.remove(pool_id)
+            stragglers = self._stop(shares, [0]*len(shares))
+            self._rebalance()
+            return stragglers
+
+    def replace(self, pool_id, thr_id, worker):
+        ''' Start a new worker in place of `worker` (dead, or hung and
+            stopped) on its slot. Returns it, None if `worker` was removed '''
+        with self._lock:
+            share = self._pools.get(pool_id)
+            if share is None or thr_id >= len(share.workers) or share.workers[thr_id] is not worker:
+                return None
+            share.workers[thr_id] = share.spawn(thr_id, share.slots[thr_id])
+            return share.workers[thr_id]
+
+    def set_weight(self, pool_id, weight):
+        with self._lock:
+            share = self._pools.get(pool_id)
+            if share is None or share.weight == weight:
+                return
+            share.weight = weight
+            self._rebalance()
+
+    def _rebalance(self):
+        counts = allocate([(pool_id, self._pools[pool_id].weight) for pool_id in self._order], self._budget)
+        shrinking = [pool_id for pool_id in self._order if counts[pool_id] < len(self._pools[pool_id].workers)]
+        self._stop([self._pools[pool_id] for pool_id in shrinking], [counts[pool_id] for pool_id in shrinking])
+        used = set(slot for share in self._pools.values() for slot in share.slots)
+        free = [slot for slot in range(self._budget) if slot not in used]
+        for pool_id in self._order:
+            share = self._pools[pool_id]
+            count = counts[pool_id]
+            if count > len(share.workers):
+                if share.resized is not None:
+                    share.resized(count)
+                while len(share.workers) < count:
+                    slot = free.pop(0)
+                    share.workers.append(share.spawn(len(share.workers), slot))
+                    share.slots.append(slot)
+            if share.log is not None and count != share.logged:
+                if count < share.weight and len(self._order) > 1:
+                    share.log("Mining with %d of %d workers, the CPUs are shared with %d other pools" %
+                              (count, share.weight, len(self._order) - 1))
+                elif count < share.weight:
+                    share.log("Mining with %d of %d workers, the CPU budget" % (count, share.weight))
+                else:
+                    share.log("Mining with all %d workers" % count)
+            share.logged = count
+
+    def _stop(self, shares, counts):
+        ''' Take the pools down to `counts` workers, stopping the last ones
+            of all of them at once '''
+        stopped = []
+        for share, count in zip(shares, counts):
+            while len(share.workers) > count:
+                stopped.append(share.workers.pop())
+                share.slots.pop()
+        stragglers = self._stop_workers(stopped, self._stop_timeout)
+        for share in shares:
+            if share.resized is not None:
+                share.resized(len(share.workers))
+        return stragglers
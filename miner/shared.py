@@ -0,0 +1,324 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Shared memory structures between the RPC client and miner workers
+'''
+
+import ctypes, time
+from Queue import Empty
+from multiprocessing import RawValue, RawArray, Lock, Semaphore, Pipe
+
+MAX_WORKERS = 256
+MAX_BLOB_SIZE = 128
+MAX_JOB_ID_SIZE = 128
+MAX_LOGIN_ID_SIZE = 256
+MAX_NONCE = 0xffffffff
+
+class _Job(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_ulonglong),        # odd while a write is in progress
+        ('has_job', ctypes.c_int),
+        ('is_cryptolite', ctypes.c_int),
+        ('num_thrs', ctypes.c_int),
+        ('blob_len', ctypes.c_int),
+        ('nonce', ctypes.c_ulonglong),
+        ('nonce_end', ctypes.c_ulonglong),
+        ('start', ctypes.c_ulonglong),      # offset in the nonce range where hashing starts
+        ('claimed', ctypes.c_ulonglong),    # nonces handed out to workers (claim)
+        ('target', ctypes.c_ulonglong),
+        ('blob', ctypes.c_char * MAX_BLOB_SIZE),
+        ('job_id', ctypes.c_char * MAX_JOB_ID_SIZE),
+        ('login_id', ctypes.c_char * MAX_LOGIN_ID_SIZE),
+    ]
+
+
+class JobSlot(object):
+    ''' Fixed-layout job descriptor in shared memory.
+
+        The RPC client publishes jobs into the slot, workers poll `version`
+        (a plain memory read, no IPC) and take a consistent snapshot with
+        `read()` when it changes. Writers are serialized by a lock, readers
+        never lock and retry while the sequence counter is odd or moved
+        under them (seqlock).
+        
+        Idle workers block in `wait()` until the version moves, writers
+        wake them up as soon as a write completes. The wake-up is a
+        semaphore released once per waiter: a condition's notify would
+        wait for every sleeping worker to be scheduled, holding up the
+        RPC client publishing the job.
+
+        Workers do not split the nonce range up front, they `claim()` chunks
+        of it from a shared cursor, sized to their own hashrate, until it is
+        used up. Coverage stays disjoint and complete when workers come and
+        go during a job, and fast cores simply claim more.
+    '''
+    def __init__(self):
+        self._job = RawValue(_Job)
+        self._write_lock = Lock()
+        self._waiters = RawValue(ctypes.c_int)
+        self._waiters_lock = Lock()
+        self._wakeup = Semaphore(0)
+
+    version = property(lambda s: s._job.seq)
+
+    def _begin_write(self):
+        self._write_lock.acquire()
+        self._job.seq += 1
+
+    def _end_write(self):
+        self._job.seq += 1
+        self._write_lock.release()
+        self.wake()
+
+    def wake(self):
+        ''' Wake up all workers blocked in wait(), without waiting for them '''
+        with self._waiters_lock:
+            waiters = self._waiters.value
+        for _ in xrange(waiters):
+            self._wakeup.release()
+
+    def wait(self, version, timeout=None):
+        ''' Block until the slot version differs from `version`, or timeout
+            (returns early on wake-ups left over by waiters that timed out) '''
+        with self._waiters_lock:
+            self._waiters.value += 1
+        try:
+            if self._job.seq == version:
+                self._wakeup.acquire(True, timeout)
+        finally:
+            with self._waiters_lock:
+                self._waiters.value -= 1
+        return self._job.seq != version
+
+    def publish(self, job_id, login_id, blob_bin, target, nonce, num_thrs, is_cryptolite, nonce_end=MAX_NONCE, 
+                start=0):
+        ''' Workers claim [nonce, nonce_end] from `start` on (wrapping around).
+            Publishing the current job again keeps the nonces already claimed '''
+        job_id = str(job_id)
+        login_id = str(login_id or '')
+        if len(blob_bin) > MAX_BLOB_SIZE or len(job_id) >= MAX_JOB_ID_SIZE \
+                or len(login_id) >= MAX_LOGIN_ID_SIZE:
+            raise ValueError("Job does not fit in shared job slot")
+
+        self._begin_write()
+        try:
+            job = self._job
+            if not (job.has_job and job.job_id == job_id and job.login_id == login_id):
+                job.start = start
+                job.claimed = 0
+            ctypes.memmove(ctypes.addressof(job) + _Job.blob.offset, blob_bin, len(blob_bin))
+            job.blob_len = len(blob_bin)
+            job.job_id = job_id
+            job.login_id = login_id
+            job.target = target
+            job.nonce = nonce
+            job.nonce_end = nonce_end
+            job.num_thrs = num_thrs
+            job.is_cryptolite = 1 if is_cryptolite else 0
+            job.has_job = 1
+        finally:
+            self._end_write()
+
+    def invalidate(self):
+        ''' Stop all mining on this slot, i.e. job_id becomes None '''
+        self._begin_write()
+        try:
+            self._job.has_job = 0
+        finally:
+            self._end_write()
+
+    def claim(self, version, count):
+        ''' Take the next `count` nonces (fewer at the end of the range) of
+            the job at `version`. Returns (first nonce, count), None if the
+            job changed or all its nonces are taken '''
+        with self._write_lock:
+            job = self._job
+            if job.seq != version or not job.has_job:
+                return None
+            span = job.nonce_end - job.nonce + 1
+            left = span - job.claimed
+            if left <= 0:
+                return None
+            offset = (job.start + job.claimed) % span
+            count = min(count, left, span - offset)
+            job.claimed += count
+            return (job.nonce + offset, count)
+
+    def set_num_thrs(self, num_thrs):
+        self._begin_write()
+        try:
+            self._job.num_thrs = num_thrs
+        finally:
+            self._end_write()
+
+    def read(self):
+        ''' Returns (version, job dict) snapshot, job is None if there is no job '''
+        job = self._job
+        while True:
+            seq = job.seq
+            if seq & 1:
+                continue
+            if not job.has_job:
+                work = None
+            else:
+                work = {
+                    'job_id': job.job_id,
+                    'login_id': job.login_id,
+                    'blob_bin': ctypes.string_at(ctypes.addressof(job) + _Job.blob.offset, job.blob_len),
+                    'target': job.target,
+                    'nonce': job.nonce,
+                    'nonce_end': job.nonce_end,
+                    'num_thrs': job.num_thrs,
+                    'is_cryptolite': job.is_cryptolite == 1,
+                }
+            if job.seq == seq:
+                return (seq, work)
+
+
+class _Assignment(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_ulonglong),        # odd while a write is in progress
+        ('lane', ctypes.c_int),             # -1 while parked
+        ('thr_id', ctypes.c_int),
+        ('cpu', ctypes.c_int),              # -1 for no pinning
+    ]
+
+
+class Assignment(object):
+    ''' What a pooled worker mines, in shared memory: a lane (job source)
+        of its WorkerPool and its worker number there, or nothing (parked).
+
+        Only the pool writes it, under its own lock, with the same seqlock
+        as JobSlot; the worker polls `version` while hashing and blocks in
+        `wait()` while parked. It is woken by a semaphore rather than a
+        condition, whose notify waits for the sleeper to be scheduled: the
+        pool never blocks on a worker.
+    '''
+    def __init__(self):
+        self._value = RawValue(_Assignment)
+        self._value.lane = -1
+        self._wakeup = Semaphore(0)
+
+    version = property(lambda s: s._value.seq)
+
+    def set(self, lane, thr_id=0, cpu=None):
+        ''' Mine `lane` as worker `thr_id`, pinned to `cpu`; lane None parks '''
+        value = self._value
+        value.seq += 1
+        value.lane = -1 if lane is None else lane
+        value.thr_id = thr_id
+        value.cpu = -1 if cpu is None else cpu
+        value.seq += 1
+        self.wake()
+
+    def wake(self):
+        self._wakeup.release()
+
+    def wait(self, version, timeout=None):
+        ''' Block until the assignment version differs from `version`, or
+            timeout (returns early on wake-ups left from earlier changes) '''
+        if self._value.seq == version:
+            self._wakeup.acquire(True, timeout)
+        return self._value.seq != version
+
+    def read(self):
+        ''' Returns (version, lane, thr_id, cpu), lane and cpu None if not set '''
+        value = self._value
+        while True:
+            seq = value.seq
+            if seq & 1:
+                continue
+            lane, thr_id, cpu = value.lane, value.thr_id, value.cpu
+            if value.seq == seq:
+                return (seq, lane if lane >= 0 else None, thr_id, cpu if cpu >= 0 else None)
+
+
+class ShareChannel(object):
+    ''' Queue-like channel carrying found shares from workers to the RPC client.
+
+        Workers put() from any process, the RPC client get()s. The read end
+        is a pipe with a fileno(), so a reactor can wait on it together with
+        the pool socket and send shares the moment they are found.
+    '''
+    def __init__(self):
+        self._reader, self._writer = Pipe(duplex=False)
+        self._write_lock = Lock()
+
+    def put(self, item):
+        with self._write_lock:
+            self._writer.send(item)
+
+    def empty(self):
+        return not self._reader.poll()
+
+    def get(self, timeout=None):
+        ''' Like Queue.get, raises Queue.Empty if nothing came within `timeout` '''
+        if timeout is not None and not self._reader.poll(timeout):
+            raise Empty
+        return self._reader.recv()
+
+    def fileno(self):
+        return self._reader.fileno()
+
+
+class HashCounters(object):
+    ''' Per-worker hash counters in shared memory.
+
+        Each worker only ever adds to its own slot, counters are never reset.
+        The time of the last update is kept next to the counter, idle workers
+        update it too (beat), as heartbeat. Hashrates are computed by readers
+        from deltas, see HashRateMeter.
+    '''
+    def __init__(self, size=MAX_WORKERS):
+        self._hashes = RawArray(ctypes.c_ulonglong, size)
+        self._stamps = RawArray(ctypes.c_double, size)
+
+    size = property(lambda s: len(s._hashes))
+
+    def add(self, thr_id, count):
+        self._hashes[thr_id] += count
+        self._stamps[thr_id] = time.time()
+
+    def beat(self, thr_id):
+        ''' Heartbeat of an idle worker: only the time of the last update '''
+        self._stamps[thr_id] = time.time()
+
+    def hashes(self, thr_id):
+        return self._hashes[thr_id]
+
+    def last_update(self, thr_id):
+        return self._stamps[thr_id]
+
+    def snapshot(self):
+        return self._hashes[:]
+
+
+class HashRateMeter(object):
+    ''' Computes hashrates of a HashCounters from deltas between samples.
+        Each reader keeps its own meter; a new sample is taken only if at least
+        `min_interval` seconds passed since the previous one.
+    '''
+    def __init__(self, counters, min_interval=1.):
+        self._counters = counters
+        self._min_interval = min_interval
+        self._last_hashes = counters.snapshot()
+        self._last_time = time.time()
+        self._rates = [0.] * counters.size
+
+    def update(self):
+        ''' Returns the total hashrate '''
+        now = time.time()
+        elapsed = now - self._last_time
+        if elapsed >= self._min_interval:
+            hashes = self._counters.snapshot()
+            self._rates = [(h - l)/elapsed for h, l in zip(hashes, self._last_hashes)]
+            self._last_hashes = hashes
+            self._last_time = now
+        return sum(self._rates)
+
+    def rate(self, thr_id):
+        return self._rates[thr_id]
+
+    def total_hashes(self):
+        return sum(self._last_hashes)
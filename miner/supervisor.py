@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Supervision of mining workers: restart the dead and the hung ones
+'''
+
+import os, signal, threading, time
+
+from connect import Backoff
+
+CHECK_INTERVAL = 1.     # seconds between checks
+HANG_TIMEOUT = 60.      # seconds without a heartbeat before a worker is hung
+RESTART_DELAY_MIN = 1.  # seconds before the second restart of a worker, doubled each time
+RESTART_DELAY_MAX = 60.
+STABLE_TIME = 300.      # seconds a restarted worker must run for its restart delay to reset
+STOP_TIMEOUT = 2.       # seconds stopping workers may take before they are terminated
+
+
+def kill_worker(worker):
+    ''' Terminate a process worker, and kill it if it does not go '''
+    worker.exit.set()
+    worker.terminate()
+    worker.join(.5)
+    if worker.is_alive() and hasattr(signal, 'SIGKILL'):
+        # SIGTERM waits while the process is stopped
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join(.5)
+
+
+def stop_workers(workers, timeout=STOP_TIMEOUT):
+    ''' Shut `workers` down all at once and wait for them against a single
+        deadline, however many they are; process workers still running then
+        are terminated (killed if need be). Returns the stragglers '''
+    for worker in workers:
+        worker.shutdown()
+    deadline = time.time() + timeout
+    for worker in workers:
+        worker.join(max(0., deadline - time.time()))
+    stragglers = [worker for worker in workers if worker.is_alive()]
+    for worker in stragglers:
+        if hasattr(worker, 'terminate'):
+            kill_worker(worker)
+    return stragglers
+
+
+class _Watched(object):
+    ''' A worker list under supervision, and the state of each worker in it '''
+    def __init__(self, workers, heartbeats, respawn, log, report):
+        self.workers = workers
+        self.heartbeats = heartbeats
+        self.respawn = respawn
+        self.log = log
+        self.report = report
+        self.restarts = 0
+        self.states = {}    # thr_id: _WorkerState
+        # held while a worker of the list is respawned, unwatch() waits for it
+        self.lock = threading.Lock()
+        self.watched = True
+
+
+class _WorkerState(object):
+    def __init__(self, worker, backoff):
+        self.worker = worker
+        self.since = time.time()
+        self.backoff = backoff
+        self.retry_at = None    # time of the pending restart
+        self.given_up = False
+
+
+class WorkerSupervisor(object):
+    ''' Watches lists of mining workers in a thread of its own.
+
+        A worker is dead when it is not alive without having been shut down
+        (crashed, killed by the OOM killer), and hung when it has not beaten
+        its heartbeat (its stamp in the HashCounters, updated with every
+        batch of hashes and while idle) for `hang_timeout` seconds. Dead
+        workers are replaced, hung process workers are terminated first;
+        hung threads can not be stopped, they are only reported.
+
+        Restarts of a worker are spaced by a backoff from `restart_delay`
+        doubling up to `restart_delay_max`, so a worker crashing at start
+        does not fork in a loop; it resets once a worker ran `stable_time`.
+
+        `respawn(thr_id, worker)` returns the started replacement of
+        `worker`, or None if it is no longer wanted; it must put it in place
+        in the list. `report(restarts)` is told the restart count.
+
+        Workers are killed and joined without holding any lock; a respawn
+        only holds the lock of its list, so unwatch() returns once a restart
+        under way has put its worker in place, and none is after that.
+    '''
+    def __init__(self, interval=CHECK_INTERVAL, hang_timeout=HANG_TIMEOUT, restart_delay=RESTART_DELAY_MIN,
+                 restart_delay_max=RESTART_DELAY_MAX, stable_time=STABLE_TIME):
+        self._interval = interval
+        self._hang_timeout = hang_timeout
+        self._restart_delay = restart_delay
+        self._restart_delay_max = restart_delay_max
+        self._stable_time = stable_time
+        self._watched = {}
+        self._lock = threading.RLock()
+        self._thread = None
+        self.exit = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self.exit.set()
+
+    def watch(self, key, workers, heartbeats, respawn, log=None, report=None):
+        with self._lock:
+            self._watched[key] = _Watched(workers, heartbeats, respawn, log, report)
+
+    def unwatch(self, key):
+        ''' Stop watching, before shutting the workers down '''
+        with self._lock:
+            watched = self._watched.pop(key, None)
+        if watched is not None:
+            with watched.lock:
+                watched.watched = False
+
+    def _run(self):
+        while not self.exit.wait(self._interval):
+            self.check()
+
+    def check(self):
+        with self._lock:
+            watched_lists = self._watched.values()
+        for watched in watched_lists:
+            self._check(watched)
+
+    def _check(self, watched):
+        now = time.time()
+        for thr_id, worker in enumerate(list(watched.workers)):
+            state = watched.states.get(thr_id)
+            if state is None:
+                state = watched.states[thr_id] = _WorkerState(worker, Backoff(self._restart_delay,
+                                                                               self._restart_delay_max))
+            elif state.worker is not worker:
+                # replaced, by us or whoever manages the list
+                state.worker = worker
+                state.since = now
+                state.retry_at = None
+                state.given_up = False
+            if state.given_up:
+                continue
+            if now - state.since >= self._stable_time:
+                state.backoff.reset()
+
+            alive = worker.is_alive()
+            if not alive and worker.exit.is_set():
+                continue    # shut down on purpose
+            if alive and now - max(state.since, watched.heartbeats.last_update(thr_id)) < self._hang_timeout:
+                continue
+
+            if state.retry_at is None:
+                delay = state.backoff.next()
+                state.retry_at = now + delay
+                if alive:
+                    problem = "hung (no heartbeat for %ds)" % self._hang_timeout
+                else:
+                    problem = "died (exit code %s)" % getattr(worker, 'exitcode', None)
+                self._log(watched, "Worker #%d %s, restarting%s" % (thr_id, problem,
+                          " in %.1fs" % delay if delay else ""))
+            if now < state.retry_at:
+                continue
+            if alive:
+                if not hasattr(worker, 'terminate'):
+                    self._log(watched, "Worker #%d is a hung thread, it can not be restarted" % thr_id)
+                    state.given_up = True
+                    continue
+                kill_worker(worker)
+            worker.join(1.)
+            with watched.lock:
+                if not watched.watched:
+                    return  # unwatched meanwhile, its owner stops the workers
+                new_worker = watched.respawn(thr_id, worker)
+            if new_worker is None:
+                continue
+            state.worker = new_worker
+            state.since = time.time()
+            state.retry_at = None
+            watched.restarts += 1
+            if watched.report is not None:
+                watched.report(watched.restarts)
+
+    def _log(self, watched, message):
+        if watched.log is not None:
+            watched.log(message)
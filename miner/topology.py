@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+CPU cache topology and worker placement (Linux)
+'''
+
+import os, sys, glob
+
+SYS_CPU_DIR = '/sys/devices/system/cpu'
+SCRATCHPAD_SIZE = 2*1024*1024       # Cryptonight
+SCRATCHPAD_SIZE_LIGHT = 1024*1024   # Cryptonight-Light
+
+def parse_cpu_list(text):
+    ''' Parse a sysfs cpu list like "0-3,8,10-11" '''
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def parse_cache_size(text):
+    ''' Parse a sysfs cache size like "32768K" into bytes '''
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024*1024, 'G': 1024*1024*1024}
+    if text and text[-1] in units:
+        return int(text[:-1])*units[text[-1]]
+    return int(text)
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+def read_topology(sys_cpu_dir=SYS_CPU_DIR):
+    ''' Returns a list of online logical CPUs as dicts with keys:
+        cpu, core (package id, core id), siblings, l3 (cpus sharing the L3),
+        l3_size (bytes, 0 if unknown) and node (NUMA node, 0 if unknown).
+        Empty list if the topology can not be read.
+    '''
+    online = _read(os.path.join(sys_cpu_dir, 'online'))
+    if online is None:
+        return []
+
+    topology = []
+    for cpu in parse_cpu_list(online):
+        cpu_dir = os.path.join(sys_cpu_dir, 'cpu%d' % cpu)
+        package_id = int(_read(os.path.join(cpu_dir, 'topology', 'physical_package_id'), 0))
+        core_id = int(_read(os.path.join(cpu_dir, 'topology', 'core_id'), cpu))
+        siblings = parse_cpu_list(_read(os.path.join(cpu_dir, 'topology', 'thread_siblings_list'), str(cpu)))
+
+        l3 = None
+        l3_size = 0
+        for index_dir in glob.glob(os.path.join(cpu_dir, 'cache', 'index*')):
+            if _read(os.path.join(index_dir, 'level')) != '3':
+                continue
+            if _read(os.path.join(index_dir, 'type')) not in ('Unified', 'Data'):
+                continue
+            l3 = tuple(parse_cpu_list(_read(os.path.join(index_dir, 'shared_cpu_list'), str(cpu))))
+            l3_size = parse_cache_size(_read(os.path.join(index_dir, 'size'), '0'))
+
+        node = 0
+        node_dirs = glob.glob(os.path.join(cpu_dir, 'node*'))
+        if node_dirs:
+            node = int(os.path.basename(node_dirs[0])[4:])
+
+        topology.append({
+            'cpu': cpu,
+            'core': (package_id, core_id),
+            'siblings': siblings,
+            'l3': l3 if l3 else ('package', package_id),
+            'l3_size': l3_size,
+            'node': node,
+        })
+    return topology
+
+def placement_order(topology, scratchpad_size=SCRATCHPAD_SIZE):
+    ''' Order logical CPUs by preference for mining workers:
+
+          1) one worker per physical core, until the L3 cache of the core's
+             domain holds no more scratchpads,
+          2) SMT siblings, within the same L3 capacity,
+          3) everything else (workers beyond cache capacity).
+
+        L3 domains are visited round-robin (sorted by NUMA node) so workers
+        spread over all caches and nodes before any of them fills up.
+        Worker `thr_id` is placed on order[thr_id % len(order)].
+    '''
+    domains = {}
+    for c in topology:
+        domains.setdefault(c['l3'], []).append(c)
+
+    in_capacity = []
+    over_capacity = []
+    for key in sorted(domains, key=lambda k: (domains[k][0]['node'], min(c['cpu'] for c in domains[k]))):
+        cpus = sorted(domains[key], key=lambda c: c['cpu'])
+        # first SMT thread of each core, then the remaining siblings
+        seen_cores = set()
+        primaries = []
+        secondaries = []
+        for c in cpus:
+            if c['core'] in seen_cores:
+                secondaries.append(c['cpu'])
+            else:
+                seen_cores.add(c['core'])
+                primaries.append(c['cpu'])
+        ordered = primaries + secondaries
+
+        l3_size = cpus[0]['l3_size']
+        capacity = max(1, l3_size // scratchpad_size) if l3_size else len(primaries)
+        in_capacity.append(ordered[:capacity])
+        over_capacity.append(ordered[capacity:])
+
+    order = []
+    for tier in (in_capacity, over_capacity):
+        tier = [list(cpus) for cpus in tier]
+        while any(tier):
+            for cpus in tier:
+                if cpus:
+                    order.append(cpus.pop(0))
+    return order
+
+_order_cache = {}
+
+def worker_cpu(thr_id, scratchpad_size=SCRATCHPAD_SIZE):
+    ''' Logical CPU to pin worker `thr_id` to, None if not supported here '''
+    if not sys.platform.startswith('linux'):
+        return None
+    if scratchpad_size not in _order_cache:
+        _order_cache[scratchpad_size] = placement_order(read_topology(), scratchpad_size)
+    order = _order_cache[scratchpad_size]
+    if not order:
+        return None
+    return order[thr_id % len(order)]
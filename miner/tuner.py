@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Worker count tuning and hardware profile
+'''
+
+import os, sys, json, time, platform
+from multiprocessing import cpu_count
+
+PROFILE_FILE_NAME = 'hardware_profile.json'
+PROFILE_VERSION = 1
+
+KNEE_TOLERANCE = 0.03   # worker counts within 3% of the best hashrate are as good
+MAX_DROPS = 2           # stop stepping after this many steps below the knee
+
+def cpu_model():
+    ''' CPU model name, as precise as the platform tells '''
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/cpuinfo') as f:
+                for line in f:
+                    if line.startswith('model name'):
+                        return line.split(':', 1)[1].strip()
+        except (IOError, OSError):
+            pass
+    return platform.processor() or platform.machine()
+
+def hardware_id():
+    ''' What a profile was measured on; profiles of other hardware are ignored '''
+    return {
+        'cpu_model': cpu_model(),
+        'cpu_count': cpu_count(),
+        'machine': platform.machine(),
+    }
+
+def find_knee(steps, tolerance=KNEE_TOLERANCE):
+    ''' Smallest worker count whose hashrate is within `tolerance` of the best
+        one, `steps` being a list of (workers, hashrate). None if empty.
+    '''
+    if not steps:
+        return None
+    best = max(rate for _, rate in steps)
+    return min(n for n, rate in steps if rate >= best*(1 - tolerance))
+
+def tune_algo(measure, max_workers, tolerance=KNEE_TOLERANCE, max_drops=MAX_DROPS):
+    ''' Step the worker count from 1 to `max_workers`, `measure(n)` returning
+        the steady-state hashrate with n workers. Stops early once adding
+        workers keeps losing hashrate (cache oversubscribed).
+        Returns (knee, steps).
+    '''
+    steps = []
+    best = 0.
+    drops = 0
+    for n in range(1, max_workers + 1):
+        rate = measure(n)
+        steps.append((n, rate))
+        if rate > best:
+            best = rate
+            drops = 0
+        elif rate < best*(1 - tolerance):
+            drops += 1
+            if drops >= max_drops:
+                break
+    return find_knee(steps, tolerance), steps
+
+def new_profile(engine):
+    return {
+        'version': PROFILE_VERSION,
+        'hardware': hardware_id(),
+        'engine': engine,
+        'updated': int(time.time()),
+        'algos': {},
+    }
+
+def set_algo_result(profile, algo, knee, steps):
+    profile['algos'][algo] = {
+        'threads': knee,
+        'hashrate': dict(steps).get(knee, 0.),
+        'steps': [[n, rate] for n, rate in steps],
+    }
+
+def load_profile(file_path):
+    ''' The profile stored at `file_path` if it matches this hardware, else None '''
+    try:
+        with open(file_path) as f:
+            profile = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(profile, dict) or profile.get('version') != PROFILE_VERSION:
+        return None
+    if profile.get('hardware') != hardware_id():
+        return None
+    return profile
+
+def save_profile(file_path, profile):
+    d = os.path.dirname(file_path)
+    if d and not os.path.exists(d):
+        os.makedirs(d)
+    with open(file_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+def profile_threads(profile, algo, default):
+    ''' Tuned worker count for `algo`, `default` if not tuned '''
+    try:
+        threads = int(profile['algos'][algo]['threads'])
+    except (TypeError, KeyError, ValueError):
+        return default
+    return threads if 0 < threads <= cpu_count() else default
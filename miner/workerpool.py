@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Pool of mining workers started ahead of time, parked while not mining
+'''
+
+import threading
+
+from shared import Assignment
+from supervisor import stop_workers, STOP_TIMEOUT
+
+
+class WorkerPool(object):
+    ''' Workers started once and handed from pool to pool.
+
+        A worker mines a lane: the submit queue, job slot and hash counters
+        of a pool (what a worker is created with otherwise). Assigning a
+        worker to a lane, or parking it, is a write to its Assignment in
+        shared memory, so starting or stopping mining, switching pools and
+        changing worker counts do not start or stop processes.
+
+        There is one worker per engine and slot of the CpuScheduler (its
+        CPU). Process workers only see the lanes added before they were
+        forked: a worker assigned a newer lane, or found dead, is replaced
+        by a new one on the spot. `prestart` forks them ahead of time.
+
+        Lanes are numbered in the order they were added. A removed lane
+        leaves a hole, so the lanes of the others keep their numbers.
+
+        `engines` are the pooled worker classes by engine name, see
+        POOLED_WORKER_ENGINES.
+    '''
+    def __init__(self, engines, cpu_priority_level):
+        self._engines = engines
+        self._cpu_priority_level = cpu_priority_level
+        self._lanes = []
+        self._workers = {}      # (engine, slot): worker
+        self._lock = threading.RLock()
+
+    def add_lane(self, work_submit_queue, g_work, hash_report):
+        ''' Index of the lane of `g_work`, added if new '''
+        with self._lock:
+            for i, lane in enumerate(self._lanes):
+                if lane is not None and lane[1] is g_work:
+                    return i
+            self._lanes.append((work_submit_queue, g_work, hash_report))
+            return len(self._lanes) - 1
+
+    def remove_lane(self, g_work):
+        ''' Drop the lane of `g_work` (a deleted pool), its workers parked '''
+        with self._lock:
+            for i, lane in enumerate(self._lanes):
+                if lane is not None and lane[1] is g_work:
+                    self._lanes[i] = None
+                    for worker in self._workers.values():
+                        worker.drop_lane(i)
+
+    def prestart(self, engine, slots):
+        ''' Start parked workers of `engine` on `slots` '''
+        with self._lock:
+            for slot in slots:
+                self._worker(engine, slot, None)
+
+    def assign(self, engine, slot, lane, thr_id, cpu=None):
+        ''' The worker of `engine` on `slot`, mining `lane` as worker `thr_id`
+            pinned to `cpu` '''
+        with self._lock:
+            worker = self._worker(engine, slot, lane)
+            # beats its new counter, the supervisor does not take it for hung before it hashes
+            self._lanes[lane][2].beat(thr_id)
+            worker.assign(lane, thr_id, cpu)
+            return worker
+
+    def park(self, workers, timeout=None):
+        ''' Take `workers` off their lanes, they stop hashing within a batch.
+            Nothing is waited for: returns no stragglers (like stop_workers) '''
+        with self._lock:
+            for worker in workers:
+                worker.assign(None)
+        return []
+
+    def shutdown(self, timeout=STOP_TIMEOUT):
+        ''' Stop all workers, returns those that had to be killed '''
+        with self._lock:
+            workers = self._workers.values()
+            self._workers.clear()
+        return stop_workers(workers, timeout)
+
+    def _worker(self, engine, slot, lane):
+        worker = self._workers.get((engine, slot))
+        if worker is not None and worker.is_alive() and not worker.exit.is_set() \
+                and (lane is None or lane < worker.lane_count):
+            return worker
+        if worker is not None and worker.is_alive():
+            # parked, only it does not know the lane
+            stop_workers([worker], STOP_TIMEOUT)
+        worker = self._engines[engine](slot, self._lanes, Assignment(), self._cpu_priority_level)
+        worker.start()
+        self._workers[(engine, slot)] = worker
+        return worker
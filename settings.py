@@ -18,11 +18,31 @@ VERSION = [0, 1, 'b1.3']
 
 OPT_RANDOMIZE = False  # Randomize scan range start to reduce duplicates
 OPT_SCANTIME = 60
+OPT_BATCH_TIME = 0.1 # Time budget (in second) of each nonce-range scan call
+OPT_CPU_PLACEMENT = True # Pin workers to cores by cache topology (Linux)
 OPT_REPLY_WITH_RPC2_EXPLICIT = True # support for explicit RPC 2.0 in reply
-OPT_SEND_PING = True
-OPT_PING_INTERVAL = 1 # Ping interval in second
+OPT_SEND_PING = True # Probe quiet pool connections (keepalived) to detect dead ones
+OPT_PROBE_IDLE_MIN = 10 # Seconds a pool may be quiet before a probe, adapted to its traffic,
+OPT_PROBE_IDLE_MAX = 60 # between these two
+OPT_PROBE_TIMEOUT = 5 # Seconds to wait for a probe's reply, at least (4 round-trips)
+OPT_PROBE_MAX_MISSED = 3 # Unreplied probes in a row before reconnecting
+OPT_STALE_GRACE = 1. # Seconds shares of a replaced job are still submitted
+OPT_RESUBMIT_SIZE = 16 # Shares found while reconnecting kept for resubmitting after relogin
+OPT_RESUBMIT_AGE = 30 # and for how many seconds
+OPT_RPC_TIMEOUTS = {'login': 10, 'submit': 10} # Seconds to wait for a reply before reconnecting
+OPT_RECONNECT_DELAY_MIN = .5 # Seconds before retrying a failed connection, doubled at each failure
+OPT_RECONNECT_DELAY_MAX = 30 # up to this
+OPT_ADDRESS_TTL = 300 # Seconds resolved pool addresses are reused
+OPT_FAILOVER_DELAY = .5 # Seconds a pool may be without a job before its failover pool takes over
+OPT_FAILBACK_DELAY = 60 # Seconds a preferred pool must be back up before switching back to it
+OPT_WORKER_HANG_TIMEOUT = 60 # Seconds without a heartbeat before a worker is restarted as hung
+OPT_WORKER_RESTART_DELAY_MIN = 1 # Seconds before restarting a worker again, doubled at each restart
+OPT_WORKER_RESTART_DELAY_MAX = 60 # up to this
+OPT_STOP_TIMEOUT = 2 # Seconds stopping mining may take, late workers are killed
+OPT_RPC_ENGINE = "thread" # Pool client: "thread" per pool, or "reactor" (all pools on one event loop thread)
 
 HASHING_ALGO = ["Cryptonight", "Cryptonight-Light"]
+WORKER_ENGINE_TYPES = ["process", "thread"] # "thread" pays off with hash libraries releasing the GIL
 
 _data_dir = str(makeDir(os.path.join(getHomeDir(), 'SumoMiner')))
 DATA_DIR = _data_dir
@@ -0,0 +1,33 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the delays between connection attempts
+'''
+
+import unittest
+
+from miner.connect import Backoff
+
+
+class BackoffTest(unittest.TestCase):
+    def test_first_attempt_right_away(self):
+        self.assertEqual(Backoff(1., 30.).next(), 0.)
+
+    def test_delays_double_up_to_the_cap_with_jitter(self):
+        backoff = Backoff(1., 8.)
+        backoff.next()
+        for delay in (1., 2., 4., 8., 8.):
+            self.assertTrue(delay/2 <= backoff.next() <= delay)
+
+    def test_reset(self):
+        backoff = Backoff(1., 8.)
+        for _ in range(4):
+            backoff.next()
+        backoff.reset()
+        self.assertEqual(backoff.attempts, 0)
+        self.assertEqual(backoff.next(), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
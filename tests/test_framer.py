@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the newline framing of the stratum stream
+'''
+
+import unittest
+
+from miner.framer import LineFramer, LineTooLong
+
+
+class FakeSocket(object):
+    ''' Hands out the given chunks, one per receive '''
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def recv_into(self, view, size):
+        data = self._chunks.pop(0) if self._chunks else ''
+        view[:len(data)] = data
+        return len(data)
+
+
+def frame(chunks, max_line_size=10):
+    ''' Lines returned after each chunk, ('too long', lines) where lines() raised '''
+    framer = LineFramer(max_line_size=max_line_size, recv_size=64)
+    sock = FakeSocket(chunks)
+    results = []
+    for _ in chunks:
+        framer.recv_from(sock)
+        try:
+            results.append(framer.lines())
+        except LineTooLong, e:
+            results.append(('too long', e.lines))
+    return results
+
+
+class LineFramerTest(unittest.TestCase):
+    def test_lines_across_reads(self):
+        self.assertEqual(frame(['ab', 'c\nde', 'f\ng\n']), [[], ['abc'], ['def', 'g']])
+
+    def test_empty_read_is_a_closed_connection(self):
+        framer = LineFramer()
+        self.assertEqual(framer.recv_from(FakeSocket([])), 0)
+
+    def test_reset_drops_the_unfinished_line(self):
+        framer = LineFramer()
+        framer.recv_from(FakeSocket(['partial']))
+        framer.reset()
+        framer.recv_from(FakeSocket(['line\n']))
+        self.assertEqual(framer.lines(), ['line'])
+
+    def test_unfinished_line_too_long(self):
+        # reported once, then discarded up to its newline
+        self.assertEqual(frame(['x'*12, 'x'*12, 'x\nok\n']), [('too long', []), [], ['ok']])
+
+    def test_carried_over_line_too_long(self):
+        self.assertEqual(frame(['abc', 'defghijkl\nok\n']), [[], ('too long', ['ok'])])
+
+    def test_line_too_long_among_others(self):
+        self.assertEqual(frame(['a\n' + 'x'*15 + '\nb\n']), [('too long', ['a', 'b'])])
+
+    def test_tail_too_long_after_complete_lines(self):
+        self.assertEqual(frame(['ok\n' + 'y'*12, 'yy\nz\n']), [('too long', ['ok']), ['z']])
+
+    def test_line_at_the_limit(self):
+        self.assertEqual(frame(['x'*10 + '\n']), [['x'*10]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the jobs a pool still accepts shares for
+'''
+
+import unittest
+
+from miner.livejobs import LiveJobs, ResubmitBuffer
+
+
+class LiveJobsTest(unittest.TestCase):
+    def test_current_job(self):
+        jobs = LiveJobs(grace=60)
+        self.assertFalse(jobs.is_live('a', 'L'))
+        jobs.new_job('a', 'L')
+        self.assertEqual(jobs.current, 'a')
+        self.assertTrue(jobs.is_live('a', 'L'))
+        self.assertFalse(jobs.is_live('a', 'other login'))
+
+    def test_replaced_job_within_grace(self):
+        jobs = LiveJobs(grace=60)
+        jobs.new_job('a', 'L')
+        jobs.new_job('b', 'L')
+        self.assertTrue(jobs.is_live('a', 'L'))
+        self.assertTrue(jobs.is_live('b', 'L'))
+
+    def test_replaced_job_past_grace(self):
+        jobs = LiveJobs(grace=0)
+        jobs.new_job('a', 'L')
+        jobs.new_job('b', 'L')
+        self.assertFalse(jobs.is_live('a', 'L'))
+
+    def test_new_login_leaves_only_its_job(self):
+        jobs = LiveJobs(grace=60)
+        jobs.new_job('a', 'L1')
+        jobs.new_job('b', 'L2')
+        self.assertFalse(jobs.is_live('a', 'L2'))
+        self.assertTrue(jobs.is_live('b', 'L2'))
+
+    def test_lost_connection(self):
+        jobs = LiveJobs(grace=60)
+        jobs.new_job('a', 'L')
+        jobs.new_job('b', 'L')
+        jobs.invalidate()
+        self.assertIsNone(jobs.current)
+        self.assertFalse(jobs.is_live('b', 'L'))
+        self.assertTrue(jobs.was_lost('a', 'L'))
+        self.assertTrue(jobs.was_lost('b', 'L'))
+        self.assertFalse(jobs.was_lost('b', 'other login'))
+
+
+class ResubmitBufferTest(unittest.TestCase):
+    def test_newest_shares_kept(self):
+        buf = ResubmitBuffer(size=2, max_age=60)
+        for i in range(3):
+            buf.add({'nonce': i})
+        self.assertEqual(len(buf), 2)
+        self.assertEqual(buf.take(), ([{'nonce': 1}, {'nonce': 2}], 1))
+        self.assertEqual(len(buf), 0)
+
+    def test_old_shares_expire(self):
+        buf = ResubmitBuffer(size=4, max_age=60)
+        buf.add({'nonce': 1}, found_time=1.)
+        buf.add({'nonce': 2})
+        self.assertEqual(buf.take(), ([{'nonce': 2}], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
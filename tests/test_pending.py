@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the table of requests waiting for a reply
+'''
+
+import unittest
+
+from miner.pending import PendingRequests
+
+
+def request(request_id, method='submit'):
+    return {'id': request_id, 'method': method, 'params': {}}
+
+
+class PendingRequestsTest(unittest.TestCase):
+    def test_reply_pops_its_request(self):
+        pending = PendingRequests()
+        pending.add(request(1, 'login'))
+        self.assertEqual(pending.pop(1), request(1, 'login'))
+        self.assertIsNone(pending.pop(1))
+        self.assertEqual(pending.latency['login'].as_dict()['count'], 1)
+
+    def test_unknown_and_foreign_ids(self):
+        pending = PendingRequests()
+        self.assertIsNone(pending.pop(7))
+        self.assertIsNone(pending.pop(['not', 'hashable']))
+
+    def test_count_by_method(self):
+        pending = PendingRequests()
+        pending.add(request(1, 'login'))
+        pending.add(request(2))
+        pending.add(request(3))
+        self.assertEqual(pending.count('submit'), 2)
+        self.assertEqual(pending.count('keepalived'), 0)
+
+    def test_expired_by_method_deadline(self):
+        pending = PendingRequests({'submit': 0}, default_deadline=60)
+        pending.add(request(1, 'login'))
+        pending.add(request(2))
+        self.assertEqual(pending.expired(), [request(2)])
+        self.assertEqual(pending.timeouts, {'submit': 1})
+        self.assertEqual(pending.count('login'), 1)
+
+    def test_oldest_evicted_when_full(self):
+        pending = PendingRequests(max_size=2)
+        for i in range(3):
+            pending.add(request(i))
+        self.assertEqual(pending.evicted, 1)
+        self.assertIsNone(pending.pop(0))
+        self.assertEqual(pending.as_dict()['pending'], 2)
+
+    def test_clear(self):
+        pending = PendingRequests()
+        pending.add(request(1))
+        pending.add(request(2))
+        self.assertEqual(pending.clear(), [request(1), request(2)])
+        self.assertEqual(pending.count('submit'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
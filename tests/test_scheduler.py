@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the CPU budget split between pools
+'''
+
+import unittest
+
+from miner.scheduler import allocate
+
+
+class AllocateTest(unittest.TestCase):
+    def test_weights_that_fit_are_kept(self):
+        self.assertEqual(allocate([('a', 2), ('b', 3)], 8), {'a': 2, 'b': 3})
+
+    def test_shares_are_proportional(self):
+        self.assertEqual(allocate([('a', 4), ('b', 4)], 4), {'a': 2, 'b': 2})
+        self.assertEqual(allocate([('a', 6), ('b', 2)], 4), {'a': 3, 'b': 1})
+
+    def test_largest_remainders_then_start_order(self):
+        self.assertEqual(allocate([('a', 3), ('b', 3), ('c', 3)], 4), {'a': 2, 'b': 1, 'c': 1})
+        self.assertEqual(allocate([('a', 1), ('b', 5)], 3), {'a': 1, 'b': 2})
+
+    def test_every_pool_gets_a_worker_while_the_budget_goes(self):
+        self.assertEqual(allocate([('a', 10), ('b', 1)], 4), {'a': 3, 'b': 1})
+
+    def test_more_pools_than_workers(self):
+        counts = allocate([('a', 1), ('b', 1), ('c', 1)], 2)
+        self.assertEqual(counts, {'a': 1, 'b': 1, 'c': 0})
+
+    def test_zero_and_negative_weights_get_nothing(self):
+        self.assertEqual(allocate([('a', 0), ('b', 4)], 2), {'a': 0, 'b': 2})
+        self.assertEqual(allocate([('a', -1), ('b', 1)], 2), {'a': 0, 'b': 1})
+
+    def test_never_more_than_the_budget(self):
+        for budget in range(1, 9):
+            counts = allocate([('a', 5), ('b', 3), ('c', 1), ('d', 7)], budget)
+            self.assertEqual(sum(counts.values()), budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
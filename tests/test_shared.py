@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## Copyright (c) 2017, The Sumokoin Project (www.sumokoin.org)
+'''
+Tests of the nonce claims of the shared job slot
+'''
+
+import unittest
+
+from miner.shared import JobSlot
+
+BLOB = '\0'*76
+
+
+class JobSlotClaimTest(unittest.TestCase):
+    def setUp(self):
+        self.slot = JobSlot()
+
+    def publish(self, job_id='j', start=0, nonce=0x100, nonce_end=0x1ff):
+        self.slot.publish(job_id, 'login', BLOB, 1000, nonce, 1, False, nonce_end, start)
+        return self.slot.read()[0]
+
+    def test_no_job(self):
+        self.assertIsNone(self.slot.claim(self.slot.version, 8))
+
+    def test_claims_follow_each_other(self):
+        version = self.publish()
+        self.assertEqual(self.slot.claim(version, 8), (0x100, 8))
+        self.assertEqual(self.slot.claim(version, 8), (0x108, 8))
+
+    def test_claims_stop_at_the_end_of_the_range(self):
+        version = self.publish(start=0xf0)
+        self.assertEqual(self.slot.claim(version, 0x20), (0x1f0, 0x10))
+
+    def test_claims_wrap_around_then_run_out(self):
+        version = self.publish(start=0xf0)
+        self.assertEqual(self.slot.claim(version, 0x10), (0x1f0, 0x10))
+        self.assertEqual(self.slot.claim(version, 0x1000), (0x100, 0xf0))
+        self.assertIsNone(self.slot.claim(version, 1))
+
+    def test_claim_for_a_replaced_job(self):
+        old = self.publish('a')
+        new = self.publish('b')
+        self.assertIsNone(self.slot.claim(old, 8))
+        self.assertEqual(self.slot.claim(new, 8), (0x100, 8))
+
+    def test_publishing_the_same_job_again_keeps_the_claims(self):
+        version = self.publish('a')
+        self.slot.claim(version, 8)
+        version = self.publish('a')
+        self.assertEqual(self.slot.claim(version, 8), (0x108, 8))
+
+    def test_invalidated_job(self):
+        self.publish()
+        self.slot.invalidate()
+        self.assertIsNone(self.slot.claim(self.slot.version, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
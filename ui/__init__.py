@@ -23,6 +23,7 @@ from PySide.QtCore import QTimer
 from settings import APP_NAME, USER_AGENT, VERSION
 from utils.logger import log, LEVEL_DEBUG, LEVEL_ERROR, LEVEL_INFO
 from miner.miner import MinerWork, MinerRPC, human_readable_hashrate
+from miner.shared import HashRateMeter
 
 from utils.notify import Notify
 MSG_TYPE_INFO = 1
@@ -187,7 +188,7 @@ class AddPoolDialog(QDialog):
         layout.addWidget(self.view)
         self.setLayout(layout)
         
-        self.setFixedSize(qt_core.QSize(660,480))
+        self.setFixedSize(qt_core.QSize(660,620))
         self.center()
         
         self.view.loadFinished.connect(self._load_finished)
@@ -368,20 +369,16 @@ class WebUI(BaseWebUI):
         _sum_hashrates = 0.
         for pool_info in self.hub.pools.all_pools:
             _json = {'pool_id': pool_info['id']}
-            hash_rates = pool_info['hash_report'] if 'hash_report' in pool_info else {}
-            if len(hash_rates) > 0:
-                _hash_rates = dict(hash_rates)
-                _total_hash_rate = reduce(lambda x, y: x+y, [_hash_rates[k] for k in _hash_rates])
+            if 'hash_report' in pool_info:
+                # hashrate from deltas of the workers' hash counters since last update
+                if not 'hash_meter' in pool_info:
+                    pool_info['hash_meter'] = HashRateMeter(pool_info['hash_report'])
+                _total_hash_rate = pool_info['hash_meter'].update()
                 _json['hash_rate'] = _total_hash_rate
                 _sum_hashrates += _total_hash_rate
                 pool_info['total_hashrate'] =  _total_hash_rate
             else:
                 _json['hash_rate'] = 0.0
-            # reset hashrate
-            if 'hash_report' in pool_info and 'thr_list' in pool_info:
-                if pool_info['thr_list'] is not None:
-                    for thr in pool_info['thr_list']:
-                        pool_info['hash_report'].update({'%d' % thr._thr_id: 0.0})
              
             
             work_report = pool_info['work_report'] if 'work_report' in pool_info else {}
@@ -445,18 +442,18 @@ class WebUI(BaseWebUI):
     
     def _handleAboutToQuit(self):
         log("%s is about to quit..." % APP_NAME, LEVEL_INFO)
+        # workers are going down on purpose now
+        self.hub.supervisor.shutdown()
+        mining_pools = []
         for pool_info in self.hub.pools.all_pools:
             if not 'thr_list' in pool_info or pool_info['thr_list'] is None:
                 pool_info['is_mining'] = False
             else:
-                # shut down threads
-                for thr in pool_info['thr_list']:
-                    thr.shutdown()
-                    thr.join()
-                # shut down RPC client
-                pool_info['rpc'].shutdown()
-                pool_info['rpc'].join()
+                mining_pools.append(pool_info)
                 pool_info['is_mining'] = True # save mining status to resume on next start
+        # shut down all workers and RPC clients at once
+        self.hub.stop_pools(mining_pools)
+        self.hub.worker_pool.shutdown()
         
         if manager: manager.shutdown()
         # save pool list